@@ -0,0 +1,165 @@
+import inspect
+import io
+import os
+
+import numpy as np
+import torch
+
+from TractOracleNet.models.inference import load_slim
+from TractOracleNet.models.quantization import quantize_model
+from TractOracleNet.models.utils import get_model
+
+"""
+Inference backends. Besides PyTorch, models can be exported to ONNX and
+run with ONNX Runtime, which has less overhead than PyTorch on the CPU.
+ONNX support is optional and requires the `onnx` and `onnxruntime`
+packages.
+"""
+
+BACKENDS = ['torch', 'onnxruntime']
+
+# Dtypes of the features and of the autocast region of each precision
+PRECISIONS = {'fp32': torch.float32, 'bf16': torch.bfloat16,
+              'fp16': torch.float16}
+
+
+def export_onnx(model, filename=None, opset=17, nb_points=128):
+    """ Export a model to ONNX, with a dynamic batch axis.
+
+    Parameters
+    ----------
+    model : TransformerOracle
+        Model to export.
+    filename : str, optional
+        Output .onnx file. The model is returned as bytes if not given.
+    opset : int, optional
+        ONNX opset version.
+    nb_points : int, optional
+        Number of points streamlines are resampled to.
+
+    Returns
+    -------
+    model_bytes : bytes or None
+        Serialized model, if `filename` is not given.
+    """
+    model = model.to('cpu').eval()
+    dummy = torch.zeros((2, nb_points - 1, 3))
+
+    # Not exported under no_grad, which would trace the fused encoder
+    # layers of the inference fast path that ONNX does not support
+    f = io.BytesIO() if filename is None else filename
+    # The TorchScript exporter is only selected explicitly since torch 2.5
+    kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(
+        torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        model, (dummy,), f, input_names=['dirs'],
+        output_names=['scores'], opset_version=opset,
+        dynamic_axes={'dirs': {0: 'batch'}, 'scores': {0: 'batch'}},
+        **kwargs)
+
+    return f.getvalue() if filename is None else None
+
+
+def _load_torch_model(checkpoint_file):
+    """ Load a checkpoint (.ckpt), or a slim model (.pt) saved by
+    export_slim.py. """
+    if os.path.splitext(checkpoint_file)[-1] == '.pt':
+        return load_slim(checkpoint_file)
+    return get_model(checkpoint_file)
+
+
+class OnnxModel():
+    """ Model exported to ONNX, run with ONNX Runtime. Called like the
+    PyTorch model, on tensors of streamline features.
+    """
+
+    def __init__(self, model, num_threads=None, providers=None):
+        """
+        Parameters
+        ----------
+        model : str or bytes
+            Exported model, as a .onnx file or serialized.
+        num_threads : int, optional
+            Number of threads used by ONNX Runtime. Defaults to the
+            number of threads used by PyTorch.
+        providers : list of str, optional
+            ONNX Runtime execution providers. Defaults to the CPU.
+        """
+        import onnxruntime as ort
+
+        if not isinstance(model, bytes):
+            with open(model, 'rb') as f:
+                model = f.read()
+        self.model_bytes = model
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = \
+            num_threads or torch.get_num_threads()
+        self.session = ort.InferenceSession(
+            model, options, providers=providers or ['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        """ Score streamlines.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, 3)
+            Directions between the points of the streamlines.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Scores of the streamlines, on the CPU.
+        """
+        x = x.detach().cpu().float().numpy()
+        y, = self.session.run(None, {self.input_name: x})
+        return torch.from_numpy(np.asarray(y))
+
+    def eval(self):
+        return self
+
+    def state_dict(self):
+        """ The serialized model, to identify it like the weights of a
+        PyTorch model. """
+        return {'onnx': torch.frombuffer(
+            bytearray(self.model_bytes), dtype=torch.uint8)}
+
+
+def load_model(checkpoint_file, backend='torch', quantize=None,
+               compile=False, batch_size=None):
+    """ Load a model for inference.
+
+    Parameters
+    ----------
+    checkpoint_file : str
+        Checkpoint (.ckpt), slim model (.pt), or exported .onnx file for
+        the onnxruntime backend.
+    backend : str, optional
+        One of `BACKENDS`. With onnxruntime, checkpoints are exported to
+        ONNX in memory.
+    quantize : str, optional
+        Quantize the model to this dtype (see `quantize_model`). Only
+        supported by the torch backend.
+    compile : bool, optional
+        Compile the model with `torch.compile`, for batches padded to
+        `batch_size` streamlines. Only supported by the torch backend.
+    batch_size : int, optional
+        Number of streamlines of the compiled batches.
+
+    Returns
+    -------
+    model : InferenceOracle, TransformerOracle, SlimOracle or OnnxModel
+        Model, in eval mode.
+    """
+    if backend == 'onnxruntime':
+        if os.path.splitext(checkpoint_file)[-1] == '.onnx':
+            return OnnxModel(checkpoint_file)
+        return OnnxModel(export_onnx(_load_torch_model(checkpoint_file)))
+
+    if os.path.splitext(checkpoint_file)[-1] == '.onnx':
+        raise ValueError('ONNX models require the onnxruntime backend.')
+    model = _load_torch_model(checkpoint_file)
+    if quantize and getattr(model, 'quantization', None) is None:
+        model = quantize_model(model, quantize)
+    return model.for_inference(batch_size if compile else None, compile)
@@ -0,0 +1,204 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+import torch
+
+"""
+Persistent cache of streamline scores, so that scoring a streamline again
+with the same model never runs the model. Streamlines are identified by a
+hash of their resampled geometry, i.e. the input features of the model,
+salted with a hash of the weights of the model.
+"""
+
+
+def weights_hash(model):
+    """ Hash the weights of a model.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Model.
+
+    Returns
+    -------
+    digest : bytes
+        SHA-256 digest of the class and the state dict of the model.
+    """
+    h = hashlib.sha256(type(model).__name__.encode('utf-8'))
+    for name, tensor in sorted(model.state_dict().items()):
+        h.update(name.encode('utf-8'))
+        if isinstance(tensor, torch.Tensor) and not tensor.is_quantized:
+            h.update(tensor.detach().cpu().contiguous().reshape(-1)
+                     .view(torch.uint8).numpy().tobytes())
+        else:
+            # Quantized weights and their parameters are serialized
+            buffer = io.BytesIO()
+            torch.save(tensor, buffer)
+            h.update(buffer.getvalue())
+    return h.digest()
+
+
+class ScoreCache():
+    """ Fixed-size table of scores backed by a memory-mapped .npy file.
+
+    The table is set-associative: a streamline can only be stored in the
+    `ways` slots of the bucket given by its key, and the least recently
+    used slot of the bucket is evicted when it is full. Lookups and
+    insertions are thus vectorized and the table never has to be indexed
+    in memory, whatever its size. The table is only meant to be used by
+    one process at a time.
+    """
+
+    DTYPE = np.dtype(
+        [('key', '<u8', (2,)), ('score', '<f4'), ('used', '<u8')])
+
+    def __init__(self, filename, model, max_entries=10000000, ways=8):
+        """
+        Parameters
+        ----------
+        filename : str
+            Backing .npy file, created if it does not exist. An existing
+            file of another size is cleared.
+        model : torch.nn.Module
+            Model whose scores are cached.
+        max_entries : int, optional
+            Maximum number of scores kept.
+        ways : int, optional
+            Number of slots per bucket.
+        """
+        self.filename = filename
+        self.salt = weights_hash(model)
+        self.hits = 0
+        self.lookups = 0
+
+        shape = (max(1, -(-max_entries // ways)), ways)
+        table = None
+        if os.path.exists(filename):
+            table = np.load(filename, mmap_mode='r+')
+            if table.dtype != self.DTYPE:
+                raise ValueError(
+                    '{} is not a score cache.'.format(filename))
+            if table.shape != shape:
+                del table
+                table = None
+
+        if table is None:
+            table = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=self.DTYPE, shape=shape)
+
+        self.table = table
+        self.tick = int(self.table['used'].max(initial=0)) + 1
+
+    def keys(self, data):
+        """ Compute the keys of streamlines.
+
+        Parameters
+        ----------
+        data : np.ndarray or torch.Tensor (N, ...)
+            Input features of the model for each streamline.
+
+        Returns
+        -------
+        keys : np.ndarray (N, 2)
+            128-bit key of each streamline.
+        """
+        if isinstance(data, torch.Tensor):
+            data = data.detach().cpu().numpy()
+        data = np.ascontiguousarray(data, dtype=np.float32).reshape(
+            len(data), -1)
+        digests = b''.join(
+            hashlib.blake2b(row, digest_size=16, key=self.salt).digest()
+            for row in data)
+        return np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+
+    def _find(self, keys):
+        """ Find the bucket and slot of streamlines.
+
+        Returns
+        -------
+        buckets : np.ndarray (N,)
+            Bucket of each streamline.
+        found : np.ndarray (N,)
+            Whether each streamline is in the table.
+        ways : np.ndarray (N,)
+            Slot of each streamline in its bucket, if found.
+        """
+        buckets = keys[:, 0] % len(self.table)
+        rows = self.table[buckets]
+        match = np.all(rows['key'] == keys[:, None], axis=-1) & \
+            (rows['used'] > 0)
+        return buckets, match.any(axis=1), match.argmax(axis=1)
+
+    def get(self, keys):
+        """ Look up scores.
+
+        Parameters
+        ----------
+        keys : np.ndarray (N, 2)
+            Keys of the streamlines.
+
+        Returns
+        -------
+        scores : np.ndarray (N,)
+            Cached scores, 0 for missing streamlines.
+        hits : np.ndarray (N,)
+            Whether each score was cached.
+        """
+        buckets, hits, ways = self._find(keys)
+        buckets, ways = buckets[hits], ways[hits]
+
+        scores = np.zeros(len(keys))
+        scores[hits] = self.table['score'][buckets, ways]
+        self.table['used'][buckets, ways] = self.tick
+        self.tick += 1
+
+        self.hits += int(np.count_nonzero(hits))
+        self.lookups += len(keys)
+
+        return scores, hits
+
+    def put(self, keys, scores):
+        """ Add scores to the cache.
+
+        Parameters
+        ----------
+        keys : np.ndarray (N, 2)
+            Keys of the streamlines.
+        scores : np.ndarray (N,)
+            Scores of the streamlines.
+        """
+        keys, first = np.unique(keys, axis=0, return_index=True)
+        scores = np.asarray(scores)[first]
+        buckets, found, _ = self._find(keys)
+        keys, scores, buckets = keys[~found], scores[~found], buckets[~found]
+
+        # The i-th new streamline of a bucket replaces the i-th least
+        # recently used slot of the bucket
+        order = np.argsort(buckets, kind='stable')
+        keys, scores, buckets = keys[order], scores[order], buckets[order]
+        group_start = np.searchsorted(buckets, buckets)
+        rank = np.arange(len(buckets)) - group_start
+
+        nb_ways = self.table.shape[1]
+        fits = rank < nb_ways
+        keys, scores, buckets, rank = \
+            keys[fits], scores[fits], buckets[fits], rank[fits]
+        lru = np.argsort(self.table['used'][buckets], axis=1, kind='stable')
+        ways = lru[np.arange(len(buckets)), rank]
+
+        entries = np.zeros(len(keys), dtype=self.DTYPE)
+        entries['key'] = keys
+        entries['score'] = scores
+        entries['used'] = self.tick
+        self.table[buckets, ways] = entries
+        self.tick += 1
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.lookups, 1)
+
+    def close(self):
+        """ Write the table to disk. """
+        self.table.flush()
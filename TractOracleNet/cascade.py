@@ -0,0 +1,249 @@
+import json
+
+import numpy as np
+import torch
+
+"""
+Cheap geometric pre-filter run ahead of the model. Geometric features are
+computed on the directions between the points of the resampled
+streamlines, i.e. the input features of the model, so that they are the
+same whether they are computed on a tractogram or on the streamlines of
+an HDF5 dataset. Streamlines which are obviously implausible, or
+obviously plausible, according to rules calibrated on a dataset are
+decided without running the model.
+"""
+
+FEATURES = ['length', 'straightness', 'mean_angle', 'max_angle',
+            'max_curvature']
+
+
+def geometric_features(dirs):
+    """ Compute geometric features of resampled streamlines.
+
+    Parameters
+    ----------
+    dirs : np.ndarray or torch.Tensor (N, L, 3)
+        Directions between the points of the resampled streamlines.
+
+    Returns
+    -------
+    features : np.ndarray (N, len(FEATURES))
+        Length, ratio of the distance between the endpoints to the length,
+        mean and maximum angle between consecutive directions (in radians)
+        and maximum curvature (angle per unit of length) of each
+        streamline.
+    """
+    if isinstance(dirs, torch.Tensor):
+        dirs = dirs.detach().cpu().float().numpy()
+    dirs = np.asarray(dirs, dtype=np.float32)
+
+    norms = np.linalg.norm(dirs, axis=-1)
+    length = norms.sum(axis=1)
+    straightness = np.divide(
+        np.linalg.norm(dirs.sum(axis=1), axis=-1), length,
+        out=np.zeros_like(length), where=length > 0)
+
+    # Angles between consecutive directions, 0 for null directions
+    dots = np.einsum('nld,nld->nl', dirs[:, 1:], dirs[:, :-1])
+    products = norms[:, 1:] * norms[:, :-1]
+    cosines = np.divide(dots, products, out=np.ones_like(dots),
+                        where=products > 0)
+    angles = np.arccos(np.clip(cosines, -1., 1.))
+
+    mean_angle = angles.sum(axis=1) / max(angles.shape[1], 1)
+    max_angle = angles.max(axis=1, initial=0.)
+
+    # Points of resampled streamlines are equally spaced
+    step = length / max(dirs.shape[1], 1)
+    max_curvature = np.divide(max_angle, step, out=np.zeros_like(step),
+                              where=step > 0)
+
+    return np.stack((length, straightness, mean_angle, max_angle,
+                     max_curvature), axis=1)
+
+
+def _loosest_cut(values, positive, tolerance, min_support):
+    """ Find the loosest cut such that the streamlines below it are
+    positive with a purity of at least 1 - `tolerance`.
+
+    Parameters
+    ----------
+    values : np.ndarray (N,)
+        Feature of each streamline.
+    positive : np.ndarray (N,)
+        Whether each streamline has the decision of the rule.
+    tolerance : float
+        Maximum fraction of wrong decisions below the cut.
+    min_support : int
+        Minimum number of streamlines below the cut.
+
+    Returns
+    -------
+    cut : float or None
+        Cut, None if no cut is pure and supported enough.
+    purity : float
+        Fraction of positive streamlines below the cut.
+    support : int
+        Number of streamlines below the cut.
+    """
+    order = np.argsort(values, kind='stable')
+    values, positive = values[order], positive[order]
+
+    # Only cut between distinct values
+    last = np.r_[values[1:] != values[:-1], True]
+    count = np.arange(1, len(values) + 1)[last]
+    purity = np.cumsum(positive)[last] / count
+
+    valid = np.flatnonzero((purity >= 1. - tolerance) &
+                           (count >= min_support))
+    if len(valid) == 0:
+        return None, 0., 0
+    k = valid[-1]
+    return float(values[last][k]), float(purity[k]), int(count[k])
+
+
+class GeometricCascade():
+    """ Rules deciding streamlines from their geometric features. Each rule
+    rejects or accepts the streamlines whose feature is below or above a
+    cut. Streamlines matched by rules of both decisions, or by no rule,
+    are ambiguous and left to the model.
+    """
+
+    def __init__(self, rules):
+        """
+        Parameters
+        ----------
+        rules : list of dict
+            Rules, each with a `feature` (one of `FEATURES`), a `side`
+            ('below' or 'above'), a `cut` and a `decision` ('reject' or
+            'accept').
+        """
+        self.rules = rules
+        self.nb_rejected = 0
+        self.nb_accepted = 0
+        self.nb_seen = 0
+
+    @classmethod
+    def calibrate(cls, features, scores, threshold=0.5, tolerance=0.01,
+                  min_support=1000):
+        """ Calibrate rules on streamlines with known scores. For each
+        feature, side and decision, the loosest cut whose decisions are
+        right for at least 1 - `tolerance` of the streamlines is kept.
+
+        Parameters
+        ----------
+        features : np.ndarray (N, len(FEATURES))
+            Geometric features of the streamlines.
+        scores : np.ndarray (N,)
+            Target scores of the streamlines.
+        threshold : float, optional
+            Streamlines scored above it are plausible.
+        tolerance : float, optional
+            Maximum fraction of wrong decisions of each rule.
+        min_support : int, optional
+            Minimum number of streamlines decided by each rule.
+
+        Returns
+        -------
+        cascade : GeometricCascade
+            Calibrated cascade.
+        """
+        plausible = np.asarray(scores) > threshold
+
+        rules = []
+        for f, feature in enumerate(FEATURES):
+            for side, sign in (('below', 1.), ('above', -1.)):
+                for decision, positive in (('reject', ~plausible),
+                                           ('accept', plausible)):
+                    cut, purity, support = _loosest_cut(
+                        sign * features[:, f], positive, tolerance,
+                        min_support)
+                    if cut is not None:
+                        rules.append({
+                            'feature': feature, 'side': side,
+                            'cut': sign * cut, 'decision': decision,
+                            'purity': purity, 'support': support})
+
+        return cls(rules)
+
+    def decide_features(self, features):
+        """ Decide the streamlines which are not ambiguous from their
+        geometric features.
+
+        Parameters
+        ----------
+        features : np.ndarray (N, len(FEATURES))
+            Geometric features of the streamlines.
+
+        Returns
+        -------
+        decided : np.ndarray (N,)
+            Whether each streamline is decided by the cascade.
+        scores : np.ndarray (N,)
+            Score of the decided streamlines, 0 if rejected and 1 if
+            accepted.
+        """
+        matched = {'reject': np.zeros(len(features), dtype=bool),
+                   'accept': np.zeros(len(features), dtype=bool)}
+        for rule in self.rules:
+            values = features[:, FEATURES.index(rule['feature'])]
+            if rule['side'] == 'below':
+                matched[rule['decision']] |= values <= rule['cut']
+            else:
+                matched[rule['decision']] |= values >= rule['cut']
+
+        rejected = matched['reject'] & ~matched['accept']
+        accepted = matched['accept'] & ~matched['reject']
+
+        return rejected | accepted, accepted.astype(float)
+
+    def decide(self, dirs):
+        """ Decide the streamlines which are not ambiguous, and count them.
+
+        Parameters
+        ----------
+        dirs : np.ndarray or torch.Tensor (N, L, 3)
+            Directions between the points of the resampled streamlines.
+
+        Returns
+        -------
+        decided : np.ndarray (N,)
+            Whether each streamline is decided by the cascade.
+        scores : np.ndarray (N,)
+            Score of the decided streamlines, 0 if rejected and 1 if
+            accepted.
+        """
+        decided, scores = self.decide_features(geometric_features(dirs))
+
+        self.nb_accepted += int(np.count_nonzero(decided & (scores > 0)))
+        self.nb_rejected += int(np.count_nonzero(decided & (scores == 0)))
+        self.nb_seen += len(decided)
+
+        return decided, scores
+
+    @property
+    def nb_decided(self):
+        return self.nb_rejected + self.nb_accepted
+
+    @property
+    def skip_rate(self):
+        """ Fraction of the streamlines decided without the model. """
+        return self.nb_decided / max(self.nb_seen, 1)
+
+    def save(self, filename):
+        """ Save the rules to a JSON file. """
+        with open(filename, 'w') as f:
+            json.dump({'features': FEATURES, 'rules': self.rules}, f,
+                      indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load rules saved with `save`. """
+        with open(filename, 'r') as f:
+            rules = json.load(f)['rules']
+        for rule in rules:
+            if rule['feature'] not in FEATURES:
+                raise ValueError(
+                    'Unknown feature {} in {}.'.format(
+                        rule['feature'], filename))
+        return cls(rules)
@@ -1,10 +1,11 @@
 import h5py
 import numpy as np
 
-from dipy.tracking.streamline import set_number_of_points
 from nibabel.streamlines.array_sequence import ArraySequence
 from torch.utils.data import Dataset
 
+from TractOracleNet.resampling import resample_streamlines
+
 
 class StreamlineBatchDataset(Dataset):
     """ Dataset for loading streamlines from hdf5 files. The streamlines
@@ -146,12 +147,14 @@ class StreamlineBatchDataset(Dataset):
                 old_length = streamlines.shape[1]
                 score *= new_lengths / old_length
 
-            # Need to convert the list of arrays to an ArraySequence
-            # to use set_number_of_points
-            array_seq = ArraySequence([streamlines[i, :new_lengths[i]]
-                                       for i in range(len(new_lengths))])
-            streamlines = set_number_of_points(array_seq, 128)
-            streamlines = np.asarray(streamlines)
+            # View the cut streamlines as an ArraySequence over the
+            # batch, without copying them
+            N, L, D = streamlines.shape
+            array_seq = ArraySequence()
+            array_seq._data = streamlines.reshape(-1, D)
+            array_seq._offsets = np.arange(N) * L
+            array_seq._lengths = new_lengths
+            streamlines = resample_streamlines(array_seq, 128)
 
         # Add noise to streamline points for robustness
         if self.noise > 0.0:
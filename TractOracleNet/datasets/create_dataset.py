@@ -6,13 +6,17 @@ import json
 import numpy as np
 
 from argparse import RawTextHelpFormatter
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, wait)
 from glob import glob
 from os.path import expanduser
 from tqdm import tqdm
 
 from dipy.io.streamline import load_tractogram
-from dipy.tracking.streamline import set_number_of_points
-from nibabel.streamlines import load
+from nibabel.streamlines import Field, load
+
+from TractOracleNet.resampling import resample_streamlines
 
 """
 Script to process multiple subjects into a single .hdf5 file.
@@ -23,7 +27,8 @@ def generate_dataset(
     config_file: str,
     dataset_file: str,
     nb_points: int = 128,
-    max_streamline_subject: int = -1
+    max_streamline_subject: int = -1,
+    workers: int = 0
 ) -> None:
     """ Generate a dataset from a configuration file and save it to disk.
 
@@ -39,6 +44,9 @@ def generate_dataset(
     max_streamline_subject: int, optional
         Maximum number of streamlines to use per subject. Default is -1,
         meaning all streamlines are used.
+    workers: int, optional
+        Number of processes loading and resampling the bundles, see
+        `process_subjects`.
     """
     # Initialize database
     with h5py.File(dataset_file, 'w') as hdf_file:
@@ -50,13 +58,14 @@ def generate_dataset(
             config = json.load(conf)
 
             add_subjects_to_hdf5(
-                config, hdf_file, nb_points, max_streamline_subject)
+                config, hdf_file, nb_points, max_streamline_subject,
+                workers)
 
     print("Saved dataset : {}".format(dataset_file))
 
 
 def add_subjects_to_hdf5(
-    config, hdf_file, nb_points=128, max_streamline_subject=-1
+    config, hdf_file, nb_points=128, max_streamline_subject=-1, workers=0
 ):
     """ Process the subjects and add them to the hdf5 file.
 
@@ -71,6 +80,9 @@ def add_subjects_to_hdf5(
     max_streamline_subject: int, optional
         Maximum number of streamlines to use per subject. Default is -1,
         meaning all streamlines are used.
+    workers: int, optional
+        Number of processes loading and resampling the bundles, see
+        `process_subjects`.
     """
     sub_files = []
     for subject_id in config:
@@ -83,17 +95,24 @@ def add_subjects_to_hdf5(
 
         sub_files.append((reference_anat, streamlines_files_list))
 
-    process_subjects(sub_files, hdf_file, nb_points, max_streamline_subject)
+    process_subjects(
+        sub_files, hdf_file, nb_points, max_streamline_subject, workers)
 
 
 def process_subjects(
-    sub_files, hdf_subject, nb_points, max_streamline_subject
+    sub_files, hdf_subject, nb_points, max_streamline_subject, workers=0
 ):
     """ Process the subjects and add them to the hdf5 file. First,
-    the size of the dataset is computed, then the streamlines are
-    loaded and assigned a random index so that they are spread
-    across the dataset. Then, the streamlines are added to the
-    dataset.
+    the size of the dataset is computed, then the streamlines of each
+    bundle are selected and assigned a random index so that they are
+    spread across the dataset. Then, the streamlines are loaded,
+    resampled and added to the dataset.
+
+    With `workers`, the bundles are loaded and resampled by a pool of
+    processes while this process writes the resampled bundles to their
+    preassigned indices, so the dataset is the same as without workers.
+    At most twice as many bundles as workers are in flight at any time,
+    which bounds memory usage.
 
     Parameters
     ----------
@@ -107,6 +126,9 @@ def process_subjects(
     max_streamline_subject: int, optional
         Maximum number of streamlines to use per subject. Default is -1,
         meaning all streamlines are used.
+    workers: int, optional
+        Number of processes loading and resampling the bundles. If 0,
+        bundles are processed one after the other in this process.
     """
 
     total = 0
@@ -114,11 +136,14 @@ def process_subjects(
     max_strml = max_streamline_subject
 
     print('Computing size of dataset.')
+    bundles = []
     for anat, strm_files in tqdm(sub_files):
         streamlines_files = glob(expanduser(strm_files[0]))
         for bundle in streamlines_files:
-            len_p = load(expanduser(bundle), expanduser(anat), lazy_load=True)
-            total += min(max_strml, len(len_p.streamlines))
+            nb_streamlines = count_streamlines(expanduser(bundle))
+            bundles.append((bundle, expanduser(anat), nb_streamlines))
+            total += nb_streamlines if max_strml < 0 else \
+                min(max_strml, nb_streamlines)
 
     print('Dataset will have {} streamlines'.format(total))
     print('Writing streamlines to dataset.')
@@ -127,23 +152,104 @@ def process_subjects(
     idices = np.arange(total)
     np.random.shuffle(idices)
 
+    # Select the streamlines of each bundle and the indices to use,
+    # before any bundle is loaded
+    tasks = []
+    for bundle, anat, nb_streamlines in bundles:
+        # Randomize the order of the streamlines
+        ps_idices = np.random.choice(
+            nb_streamlines, nb_streamlines if max_strml < 0 else
+            min(max_strml, nb_streamlines), replace=False)
+        # Get the indices to use
+        idx = idices[:len(ps_idices)]
+        tasks.append((bundle, anat, ps_idices, nb_points, idx))
+        # Remove the indices that have been used
+        idices = idices[len(ps_idices):]
+
     # Add the streamlines to the dataset
-    for anat, strm_files in tqdm(sub_files):
-        streamlines_files = glob(expanduser(strm_files[0]))
-        for bundle in streamlines_files:
-            # Load the streamlines
-            ps = load_streamlines(bundle, expanduser(anat))
-            # Randomize the order of the streamlines
-            ps_idices = np.random.choice(len(ps), min(max_strml, len(ps)),
-                                         replace=False)
-            print('Processing {}'.format(bundle))
-            # Get the indices to use
-            idx = idices[:len(ps_idices)]
-            # Add the streamlines to the dataset
-            add_streamlines_to_hdf5(
-                hdf_subject, ps[ps_idices], nb_points, total, idx)
-            # Remove the indices that have been used
-            idices = idices[len(ps_idices):]
+    for bundle, streamlines, scores, idx in tqdm(
+            _iter_bundles(tasks, workers), total=len(tasks)):
+        tqdm.write('Processing {}'.format(bundle))
+        write_streamlines_to_hdf5(
+            hdf_subject, streamlines, scores, total, idx)
+
+
+def load_bundle(bundle, anat, ps_idices, nb_points, idx):
+    """ Load and resample the selected streamlines of a bundle.
+
+    Parameters
+    ----------
+    bundle: str
+        Path to the file containing the streamlines.
+    anat: str
+        Path to the reference anatomy file.
+    ps_idices: np.ndarray
+        Indices of the streamlines of the bundle to keep.
+    nb_points: int
+        Number of points to resample the streamlines to.
+    idx: np.ndarray
+        Positions of the streamlines in the dataset, returned as is.
+
+    Returns
+    -------
+    bundle: str
+        Path to the file containing the streamlines.
+    streamlines: np.ndarray
+        Array of shape (N, nb_points, 3) of the resampled streamlines.
+    scores: np.ndarray
+        Array of shape (N,) of the scores of the streamlines.
+    idx: np.ndarray
+        Positions of the streamlines in the dataset.
+    """
+
+    ps = load_streamlines(bundle, anat)[ps_idices]
+    scores = np.asarray(ps.data_per_streamline['score']).squeeze(-1)
+    streamlines = resample_streamlines(ps.streamlines, nb_points)
+
+    return bundle, streamlines.astype(np.float32), scores, idx
+
+
+def _iter_bundles(tasks, workers):
+    """ Load the bundles, in the order of the tasks without workers and
+    as they are ready with workers. """
+
+    if workers <= 0:
+        for task in tasks:
+            yield load_bundle(*task)
+        return
+
+    max_pending = 2 * workers
+    tasks = deque(tasks)
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        while tasks or pending:
+            while tasks and len(pending) < max_pending:
+                pending.add(pool.submit(load_bundle, *tasks.popleft()))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def count_streamlines(streamlines_file):
+    """ Read the number of streamlines of a .trk or .tck file from its
+    header, without loading the streamlines. If the header holds no
+    count, or 0 as written by some tools, the streamlines are counted
+    one by one.
+
+    Parameters
+    ----------
+    streamlines_file: str
+        Path to the file containing the streamlines.
+    """
+
+    tractogram = load(streamlines_file, lazy_load=True)
+    header = tractogram.header
+    # TCK headers only hold the count as written by MRtrix
+    count = header.get(Field.NB_STREAMLINES, header.get('count'))
+    if count is not None and int(count) > 0:
+        return int(count)
+
+    return sum(1 for _ in tractogram.streamlines)
 
 
 def load_streamlines(
@@ -170,29 +276,23 @@ def load_streamlines(
     return sft
 
 
-def add_streamlines_to_hdf5(hdf_subject, sft, nb_points, total, idx):
-    """ Add the streamlines to the hdf5 file.
+def write_streamlines_to_hdf5(hdf_subject, streamlines, scores, total, idx):
+    """ Write resampled streamlines to the hdf5 file.
 
     Parameters
     ----------
     hdf_subject: h5py.File
         HDF5 file to save the dataset to.
-    sft: nib.streamlines.tractogram.Tractogram
-        Streamlines to add to the dataset.
-    nb_points: int, optional
-        Number of points to resample the streamlines to
+    streamlines: np.ndarray
+        Array of shape (N, nb_points, 3) of the resampled streamlines.
+    scores: np.ndarray
+        Array of shape (N,) of the scores of the streamlines.
     total: int
         Total number of streamlines in the dataset
     idx: list
         List of positions to store the streamlines
     """
 
-    # Get the scores and the streamlines
-    scores = np.asarray(sft.data_per_streamline['score']).squeeze(-1)
-    # Resample the streamlines
-    streamlines = set_number_of_points(sft.streamlines, nb_points)
-    streamlines = np.asarray(streamlines)
-
     # Create the dataset if it does not exist
     if 'streamlines' not in hdf_subject:
         # Create the group
@@ -201,7 +301,7 @@ def add_streamlines_to_hdf5(hdf_subject, sft, nb_points, total, idx):
         streamlines = np.asarray(streamlines)
         # 'data' will contain the streamlines
         streamlines_group.create_dataset(
-            'data', shape=(total, nb_points, streamlines.shape[-1]))
+            'data', shape=(total, *streamlines.shape[1:]))
         # 'scores' will contain the scores
         streamlines_group.create_dataset('scores', shape=(total))
 
@@ -209,9 +309,12 @@ def add_streamlines_to_hdf5(hdf_subject, sft, nb_points, total, idx):
     data_group = streamlines_group['data']
     scores_group = streamlines_group['scores']
 
-    for i, st, sc in zip(idx, streamlines, scores):
-        data_group[i] = st
-        scores_group[i] = sc
+    # Write in the order of the dataset, which is faster than in a random
+    # order. Writing scattered streamlines one by one is still faster
+    # than with h5py's fancy indexing.
+    for i in np.argsort(idx):
+        data_group[idx[i]] = streamlines[i]
+        scores_group[idx[i]] = scores[i]
 
 
 def parse_args():
@@ -231,9 +334,18 @@ def parse_args():
                         help='Maximum number of streamlines per subject. '
                              'Default is -1, meaning all streamlines are '
                              'used.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of processes loading and resampling '
+                             'the bundles while the main process writes\n'
+                             'them to the dataset. 0 processes the bundles '
+                             'one after the other. Default is '
+                             '[%(default)s].')
 
     arguments = parser.parse_args()
 
+    if arguments.workers < 0:
+        parser.error('--workers cannot be negative.')
+
     return arguments
 
 
@@ -242,9 +354,10 @@ def main():
     args = parse_args()
 
     generate_dataset(config_file=args.config_file,
-                     output=args.output,
+                     dataset_file=args.output,
                      nb_points=args.nb_points,
-                     max_streamline_subject=args.max_streamline_subject)
+                     max_streamline_subject=args.max_streamline_subject,
+                     workers=args.workers)
 
 
 if __name__ == "__main__":
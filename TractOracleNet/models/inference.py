@@ -0,0 +1,307 @@
+import inspect
+import math
+import torch
+
+from torch import nn, Tensor
+from torch.nn import functional as F
+
+"""
+Inference-only models, which do not depend on Lightning or torchmetrics,
+and the slim model format: the hyperparameters and the weights of a
+`TransformerOracle`, without the state of its training, saved so that
+they can be memory-mapped and loaded in a single read.
+"""
+
+# Identifies slim models, bumped when their content changes
+SLIM_FORMAT = 'TractOracleNet-slim'
+SLIM_VERSION = 1
+
+# Parameters and buffers needed to score streamlines
+_SLIM_MODULES = ('cls_token', 'embedding.', 'pos_encoding.', 'bert.', 'head.')
+
+# Memory-mapping, meta tensors and assigning loaded weights to a model all
+# need torch >= 2.1
+_IN_PLACE_LOADING = 'assign' in inspect.signature(
+    nn.Module.load_state_dict).parameters
+
+
+class PositionalEncoding(nn.Module):
+    """ Modified from
+    https://pytorch.org/tutorials/beginner/transformer_tutorial.htm://pytorch.org/tutorials/beginner/transformer_tutorial.html  # noqa E504
+    """
+
+    def __init__(
+        self, d_model: int, dropout: float = 0.1, max_len: int = 5000
+    ):
+        super().__init__()
+        self.dropout = nn.Dropout(p=dropout)
+
+        position = torch.arange(max_len).unsqueeze(1)
+        div_term = torch.exp(torch.arange(0, d_model, 2)
+                             * (-math.log(10000.0) / d_model))
+        pe = torch.zeros(max_len, 1, d_model)
+        pe[:, 0, 0::2] = torch.sin(position * div_term)
+        pe[:, 0, 1::2] = torch.cos(position * div_term)
+        self.register_buffer('pe', pe)
+
+    def forward(self, x: Tensor) -> Tensor:
+        """
+        Arguments:
+            x: Tensor, shape ``[batch_size, seq_len, embedding_dim]``
+        """
+        # The encodings of the positions broadcast over the batch
+        x = x + self.pe[:x.size(1), 0]
+        return self.dropout(x)
+
+
+def patchify(x, patch_size):
+    """ Group consecutive directions of streamlines into patches, the
+    last patch being padded with null directions.
+
+    Parameters
+    ----------
+    x : torch.Tensor (N, L, D)
+        Directions between the points of the streamlines.
+    patch_size : int
+        Number of directions per patch.
+
+    Returns
+    -------
+    x : torch.Tensor (N, ceil(L / patch_size), patch_size * D)
+        Patches of directions.
+    """
+    if patch_size == 1:
+        return x
+    N, L, D = x.shape
+    x = F.pad(x, (0, 0, 0, -L % patch_size))
+    return x.reshape(N, -1, patch_size * D)
+
+
+class InferenceOracle(nn.Module):
+    """ Inference-only version of a `TransformerOracle`, computing the
+    same scores with less work per batch:
+
+    - the embedding of the class token, which does not depend on the
+      input, is computed once,
+    - the scale of the embeddings is folded into the weights of the
+      embedding layer, since ReLU commutes with positive scales,
+    - the positional encodings are stored batch-first, without dropout,
+    - the encoder is always run in eval mode under `torch.inference_mode`,
+      so that it takes the fused fast path of PyTorch.
+
+    With `batch_size`, batches are split and padded to exactly
+    `batch_size` streamlines, so that compiling the model with
+    `torch.compile` only ever sees one shape.
+    """
+
+    def __init__(self, model, batch_size=None, compile=False):
+        """
+        Parameters
+        ----------
+        model : TransformerOracle
+            Trained model. Its encoder and head are shared, not copied.
+        batch_size : int, optional
+            Batches are padded to this number of streamlines.
+        compile : bool, optional
+            Compile the model with `torch.compile`.
+        """
+        super().__init__()
+        model = model.eval()
+        scale = math.sqrt(model.embedding_size)
+        linear = model.embedding[0]
+
+        self.embedding = nn.Linear(
+            linear.in_features, linear.out_features,
+            device=linear.weight.device)
+        with torch.no_grad():
+            self.embedding.weight.copy_(linear.weight * scale)
+            self.embedding.bias.copy_(linear.bias * scale)
+
+            pe = model.pos_encoding.pe[:, 0].clone()
+            cls_embedding = F.relu(self.embedding(model.cls_token)) + pe[0]
+
+        self.register_buffer('cls_embedding', cls_embedding.view(1, 1, -1))
+        self.register_buffer('pe', pe[None, 1:])
+        self.bert = model.bert
+        self.head = model.head
+        self.patch_size = model.patch_size
+
+        self.batch_size = batch_size
+        self.encode = torch.compile(self._encode, dynamic=False) \
+            if compile else self._encode
+
+    def _encode(self, x):
+        """ Score a batch of streamlines, see `forward`. """
+        x = patchify(x, self.patch_size)
+        N, L, D = x.shape
+        h = F.relu(self.embedding(x)) + self.pe[:, :L]
+        h = torch.cat((self.cls_embedding.expand(N, -1, -1), h), dim=1)
+        hidden = self.bert(h)
+        return torch.sigmoid(self.head(hidden[:, 0])).squeeze(-1)
+
+    def forward(self, x):
+        """ Score streamlines.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Directions between the points of the streamlines.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Scores of the streamlines.
+        """
+        with torch.inference_mode():
+            if self.batch_size is None:
+                return self.encode(x)
+
+            scores = []
+            for i in range(0, len(x), self.batch_size):
+                batch = x[i:i + self.batch_size]
+                n = len(batch)
+                if n < self.batch_size:
+                    batch = F.pad(batch, (0, 0, 0, 0, 0, self.batch_size - n))
+                scores.append(self.encode(batch)[:n])
+
+            return torch.cat(scores) if scores else x.new_zeros(0)
+
+
+class SlimOracle(nn.Module):
+    """ Bare version of a `TransformerOracle`, with the same layers and
+    weights but none of its training machinery (loss, metrics, optimizer),
+    built from a slim model by `load_slim`.
+    """
+
+    def __init__(
+        self,
+        input_size,
+        output_size,
+        n_head,
+        n_layers,
+        embedding_size=32,
+        dim_feedforward=2048,
+        patch_size=1
+    ):
+        super().__init__()
+        self.input_size = input_size
+        self.output_size = output_size
+        self.n_head = n_head
+        self.n_layers = n_layers
+        self.embedding_size = embedding_size
+        self.patch_size = patch_size
+
+        self.cls_token = nn.Parameter(torch.empty((3 * patch_size)))
+        self.embedding = nn.Sequential(
+            *(nn.Linear(3 * patch_size, embedding_size),
+              nn.ReLU()))
+        nb_tokens = -(-(input_size // 3) // patch_size)
+        self.pos_encoding = PositionalEncoding(
+            embedding_size, max_len=nb_tokens + 1)
+        layer = nn.TransformerEncoderLayer(
+            embedding_size, n_head, dim_feedforward=dim_feedforward,
+            batch_first=True)
+        self.bert = nn.TransformerEncoder(layer, n_layers)
+        self.head = nn.Linear(embedding_size, output_size)
+
+    def forward(self, x):
+        """ Score streamlines, as `TransformerOracle.forward`.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Directions between the points of the streamlines.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Scores of the streamlines.
+        """
+        x = patchify(x, self.patch_size)
+        N, L, D = x.shape
+        x = torch.cat((self.cls_token.repeat(N, 1, 1), x), dim=1)
+        x = self.embedding(x) * math.sqrt(self.embedding_size)
+        hidden = self.bert(self.pos_encoding(x))
+        return torch.sigmoid(self.head(hidden[:, 0])).squeeze(-1)
+
+    def for_inference(self, batch_size=None, compile=False):
+        """ Build a copy of the model for inference only, see
+        `TransformerOracle.for_inference`. """
+        if getattr(self, 'quantization', None) is not None:
+            return self.eval()
+        return InferenceOracle(self, batch_size, compile)
+
+
+def save_slim(model, filename):
+    """ Save the hyperparameters and the weights of a model as a slim
+    model, to be loaded with `load_slim`.
+
+    Parameters
+    ----------
+    model : TransformerOracle
+        Model to save. Other architectures and quantized models are not
+        supported.
+    filename : str
+        Output file.
+    """
+    if type(model).__name__ not in ('TransformerOracle', 'SlimOracle') or \
+            getattr(model, 'quantization', None) is not None:
+        raise ValueError('Only non-quantized TransformerOracle models can '
+                         'be saved as slim models.')
+
+    hyper_parameters = {
+        'input_size': model.input_size,
+        'output_size': model.output_size,
+        'n_head': model.n_head,
+        'n_layers': model.n_layers,
+        'embedding_size': model.embedding_size,
+        'dim_feedforward': model.bert.layers[0].linear1.out_features,
+        'patch_size': model.patch_size}
+    state_dict = {k: v.detach().cpu().contiguous()
+                  for k, v in model.state_dict().items()
+                  if k.startswith(_SLIM_MODULES)}
+
+    torch.save({'format': SLIM_FORMAT, 'version': SLIM_VERSION,
+                'hyper_parameters': hyper_parameters,
+                'state_dict': state_dict}, filename)
+
+
+def load_slim(filename, device=None):
+    """ Load a model saved with `save_slim`. The file is read once and
+    memory-mapped, and the weights are used in place rather than copied
+    into a randomly initialized model. Versions of PyTorch older than 2.1
+    read the file into memory and build the model as usual.
+
+    Parameters
+    ----------
+    filename : str
+        Slim model.
+    device : torch.device, optional
+        Device of the model. Defaults to the GPU if available.
+
+    Returns
+    -------
+    model : SlimOracle
+        Model, in eval mode.
+    """
+    checkpoint = torch.load(
+        filename, map_location='cpu', weights_only=True,
+        **({'mmap': True} if _IN_PLACE_LOADING else {}))
+    if checkpoint.get('format') != SLIM_FORMAT or \
+            checkpoint.get('version', 0) > SLIM_VERSION:
+        raise ValueError('{} is not a supported slim model.'.format(
+            filename))
+
+    if _IN_PLACE_LOADING:
+        # Layers are built without allocating nor initializing their
+        # weights
+        with torch.device('meta'):
+            model = SlimOracle(**checkpoint['hyper_parameters'])
+        model.load_state_dict(checkpoint['state_dict'], assign=True)
+    else:
+        model = SlimOracle(**checkpoint['hyper_parameters'])
+        model.load_state_dict(checkpoint['state_dict'])
+
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return model.to(device).eval()
@@ -0,0 +1,108 @@
+import copy
+
+import numpy as np
+import torch
+
+from torch import nn
+
+"""
+Dynamic quantization of the models for CPU inference. The weights of the
+linear layers (embedding, feed-forward layers of the encoder and head) are
+stored as int8 and their activations are quantized on the fly.
+"""
+
+QUANTIZATION_DTYPES = {'int8': torch.qint8}
+
+
+def _skip_fast_path(module, args):
+    """ Forward pre-hook of the encoder layers. Layers with hooks do not
+    take the fused inference fast path, which reads the weights of the
+    linear layers as tensors, which quantized layers do not expose.
+    """
+    return None
+
+
+def quantize_model(model, dtype='int8'):
+    """ Quantize the linear layers of a model.
+
+    Parameters
+    ----------
+    model : TransformerOracle
+        Model to quantize. It is not modified.
+    dtype : str, optional
+        One of `QUANTIZATION_DTYPES`.
+
+    Returns
+    -------
+    model : TransformerOracle
+        Quantized copy of the model, in eval mode, on the CPU.
+    """
+    # The copy is quantized in place, so the model is only copied once
+    quantized = torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(model).to('cpu').eval(), {nn.Linear},
+        dtype=QUANTIZATION_DTYPES[dtype], inplace=True)
+
+    for layer in quantized.bert.layers:
+        layer.register_forward_pre_hook(_skip_fast_path)
+    quantized.quantization = dtype
+
+    return quantized
+
+
+def save_quantized(model, filename):
+    """ Save a quantized model as a checkpoint which can be loaded with
+    `get_model`.
+
+    Parameters
+    ----------
+    model : TransformerOracle
+        Model quantized with `quantize_model`.
+    filename : str
+        Output checkpoint.
+    """
+    # Only plain hyperparameters are saved, e.g. not the class of the loss,
+    # so that the checkpoint can be loaded with weights_only
+    hyper_parameters = {k: v for k, v in model.hparams.items()
+                        if isinstance(v, (bool, int, float, str))}
+    torch.save({
+        'hyper_parameters': hyper_parameters,
+        'quantization': model.quantization,
+        'state_dict': model.state_dict()}, filename)
+
+
+def agreement(scores, reference_scores, threshold):
+    """ Compare scores to reference scores, e.g. those of the quantized
+    and the original model, at a filtering threshold.
+
+    Parameters
+    ----------
+    scores : np.ndarray (N,)
+        Scores to compare.
+    reference_scores : np.ndarray (N,)
+        Reference scores.
+    threshold : float
+        Filtering threshold.
+
+    Returns
+    -------
+    report : dict
+        Number of streamlines, number of streamlines kept by both, number
+        of decisions flipped each way, fraction of matching decisions and
+        absolute deviation of the scores.
+    """
+    kept = scores > threshold
+    reference_kept = reference_scores > threshold
+    deviation = np.abs(scores - reference_scores)
+
+    return {
+        'threshold': threshold,
+        'streamlines': len(scores),
+        'kept': int(np.count_nonzero(kept)),
+        'reference_kept': int(np.count_nonzero(reference_kept)),
+        'flipped_to_kept': int(np.count_nonzero(kept & ~reference_kept)),
+        'flipped_to_rejected': int(np.count_nonzero(~kept & reference_kept)),
+        'agreement': float(np.mean(kept == reference_kept))
+        if len(scores) else 1.,
+        'max_deviation': float(deviation.max(initial=0.)),
+        'mean_deviation': float(deviation.mean()) if len(scores) else 0.,
+    }
@@ -1,8 +1,8 @@
 import math
 import torch
 
-from matplotlib import pyplot as plt
-from torch import nn, Tensor
+from torch import nn
+from torch.nn import functional as F
 from lightning.pytorch import LightningModule
 from torchmetrics.classification import (
     BinaryRecall, BinaryPrecision, BinaryAccuracy, BinaryROC,
@@ -10,36 +10,8 @@ from torchmetrics.classification import (
 from torchmetrics.regression import (
     MeanSquaredError, MeanAbsoluteError)
 
-
-class PositionalEncoding(nn.Module):
-    """ Modified from
-    https://pytorch.org/tutorials/beginner/transformer_tutorial.htm://pytorch.org/tutorials/beginner/transformer_tutorial.html  # noqa E504
-    """
-
-    def __init__(
-        self, d_model: int, dropout: float = 0.1, max_len: int = 5000
-    ):
-        super().__init__()
-        self.dropout = nn.Dropout(p=dropout)
-
-        position = torch.arange(max_len).unsqueeze(1)
-        div_term = torch.exp(torch.arange(0, d_model, 2)
-                             * (-math.log(10000.0) / d_model))
-        pe = torch.zeros(max_len, 1, d_model)
-        pe[:, 0, 0::2] = torch.sin(position * div_term)
-        pe[:, 0, 1::2] = torch.cos(position * div_term)
-        self.register_buffer('pe', pe)
-
-    def forward(self, x: Tensor) -> Tensor:
-        """
-        Arguments:
-            x: Tensor, shape ``[seq_len, batch_size, embedding_dim]``
-        """
-        x = x.permute(1, 0, 2)
-        x = x + self.pe[:x.size(0)]
-        x = self.dropout(x)
-        x = x.permute(1, 0, 2)
-        return x
+from TractOracleNet.models.inference import (  # noqa F401
+    InferenceOracle, PositionalEncoding, patchify)
 
 
 class TransformerOracle(LightningModule):
@@ -47,6 +19,10 @@ class TransformerOracle(LightningModule):
 
     The model consits of an embedding layer, a positional encoding layer,
     a transformer encoder and a linear layer.
+
+    With `patch_size` k, k consecutive directions are embedded into a
+    single token, dividing the length of the sequences seen by the encoder
+    by k and the cost of attention by k².
     """
 
     def __init__(
@@ -56,7 +32,10 @@ class TransformerOracle(LightningModule):
         n_head,
         n_layers,
         lr,
-        loss=nn.MSELoss
+        loss=nn.MSELoss,
+        embedding_size=32,
+        dim_feedforward=2048,
+        patch_size=1
     ):
         super(TransformerOracle, self).__init__()
         # Keep the name of the model
@@ -69,24 +48,28 @@ class TransformerOracle(LightningModule):
         self.n_head = n_head
         self.n_layers = n_layers
 
-        # Embedding size, could be defined by the user ?
-        self.embedding_size = 32
+        # Embedding size, smaller for distilled models
+        self.embedding_size = embedding_size
+        # Number of directions per token
+        self.patch_size = patch_size
 
         # Class token, initialized randomly
-        self.cls_token = nn.Parameter(torch.randn((3)))
+        self.cls_token = nn.Parameter(torch.randn((3 * patch_size)))
 
         # Embedding layer
         self.embedding = nn.Sequential(
-            *(nn.Linear(3, self.embedding_size),
+            *(nn.Linear(3 * patch_size, self.embedding_size),
               nn.ReLU()))
 
-        # Positional encoding layer
+        # Positional encoding layer, one position per token
+        nb_tokens = -(-(input_size // 3) // patch_size)
         self.pos_encoding = PositionalEncoding(
-            self.embedding_size, max_len=(input_size//3) + 1)
+            self.embedding_size, max_len=nb_tokens + 1)
 
         # Transformer encoder layer
         layer = nn.TransformerEncoderLayer(
-            self.embedding_size, n_head, batch_first=True)
+            self.embedding_size, n_head, dim_feedforward=dim_feedforward,
+            batch_first=True)
 
         # Transformer encoder
         self.bert = nn.TransformerEncoder(layer, self.n_layers)
@@ -108,6 +91,10 @@ class TransformerOracle(LightningModule):
         self.roc = BinaryROC()
         self.f1 = BinaryF1Score()
 
+        # Teacher model of a distilled model, see `distill_from`
+        self._teacher = None
+        self.distillation_alpha = 1.
+
         # Save the hyperparameters to the checkpoint
         self.save_hyperparameters()
 
@@ -143,6 +130,8 @@ class TransformerOracle(LightningModule):
             Output tensor with shape (N) where N is the batch size.
 
         """
+        # Group the directions into tokens
+        x = patchify(x, self.patch_size)
         # Get the shape of the input
         N, L, D = x.shape  # Batch size, length of sequence, nb. of dims
         # Add class token to the input
@@ -167,6 +156,91 @@ class TransformerOracle(LightningModule):
         # Return the output
         return y.squeeze(-1)
 
+    def for_inference(self, batch_size=None, compile=False):
+        """ Build a copy of the model for inference only, see
+        `InferenceOracle`.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Batches are padded to this number of streamlines.
+        compile : bool, optional
+            Compile the model with `torch.compile`.
+
+        Returns
+        -------
+        model : InferenceOracle
+            Model for inference. Quantized models are returned as is, in
+            eval mode.
+        """
+        if getattr(self, 'quantization', None) is not None:
+            return self.eval()
+        return InferenceOracle(self, batch_size, compile)
+
+    def distill_from(self, teacher, alpha=1.):
+        """ Train the model against the scores of a teacher model
+        instead of, or along with, the target scores of the dataset.
+        Metrics are still computed against the target scores.
+
+        Parameters
+        ----------
+        teacher : TransformerOracle
+            Trained model, kept frozen and in eval mode.
+        alpha : float, optional
+            Weight of the scores of the teacher in the targets, the
+            target scores of the dataset having a weight of 1 - alpha.
+        """
+        # Kept in a tuple so that the teacher is neither registered as a
+        # submodule nor saved in the checkpoints of the model
+        self._teacher = (teacher.eval().requires_grad_(False),)
+        self.distillation_alpha = alpha
+
+    def targets(self, x, y):
+        """ Targets of the loss, blending the scores of the teacher
+        with the target scores when distilling.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+        y : torch.Tensor (N)
+            Target scores.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Targets of the loss.
+        """
+        if self._teacher is None:
+            return y
+
+        teacher, = self._teacher
+        with torch.no_grad():
+            soft = teacher.to(x.device)(x).to(y.dtype)
+        return self.distillation_alpha * soft + \
+            (1. - self.distillation_alpha) * y
+
+    def compute_loss(self, x, y):
+        """ Score the streamlines and compute the loss against their
+        target scores.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+        y : torch.Tensor (N)
+            Target scores.
+
+        Returns
+        -------
+        y_hat : torch.Tensor (N)
+            Predicted scores.
+        loss : torch.Tensor
+            Prediction loss.
+        """
+        y_hat = self(x)
+        return y_hat, self.loss(y_hat, y)
+
     def training_step(self, train_batch, batch_idx):
         """ Training step of the model.
 
@@ -187,10 +261,8 @@ class TransformerOracle(LightningModule):
         # Get the input and output
         x, y = train_batch
 
-        # Forward pass
-        y_hat = self(x)
-        # Compute the loss
-        pred_loss = self.loss(y_hat, y)
+        # Forward pass and loss
+        y_hat, pred_loss = self.compute_loss(x, self.targets(x, y))
 
         # Compute metrics
         acc = self.accuracy(y_hat, torch.round(y))
@@ -230,10 +302,8 @@ class TransformerOracle(LightningModule):
             x = x.squeeze(0)
             y = y.squeeze(0)
 
-        # Forward pass
-        y_hat = self(x)
-        # Compute the loss
-        pred_loss = self.loss(y_hat, y)
+        # Forward pass and loss
+        y_hat, pred_loss = self.compute_loss(x, self.targets(x, y))
 
         # Compute metrics
         acc = self.accuracy(y_hat, torch.round(y))
@@ -293,8 +363,433 @@ class TransformerOracle(LightningModule):
 
     def on_test_epoch_end(self):
         """ Plot ROC curve and save it to file. """
+        # Only imported when testing, matplotlib is slow to import
+        from matplotlib import pyplot as plt
 
         fig, ax_ = self.roc.plot(score=True)
 
         fig.savefig('roc.png')
         plt.close(fig)
+
+
+class CausalTransformerOracle(TransformerOracle):
+    """ Transformer model scoring every prefix of a streamline at once.
+
+    Instead of reading a bidirectional class token, attention is causal
+    and a score is predicted at every position, so that the score at
+    position t only depends on the first t + 1 directions. A single
+    forward pass therefore scores all the prefixes of the streamlines,
+    and a growing streamline can be scored one step at a time by caching
+    the keys and values of the previous steps (see `step`).
+
+    As with the `partial` option of `StreamlineBatchDataset`, the score of
+    a prefix is the score of its streamline scaled by the fraction of the
+    streamline it covers, i.e. the prefix of the first t + 1 of the L
+    directions is trained against y * (t + 1) / L.
+    """
+
+    def __init__(
+        self,
+        input_size,
+        output_size,
+        n_head,
+        n_layers,
+        lr,
+        loss=nn.MSELoss,
+        embedding_size=32,
+        dim_feedforward=2048,
+        patch_size=1
+    ):
+        # Prefixes are scored direction by direction
+        if patch_size != 1:
+            raise ValueError('Causal models do not support patches.')
+
+        super(CausalTransformerOracle, self).__init__(
+            input_size, output_size, n_head, n_layers, lr, loss,
+            embedding_size, dim_feedforward)
+
+        # No class token, every position is scored
+        self.cls_token = None
+
+        # Mask preventing positions from attending to the next ones
+        max_len = self.pos_encoding.pe.shape[0]
+        self.register_buffer('causal_mask', torch.triu(
+            torch.full((max_len, max_len), float('-inf')), diagonal=1),
+            persistent=False)
+
+    def forward_prefixes(self, x):
+        """ Score every prefix of the streamlines.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor with shape (N, L, D) where N is the batch size,
+            L is the length of the sequence and D is the number of
+            dimensions.
+
+        Returns
+        -------
+        y : torch.Tensor (N, L)
+            Scores of the prefixes, i.e. y[:, t] is the score of the
+            first t + 1 directions, scaled by the fraction of the
+            streamline they cover.
+        """
+        N, L, D = x.shape  # Batch size, length of sequence, nb. of dims
+        # Apply embedding layer and positional encoding
+        x = self.embedding(x) * math.sqrt(self.embedding_size)
+        encoding = self.pos_encoding(x)
+
+        # Apply transformer, each position only sees the previous ones
+        hidden = self.bert(encoding, mask=self.causal_mask[:L, :L])
+        # Apply linear layer and sigmoid
+        y = self.sig(self.head(hidden))
+
+        return y.squeeze(-1)
+
+    def forward(self, x):
+        """ Score the whole streamlines, i.e. their longest prefix.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Output tensor with shape (N) where N is the batch size.
+        """
+        return self.forward_prefixes(x)[:, -1]
+
+    def for_inference(self, batch_size=None, compile=False):
+        """ Prefixes are scored by the model itself, which is returned
+        in eval mode. """
+        return self.eval()
+
+    def compute_loss(self, x, y):
+        """ Score the streamlines and compute the loss of every prefix
+        against the target score of its streamline, scaled by the
+        fraction of the streamline the prefix covers.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+        y : torch.Tensor (N)
+            Target scores.
+
+        Returns
+        -------
+        y_hat : torch.Tensor (N)
+            Predicted scores of the whole streamlines.
+        loss : torch.Tensor
+            Prediction loss over all prefixes.
+        """
+        y_hat = self.forward_prefixes(x)
+        N, L = y_hat.shape
+        # The prefix of the first t + 1 directions covers (t + 1) / L of
+        # the streamline
+        fractions = torch.arange(
+            1, L + 1, device=y_hat.device, dtype=y_hat.dtype) / L
+        loss = self.loss(y_hat, y[:, None].to(y_hat.dtype) * fractions)
+        return y_hat[:, -1], loss
+
+    def step(self, x, cache=None):
+        """ Score growing streamlines one direction at a time. The keys
+        and values of the previous directions are cached so that they are
+        not recomputed at every step. Scores are the same as the ones of
+        `forward_prefixes` over the whole sequence of directions.
+
+        The model is trained on the directions between the points of
+        streamlines resampled to 128 points, each 1/127 of the length of
+        its streamline, and scores are only meaningful for directions on
+        that scale. The raw directions of a tracking step are not
+        rescaled, since the final length of the streamline is not known
+        while it grows: they match the training directions only for
+        streamlines ending with about 128 points.
+
+        Streamlines can be dropped from the batch between steps by
+        indexing the first dimension of the cached tensors.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, D)
+            Latest direction of each streamline.
+        cache : list of tuple of torch.Tensor, optional
+            Keys and values of each layer for the previous directions, as
+            returned by the previous call. None for the first direction.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Scores of the streamlines up to the latest direction.
+        cache : list of tuple of torch.Tensor
+            Updated keys and values, each of shape (N, n_head, t + 1,
+            embedding_size // n_head).
+        """
+        t = 0 if cache is None else cache[0][0].shape[2]
+        if t >= self.pos_encoding.pe.shape[0]:
+            raise ValueError(
+                'Cannot score more than {} directions.'.format(
+                    self.pos_encoding.pe.shape[0]))
+
+        # Apply embedding layer and positional encoding of position t
+        h = self.embedding(x) * math.sqrt(self.embedding_size)
+        h = self.pos_encoding.dropout(h + self.pos_encoding.pe[t])
+
+        new_cache = []
+        for i, layer in enumerate(self.bert.layers):
+            past = None if cache is None else cache[i]
+            if layer.norm_first:
+                attn, kv = self._cached_attention(
+                    layer, layer.norm1(h), past)
+                h = h + attn
+                h = h + self._feed_forward(layer, layer.norm2(h))
+            else:
+                attn, kv = self._cached_attention(layer, h, past)
+                h = layer.norm1(h + attn)
+                h = layer.norm2(h + self._feed_forward(layer, h))
+            new_cache.append(kv)
+
+        if self.bert.norm is not None:
+            h = self.bert.norm(h)
+
+        # Apply linear layer and sigmoid
+        y = self.sig(self.head(h))
+
+        return y.squeeze(-1), new_cache
+
+    def _cached_attention(self, layer, h, past):
+        """ Self-attention of the latest position over the cached ones.
+
+        Parameters
+        ----------
+        layer : nn.TransformerEncoderLayer
+            Layer to apply.
+        h : torch.Tensor (N, E)
+            Input of the attention for the latest position.
+        past : tuple of torch.Tensor or None
+            Cached keys and values of the previous positions.
+
+        Returns
+        -------
+        out : torch.Tensor (N, E)
+            Output of the attention, after dropout.
+        kv : tuple of torch.Tensor
+            Keys and values including the latest position.
+        """
+        attn = layer.self_attn
+        N, E = h.shape
+        H = attn.num_heads
+
+        q, k, v = F.linear(
+            h, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1)
+        q, k, v = (a.view(N, H, 1, E // H) for a in (q, k, v))
+        if past is not None:
+            k = torch.cat((past[0], k), dim=2)
+            v = torch.cat((past[1], v), dim=2)
+
+        weights = torch.softmax(
+            q @ k.transpose(-2, -1) / math.sqrt(E // H), dim=-1)
+        out = (weights @ v).view(N, E)
+        out = attn.out_proj(out)
+
+        return layer.dropout1(out), (k, v)
+
+    def _feed_forward(self, layer, h):
+        """ Feed-forward block of an encoder layer. """
+        h = layer.linear2(layer.dropout(layer.activation(layer.linear1(h))))
+        return layer.dropout2(h)
+
+
+class EarlyExitTransformerOracle(TransformerOracle):
+    """ Transformer model with a score head after every encoder layer.
+
+    All heads read the class token and are trained jointly. At inference,
+    once early exit is enabled (see `enable_early_exit`), a streamline
+    stops going through the encoder as soon as its score is far enough
+    from the filtering threshold, and only the remaining streamlines are
+    passed to the next layers.
+    """
+
+    def __init__(
+        self,
+        input_size,
+        output_size,
+        n_head,
+        n_layers,
+        lr,
+        loss=nn.MSELoss,
+        embedding_size=32,
+        dim_feedforward=2048,
+        patch_size=1
+    ):
+        super(EarlyExitTransformerOracle, self).__init__(
+            input_size, output_size, n_head, n_layers, lr, loss,
+            embedding_size, dim_feedforward, patch_size)
+
+        # Heads of the first layers, the last one uses `head`
+        self.exit_heads = nn.ModuleList(
+            [nn.Linear(self.embedding_size, output_size)
+             for _ in range(n_layers - 1)])
+
+        # Early exit is disabled until `enable_early_exit` is called
+        self.exit_threshold = None
+        self.exit_margin = None
+        self.nb_exited = 0
+        self.total_exit_depth = 0
+
+    def _embed(self, x):
+        """ Embed the class token and the directions, with their
+        positional encodings. """
+        x = patchify(x, self.patch_size)
+        N, L, D = x.shape
+        cls_tokens = self.cls_token.repeat(N, 1, 1)
+        x = torch.cat((cls_tokens, x), dim=1)
+        x = self.embedding(x) * math.sqrt(self.embedding_size)
+        return self.pos_encoding(x)
+
+    def _exit_score(self, i, hidden):
+        """ Score of the streamlines after the i-th layer. """
+        head = self.exit_heads[i] if i < len(self.exit_heads) else self.head
+        return self.sig(head(hidden[:, 0])).squeeze(-1)
+
+    def forward_exits(self, x):
+        """ Score the streamlines after every layer.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+
+        Returns
+        -------
+        y : torch.Tensor (N, n_layers)
+            Scores of the streamlines after each layer.
+        """
+        hidden = self._embed(x)
+        scores = []
+        for i, layer in enumerate(self.bert.layers):
+            hidden = layer(hidden)
+            scores.append(self._exit_score(i, hidden))
+        return torch.stack(scores, dim=1)
+
+    def forward_early_exit(self, x, threshold, margin):
+        """ Score the streamlines, each one exiting the encoder after the
+        first layer whose score is at least `margin` away from
+        `threshold`. Streamlines which exited are removed from the batch,
+        so that the next layers only process the remaining ones.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+        threshold : float
+            Filtering threshold.
+        margin : float
+            Minimum distance of a score to the threshold to exit early.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Scores of the streamlines.
+        depth : torch.Tensor (N)
+            Number of layers each streamline went through.
+        """
+        N = len(x)
+        y = x.new_zeros(N)
+        depth = torch.full((N,), self.n_layers, device=x.device)
+        active = torch.arange(N, device=x.device)
+
+        hidden = self._embed(x)
+        for i, layer in enumerate(self.bert.layers):
+            hidden = layer(hidden)
+            scores = self._exit_score(i, hidden)
+            if i == len(self.bert.layers) - 1:
+                y[active] = scores.to(y.dtype)
+                break
+
+            done = (scores - threshold).abs() >= margin
+            y[active[done]] = scores[done].to(y.dtype)
+            depth[active[done]] = i + 1
+
+            # Compact the batch to the streamlines still in the encoder
+            keep = ~done
+            active, hidden = active[keep], hidden[keep]
+            if len(active) == 0:
+                break
+
+        return y, depth
+
+    def enable_early_exit(self, threshold, margin):
+        """ Make `forward` exit early when the model is not training.
+
+        Parameters
+        ----------
+        threshold : float
+            Filtering threshold.
+        margin : float
+            Minimum distance of a score to the threshold to exit early.
+        """
+        self.exit_threshold = threshold
+        self.exit_margin = margin
+        self.nb_exited = 0
+        self.total_exit_depth = 0
+
+    @property
+    def average_exit_depth(self):
+        """ Average number of layers streamlines went through since early
+        exit was enabled. """
+        return self.total_exit_depth / max(self.nb_exited, 1)
+
+    def forward(self, x):
+        """ Score the streamlines with the last head, or with early exit
+        if enabled and the model is in eval mode without gradients.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+
+        Returns
+        -------
+        y : torch.Tensor (N)
+            Output tensor with shape (N) where N is the batch size.
+        """
+        if self.exit_margin is None or self.training or \
+                torch.is_grad_enabled():
+            return self.forward_exits(x)[:, -1]
+
+        y, depth = self.forward_early_exit(
+            x, self.exit_threshold, self.exit_margin)
+        self.nb_exited += len(depth)
+        self.total_exit_depth += int(depth.sum())
+        return y
+
+    def for_inference(self, batch_size=None, compile=False):
+        """ Streamlines are removed from the batches by the model itself,
+        which is returned in eval mode. """
+        return self.eval()
+
+    def compute_loss(self, x, y):
+        """ Score the streamlines after every layer and average the losses
+        of all heads, so that they are trained jointly.
+
+        Parameters
+        ----------
+        x : torch.Tensor (N, L, D)
+            Input tensor.
+        y : torch.Tensor (N)
+            Target scores.
+
+        Returns
+        -------
+        y_hat : torch.Tensor (N)
+            Predicted scores of the last head.
+        loss : torch.Tensor
+            Mean prediction loss of the heads.
+        """
+        y_hat = self.forward_exits(x)
+        loss = torch.stack([self.loss(y_hat[:, i], y)
+                            for i in range(y_hat.shape[1])]).mean()
+        return y_hat[:, -1], loss
@@ -1,10 +1,16 @@
+import inspect
+
 import torch
 
-from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.models.quantization import quantize_model
 
 
 def get_model(checkpoint_file):
     """ Get the model from a checkpoint. """
+    # Lightning and torchmetrics are only imported to load checkpoints
+    from TractOracleNet.models.transformer import (
+        CausalTransformerOracle, EarlyExitTransformerOracle,
+        TransformerOracle)
 
     # Load the model's hyper and actual params from a saved checkpoint
     try:
@@ -18,10 +24,24 @@ def get_model(checkpoint_file):
     # The model's class is saved in hparams
     models = {
         # Add other architectures here
-        'TransformerOracle': TransformerOracle
+        'TransformerOracle': TransformerOracle,
+        'CausalTransformerOracle': CausalTransformerOracle,
+        'EarlyExitTransformerOracle': EarlyExitTransformerOracle
     }
 
     hyper_parameters = checkpoint["hyper_parameters"]
+
+    if checkpoint.get('quantization'):
+        # Quantized models are saved with `save_quantized`: the model is
+        # built from its hyperparameters, quantized, then its weights loaded
+        model_class = models[hyper_parameters['name']]
+        arguments = inspect.signature(model_class).parameters
+        model = model_class(**{k: v for k, v in hyper_parameters.items()
+                               if k in arguments})
+        model = quantize_model(model, checkpoint['quantization'])
+        model.load_state_dict(checkpoint['state_dict'])
+        return model
+
     # Load it from the checkpoint
     try:
         model = models[hyper_parameters[
@@ -0,0 +1,174 @@
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+from contextlib import contextmanager, nullcontext
+
+"""
+Per-stage profiling of the scoring of tractograms. Code paths mark their
+stages with `stage`, which only measures anything while a `StageProfiler`
+is active, so that the stages of the functions shared with other scripts
+(e.g. saving tractograms) are profiled without passing the profiler
+around.
+"""
+
+# Profiler recording the stages, if any. Shared with the worker threads
+# preparing batches, which do not inherit context variables.
+_active = None
+
+
+def peak_rss():
+    """ Peak resident set size of the process since it started, in MB. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def current_rss():
+    """ Current resident set size of the process, in MB, or None if it
+    cannot be read (i.e. without /proc). """
+    try:
+        with open('/proc/self/statm') as f:
+            resident = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident * resource.getpagesize() / 2 ** 20
+
+
+def machine_info():
+    """ Hardware a run was made on, so that runs can be compared. """
+    return dict(
+        platform=platform.platform(),
+        processor=platform.processor() or platform.machine(),
+        cpu_count=os.cpu_count())
+
+
+def stage(name, nb_streamlines=None):
+    """ Measure a stage with the active profiler, if any.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    nb_streamlines : int, optional
+        Number of streamlines processed by the stage.
+
+    Returns
+    -------
+    context : context manager
+        Context measuring the stage.
+    """
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name, nb_streamlines)
+
+
+class StageProfiler():
+    """ Wall time, number of streamlines and memory of each stage,
+    accumulated over all the calls of the stage while the profiler is
+    active (see `stage`).
+
+    The memory of a stage is measured from the resident set size of the
+    process at the start and at the end of each call: the memory it holds
+    on to (`rss_delta_mb`, summed over the calls) and the largest size of
+    the process at the end of a call (`max_rss_mb`). Memory allocated and
+    freed within a call is not seen.
+
+    Stages run by worker threads, e.g. preparing the batches, are timed in
+    each thread: their time is summed over the threads and overlaps the
+    stages of the main thread, whose allocations are also counted in
+    their memory.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.start = None
+        self.end = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        global _active
+        _active = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        self.end = time.perf_counter()
+        _active = None
+
+    @contextmanager
+    def stage(self, name, nb_streamlines=None):
+        """ Measure a call of a stage.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        nb_streamlines : int, optional
+            Number of streamlines processed by the call.
+        """
+        start, start_rss = time.perf_counter(), current_rss()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            end_rss = current_rss()
+            with self._lock:
+                s = self.stages.setdefault(name, {
+                    'time': 0., 'calls': 0, 'streamlines': 0,
+                    'rss_delta_mb': None, 'max_rss_mb': None})
+                s['time'] += elapsed
+                s['calls'] += 1
+                s['streamlines'] += int(nb_streamlines or 0)
+                if start_rss is not None and end_rss is not None:
+                    s['rss_delta_mb'] = (s['rss_delta_mb'] or 0.) + \
+                        end_rss - start_rss
+                    s['max_rss_mb'] = max(s['max_rss_mb'] or 0., end_rss)
+
+    def report(self, nb_streamlines, **info):
+        """ Summarize the stages.
+
+        Parameters
+        ----------
+        nb_streamlines : int
+            Number of streamlines of the tractogram.
+        info : dict
+            Options of the run, e.g. the batch size, added to the report
+            so that runs can be compared.
+
+        Returns
+        -------
+        report : dict
+            Total wall time, throughput and memory of the run and of each
+            stage, in the order they first ran, along with the hardware
+            the run was made on. The peak memory is only known for the
+            whole process.
+        """
+        end = self.end or time.perf_counter()
+        total = end - self.start
+
+        stages = []
+        for name, s in self.stages.items():
+            stages.append(dict(
+                stage=name, **s, streamlines_per_s=s['streamlines'] /
+                s['time'] if s['streamlines'] and s['time'] > 0 else None))
+
+        return dict(
+            info,
+            nb_streamlines=int(nb_streamlines),
+            time=total,
+            streamlines_per_s=nb_streamlines / total if total > 0 else None,
+            process_peak_rss_mb=peak_rss(),
+            **machine_info(),
+            stages=stages)
+
+    @staticmethod
+    def save(filename, report):
+        """ Save a report, see `report`, to a JSON file. """
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
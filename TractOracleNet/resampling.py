@@ -0,0 +1,156 @@
+import numpy as np
+
+from dipy.tracking.streamline import set_number_of_points
+from nibabel.streamlines.array_sequence import ArraySequence
+
+"""
+Resampling of streamlines to a fixed number of points, and arc lengths
+computed directly on the flat points of an ArraySequence instead of
+looping over streamlines.
+"""
+
+
+def flatten_streamlines(streamlines):
+    """ Get the points of an ArraySequence as a single contiguous array.
+    Slicing or masking an ArraySequence only subsets its offsets and
+    lengths, so the points have to be gathered back together.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence
+        Streamlines to flatten.
+
+    Returns
+    -------
+    points : np.ndarray (M, 3)
+        Points of all streamlines, one streamline after the other.
+    lengths : np.ndarray (N,)
+        Number of points of each streamline.
+    """
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    offsets = np.asarray(streamlines._offsets, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+
+    # Points are already laid out one streamline after the other
+    if len(lengths) == 0 or np.all(offsets - starts == offsets[0]):
+        begin = offsets[0] if len(offsets) else 0
+        return streamlines._data[begin:begin + lengths.sum()], lengths
+
+    idx = np.arange(lengths.sum()) + np.repeat(offsets - starts, lengths)
+    return np.take(streamlines._data, idx, axis=0), lengths
+
+
+def _arc_lengths(points, ends):
+    """ Compute the segments and cumulated arc lengths of streamlines.
+
+    Parameters
+    ----------
+    points : np.ndarray (M, 3)
+        Flat points of the streamlines, one streamline after the other.
+    ends : np.ndarray (N,)
+        Index following the last point of each streamline.
+
+    Returns
+    -------
+    segments : np.ndarray (M, 3)
+        Vector from each point to the next one of the same streamline,
+        zero for the last point of each streamline.
+    arc : np.ndarray (M,)
+        Arc length up to each point, cumulated over all streamlines.
+    """
+    # Segments between consecutive points. Segments joining two
+    # streamlines have no length.
+    segments = np.empty_like(points)
+    np.subtract(points[1:], points[:-1], out=segments[:-1])
+    segments[ends - 1] = 0.
+    seg_lengths = np.sqrt(np.einsum('ij,ij->i', segments, segments))
+
+    arc = np.cumsum(seg_lengths, dtype=np.float64)
+    arc -= seg_lengths
+
+    return segments, arc
+
+
+def arc_length_fractions(streamlines):
+    """ Compute the fraction of the length of its streamline covered at
+    each point, i.e. 0 at the first point and 1 at the last one.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence or list of np.ndarray
+        Streamlines.
+
+    Returns
+    -------
+    fractions : np.ndarray (M,)
+        Fraction of the arc length at each point, one streamline after
+        the other.
+    """
+    if not isinstance(streamlines, ArraySequence):
+        streamlines = ArraySequence(streamlines)
+
+    points, lengths = flatten_streamlines(streamlines)
+    if len(lengths) == 0:
+        return np.zeros(0)
+
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    _, arc = _arc_lengths(points, ends)
+    arc_start = np.repeat(arc[starts], lengths)
+    arc_total = np.repeat(arc[ends - 1], lengths) - arc_start
+
+    return np.divide(arc - arc_start, arc_total,
+                     out=np.zeros_like(arc), where=arc_total > 0)
+
+
+def resample_streamlines(streamlines, nb_points=128):
+    """ Resample streamlines to a fixed number of points, equally spaced
+    along their arc length, as a single array. The streamlines are
+    resampled by dipy's `set_number_of_points`, whose points are viewed
+    as an array instead of being converted from a list of streamlines.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence or list of np.ndarray
+        Streamlines to resample.
+    nb_points : int, optional
+        Number of points of the resampled streamlines.
+
+    Returns
+    -------
+    resampled : np.ndarray (N, nb_points, 3)
+        Resampled streamlines.
+    """
+    if not isinstance(streamlines, ArraySequence):
+        streamlines = ArraySequence(streamlines)
+
+    if len(streamlines) == 0:
+        return np.zeros((0, nb_points, 3), dtype=streamlines._data.dtype)
+
+    # Resampled streamlines are laid out one after the other
+    resampled = set_number_of_points(streamlines, nb_points)
+    return resampled._data.reshape(len(streamlines), nb_points, 3)
+
+
+def resample_directions(streamlines, nb_points=128):
+    """ Compute the directions between the points of the streamlines
+    resampled to a fixed number of points, i.e. the input features of
+    the model. Equivalent to, and faster than,
+    `np.diff(set_number_of_points(streamlines, nb_points), axis=1)`.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence or list of np.ndarray
+        Streamlines to resample.
+    nb_points : int, optional
+        Number of points of the resampled streamlines.
+
+    Returns
+    -------
+    dirs : np.ndarray (N, nb_points - 1, 3)
+        Directions between consecutive resampled points.
+    """
+    resampled = resample_streamlines(streamlines, nb_points)
+
+    return np.subtract(resampled[:, 1:], resampled[:, :-1])
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+import argparse
+import csv
+import json
+import os
+import time
+
+from argparse import RawTextHelpFormatter
+from tqdm import tqdm
+
+from TractOracleNet.backends import load_model
+from TractOracleNet.cache import ScoreCache
+from TractOracleNet.cascade import GeometricCascade
+from TractOracleNet.runners.predictor import (
+    TractOracleNetPredictor, _add_scoring_args, _check_scoring_args,
+    enable_early_exit)
+from TractOracleNet.utils import prefetch_map
+
+SUMMARY_FIELDS = ['tractogram', 'out', 'kept', 'total', 'load_time',
+                  'score_time']
+
+
+def load_manifest(manifest_file):
+    """ Read the subjects to score from a manifest.
+
+    Args:
+        manifest_file: JSON file containing a list of objects, or CSV file
+            with a header, with the `tractogram` and `out` fields and
+            optionally the `reference` and `rejected` fields.
+
+    Returns:
+        A list of dicts, one per subject.
+    """
+
+    with open(manifest_file, 'r', newline='') as f:
+        if os.path.splitext(manifest_file)[-1] == '.json':
+            subjects = json.load(f)
+        else:
+            subjects = list(csv.DictReader(f))
+
+    for i, subject in enumerate(subjects):
+        for field in ('tractogram', 'out'):
+            if not subject.get(field):
+                raise ValueError(
+                    'Subject {} of {} has no {}.'.format(
+                        i, manifest_file, field))
+        subject['reference'] = subject.get('reference') or 'same'
+        subject['rejected'] = subject.get('rejected') or None
+
+    return subjects
+
+
+def save_summary(summary, summary_file):
+    """ Save the per-subject summary.
+
+    Args:
+        summary: List of dicts with the `SUMMARY_FIELDS` fields.
+        summary_file: Output file, as JSON if it ends with .json, as CSV
+            otherwise.
+    """
+
+    with open(summary_file, 'w', newline='') as f:
+        if os.path.splitext(summary_file)[-1] == '.json':
+            json.dump(summary, f, indent=2)
+        else:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(summary)
+
+
+class TractOracleNetBatchPredictor():
+    """
+    Filter many tractograms with a single model
+    """
+
+    def __init__(
+        self,
+        train_dto: dict,
+    ):
+        """
+        """
+        self.dto = train_dto
+        self.checkpoint = train_dto['checkpoint']
+        self.backend = train_dto['backend']
+        self.quantize = train_dto['quantize']
+        self.compile = train_dto['compile']
+        self.batch_size = train_dto['batch_size']
+        self.subjects = train_dto['subjects']
+        self.summary = train_dto['summary']
+        self.stream = train_dto['stream']
+        self.cache = train_dto['cache']
+        self.cache_size = train_dto['cache_size']
+        self.threshold = train_dto['threshold']
+        self.exit_margin = train_dto['exit_margin']
+        self.cascade = train_dto['cascade']
+        self.score_cache = None
+        self.geometric_cascade = None
+
+    def _predictor(self, subject):
+        """ Build the predictor of a subject.
+
+        Args:
+            subject: Dict with the files of the subject.
+
+        Returns:
+            The predictor.
+        """
+
+        predictor = TractOracleNetPredictor(
+            dict(self.dto, thresholds=None, curve=None, profile=None,
+                 profile_trace=None, **subject))
+        # All subjects share the same score cache and cascade
+        predictor.score_cache = self.score_cache
+        predictor.geometric_cascade = self.geometric_cascade
+        return predictor
+
+    def run(self):
+        """
+        Load the model once and score the subjects back to back
+        """
+
+        model = load_model(self.checkpoint, self.backend, self.quantize,
+                           self.compile, self.batch_size)
+
+        if self.cache:
+            self.score_cache = ScoreCache(self.cache, model, self.cache_size)
+        if self.exit_margin is not None:
+            enable_early_exit(model, self.threshold, self.exit_margin)
+        if self.cascade:
+            self.geometric_cascade = GeometricCascade.load(self.cascade)
+
+        def _load(subject):
+            # Load the next tractogram while the current one is scored.
+            # Tractograms are read chunk by chunk when streaming.
+            start = time.perf_counter()
+            sft = None if self.stream else \
+                self._predictor(subject).load_tractogram()
+            return subject, sft, time.perf_counter() - start
+
+        # The next tractogram is loaded while the current one is scored,
+        # so at most two are held in memory
+        tractograms = prefetch_map(_load, self.subjects, 1, max_pending=2)
+
+        summary = []
+        for subject, sft, load_time in tqdm(
+                tractograms, total=len(self.subjects)):
+            start = time.perf_counter()
+            kept, total = self._predictor(subject).filter_tractogram(
+                model, sft)
+            score_time = time.perf_counter() - start
+
+            summary.append({
+                'tractogram': subject['tractogram'],
+                'out': subject['out'],
+                'kept': kept,
+                'total': total,
+                'load_time': load_time,
+                'score_time': score_time})
+            print('{}: kept {}/{} streamlines ({}%).'.format(
+                subject['tractogram'], kept, total,
+                (kept / max(total, 1) * 100)))
+
+            # Keep the summary up to date in case of failure
+            if self.summary:
+                save_summary(summary, self.summary)
+
+        if self.score_cache is not None:
+            self.score_cache.close()
+            print('Score cache: {}/{} hits ({}%).'.format(
+                self.score_cache.hits, self.score_cache.lookups,
+                self.score_cache.hit_rate * 100))
+
+        if self.geometric_cascade is not None:
+            print('Cascade: decided {}/{} streamlines without the model '
+                  '({}%): {} rejected, {} accepted.'.format(
+                      self.geometric_cascade.nb_decided,
+                      self.geometric_cascade.nb_seen,
+                      self.geometric_cascade.skip_rate * 100,
+                      self.geometric_cascade.nb_rejected,
+                      self.geometric_cascade.nb_accepted))
+
+        if self.exit_margin is not None:
+            print('Average exit depth: {}/{} layers.'.format(
+                model.average_exit_depth, model.n_layers))
+
+        return summary
+
+
+def _build_arg_parser(parser):
+    # scilpy's IO utilities pull in fury and matplotlib, so they are only
+    # imported when parsing arguments
+    from scilpy.io.utils import add_overwrite_arg
+
+    parser.add_argument('manifest', type=str,
+                        help='JSON or CSV file listing the subjects to '
+                             'score. Each subject has a `tractogram` and an '
+                             '`out` file,\nand optionally a `reference` '
+                             '(\'same\' by default) and a `rejected` file.')
+    parser.add_argument('--summary', type=str,
+                        help='Save the number of kept streamlines and the '
+                             'timings of each subject to this JSON or CSV '
+                             'file.')
+
+    _add_scoring_args(parser, rejected=False)
+
+    add_overwrite_arg(parser)
+
+
+def parse_args():
+    """ Filter many tractograms, loading the model only once. """
+    from scilpy.io.utils import assert_inputs_exist, assert_outputs_exist
+
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+
+    _build_arg_parser(parser)
+    args = parser.parse_args()
+
+    assert_inputs_exist(parser, args.manifest)
+    try:
+        args.subjects = load_manifest(args.manifest)
+    except (ValueError, KeyError, TypeError) as e:
+        parser.error('Invalid manifest: {}'.format(e))
+
+    assert_inputs_exist(
+        parser, [s['tractogram'] for s in args.subjects],
+        optional=[s['reference'] for s in args.subjects
+                  if s['reference'] != 'same'])
+    assert_outputs_exist(
+        parser, args, [s['out'] for s in args.subjects],
+        optional=[s['rejected'] for s in args.subjects if s['rejected']] +
+        [args.summary])
+
+    _check_scoring_args(parser, args)
+
+    return parser, args
+
+
+def main():
+
+    parser, args = parse_args()
+
+    experiment = TractOracleNetBatchPredictor(vars(args))
+    experiment.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+import argparse
+
+import h5py
+import numpy as np
+
+from argparse import RawTextHelpFormatter
+from tqdm import tqdm
+
+from scilpy.io.utils import (
+    assert_inputs_exist, assert_outputs_exist, add_overwrite_arg)
+
+from TractOracleNet.cascade import (
+    FEATURES, GeometricCascade, geometric_features)
+
+
+def load_features(dataset_file, max_streamlines=None, chunk_size=10000):
+    """ Compute the geometric features of the streamlines of a dataset.
+
+    Args:
+        dataset_file: HDF5 dataset created by create_dataset.py.
+        max_streamlines: Only use the first streamlines of the dataset,
+            which is shuffled. All streamlines are used by default.
+        chunk_size: Number of streamlines read at a time.
+
+    Returns:
+        The features and the scores of the streamlines.
+    """
+
+    with h5py.File(dataset_file, 'r') as f:
+        data = f['streamlines']['data']
+        scores = f['streamlines']['scores']
+        total = len(data) if max_streamlines is None else \
+            min(len(data), max_streamlines)
+
+        features = np.zeros((total, len(FEATURES)), dtype=np.float32)
+        for i in tqdm(range(0, total, chunk_size)):
+            j = min(i + chunk_size, total)
+            features[i:j] = geometric_features(np.diff(data[i:j], axis=1))
+
+        return features, scores[:total]
+
+
+def _build_arg_parser(parser):
+    parser.add_argument('dataset', type=str,
+                        help='HDF5 dataset (.hdf5) created by '
+                             'create_dataset.py.')
+    parser.add_argument('out', type=str,
+                        help='Output rules (.json), to be used as the '
+                             '--cascade of predictor.py.')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Maximum fraction of wrong decisions of each '
+                             'rule. Default is [%(default)s].')
+    parser.add_argument('--min_support', type=int, default=1000,
+                        help='Minimum number of streamlines decided by each '
+                             'rule. Default is [%(default)s].')
+    parser.add_argument('--label_threshold', type=float, default=0.5,
+                        help='Streamlines of the dataset scored above this '
+                             'are plausible. Default is [%(default)s].')
+    parser.add_argument('--max_streamlines', type=int,
+                        help='Only use the first streamlines of the '
+                             'dataset. All streamlines are used by default.')
+
+    add_overwrite_arg(parser)
+
+
+def parse_args():
+    """ Calibrate the rules of the geometric cascade of predictor.py on a
+    dataset. Each rule rejects or accepts the streamlines whose geometric
+    feature is below or above a cut, such that at most --tolerance of the
+    streamlines of the dataset it decides are decided wrongly. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+
+    _build_arg_parser(parser)
+    args = parser.parse_args()
+
+    assert_inputs_exist(parser, args.dataset)
+    assert_outputs_exist(parser, args, args.out)
+    if not 0 <= args.tolerance < 1:
+        parser.error('--tolerance must be in [0, 1).')
+
+    return parser, args
+
+
+def main():
+
+    parser, args = parse_args()
+
+    features, scores = load_features(args.dataset, args.max_streamlines)
+    cascade = GeometricCascade.calibrate(
+        features, scores, args.label_threshold, args.tolerance,
+        args.min_support)
+    cascade.save(args.out)
+
+    # Fraction of the dataset the rules would decide without the model
+    decided, _ = cascade.decide_features(features)
+    for rule in cascade.rules:
+        print('{} {} {} {:.4g}: {} streamlines ({}% right).'.format(
+            rule['decision'], rule['feature'], rule['side'], rule['cut'],
+            rule['support'], rule['purity'] * 100))
+    print('Decided {}/{} streamlines of the dataset ({}%).'.format(
+        np.count_nonzero(decided), len(decided),
+        np.count_nonzero(decided) / max(len(decided), 1) * 100))
+
+
+if __name__ == "__main__":
+    main()
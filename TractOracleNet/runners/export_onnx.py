@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import argparse
+
+from argparse import RawTextHelpFormatter
+
+from scilpy.io.utils import (
+    assert_inputs_exist, assert_outputs_exist, add_overwrite_arg)
+
+from TractOracleNet.backends import export_onnx
+from TractOracleNet.models.utils import get_model
+
+
+def _build_arg_parser(parser):
+    parser.add_argument('checkpoint', type=str,
+                        help='Checkpoint (.ckpt) containing hyperparameters '
+                             'and weights of model.')
+    parser.add_argument('out', type=str,
+                        help='Output ONNX model (.onnx).')
+    parser.add_argument('--opset', type=int, default=17,
+                        help='ONNX opset version. Default is '
+                             '[%(default)s].')
+
+    add_overwrite_arg(parser)
+
+
+def parse_args():
+    """ Export a model to ONNX, to be used with
+    `predictor.py --backend onnxruntime`. The batch axis of the exported
+    model is dynamic. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+
+    _build_arg_parser(parser)
+    args = parser.parse_args()
+
+    assert_inputs_exist(parser, args.checkpoint)
+    assert_outputs_exist(parser, args, args.out)
+
+    return parser, args
+
+
+def main():
+
+    parser, args = parse_args()
+
+    export_onnx(get_model(args.checkpoint), args.out, args.opset)
+
+
+if __name__ == "__main__":
+    main()
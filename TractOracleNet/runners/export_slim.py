@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import argparse
+
+from argparse import RawTextHelpFormatter
+
+from scilpy.io.utils import (
+    assert_inputs_exist, assert_outputs_exist, add_overwrite_arg)
+
+from TractOracleNet.models.inference import save_slim
+from TractOracleNet.models.utils import get_model
+
+
+def _build_arg_parser(parser):
+    parser.add_argument('checkpoint', type=str,
+                        help='Checkpoint (.ckpt) containing hyperparameters '
+                             'and weights of model.')
+    parser.add_argument('out', type=str,
+                        help='Output slim model (.pt).')
+
+    add_overwrite_arg(parser)
+
+
+def parse_args():
+    """ Save the hyperparameters and the weights of a model, without the
+    state of its training, as a slim model to be used as the `--checkpoint`
+    of predictor.py. Slim models are memory-mapped and loaded in a single
+    read, without Lightning nor torchmetrics. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+
+    _build_arg_parser(parser)
+    args = parser.parse_args()
+
+    assert_inputs_exist(parser, args.checkpoint)
+    assert_outputs_exist(parser, args, args.out)
+    if not args.out.endswith('.pt'):
+        parser.error('Slim models must be saved as .pt files.')
+
+    return parser, args
+
+
+def main():
+
+    parser, args = parse_args()
+
+    try:
+        save_slim(get_model(args.checkpoint), args.out)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
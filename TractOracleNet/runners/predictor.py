@@ -1,22 +1,113 @@
 #!/usr/bin/env python
 import argparse
+import csv
 import numpy as np
+import os
 import torch
+import torch.multiprocessing as mp
 
 from argparse import RawTextHelpFormatter
-from dipy.io.streamline import load_tractogram
-from dipy.io.stateful_tractogram import StatefulTractogram
-from dipy.tracking.streamline import set_number_of_points
+from contextlib import nullcontext
+from dipy.io.utils import get_reference_info
+from nibabel.streamlines.array_sequence import ArraySequence
 from tqdm import tqdm
 
-from scilpy.io.utils import (
-    assert_inputs_exist, assert_outputs_exist, add_overwrite_arg)
-
-from TractOracleNet.utils import get_data, save_filtered_streamlines
-from TractOracleNet.models.utils import get_model
+from TractOracleNet.backends import BACKENDS, PRECISIONS, load_model
+from TractOracleNet.cache import ScoreCache
+from TractOracleNet.cascade import GeometricCascade
+from TractOracleNet.models.quantization import QUANTIZATION_DTYPES
+from TractOracleNet.profiling import StageProfiler, stage
+from TractOracleNet.resampling import (
+    arc_length_fractions, resample_directions)
+from TractOracleNet.streaming import (
+    StreamingTractogramWriter, iter_tractogram_chunks, rasmm_to_vox_corner)
+from TractOracleNet.utils import (
+    get_data, get_streamlines_data, prefetch_map, save_filtered_streamlines)
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 cast_device = 'cuda' if torch.cuda.is_available() else 'cpu'
+cpu_device = torch.device("cpu")
+
+# Predictor, model and tractogram shared with the worker processes. They
+# are set before forking so that the workers inherit them without copies.
+_shard_context = None
+
+
+def _init_shard_worker(nb_threads):
+    """ Pin the number of threads used by torch in a worker process. """
+    torch.set_num_threads(nb_threads)
+
+
+def _predict_shard(bounds):
+    """ Score a range of streamlines in a worker process.
+
+    Args:
+        bounds: Start and end indices of the streamlines to score.
+
+    Returns:
+        The start index and the scores of the streamlines.
+    """
+    predictor, model, sft = _shard_context
+    start, end = bounds
+    return start, predictor.predict(
+        model, sft, start, end, progress=False)
+
+
+def enable_early_exit(model, threshold, margin):
+    """ Make an early-exit model stop scoring streamlines whose score is
+    at least `margin` away from the threshold.
+
+    Args:
+        model: The model to use for prediction.
+        threshold: Threshold score for filtering.
+        margin: Minimum distance of a score to the threshold to exit.
+    """
+
+    if not hasattr(model, 'enable_early_exit'):
+        raise ValueError('--exit_margin requires a model trained with '
+                         '--early_exit.')
+    model.enable_early_exit(threshold, margin)
+
+
+def threshold_filename(filename, threshold):
+    """ Name the output of a threshold of a sweep.
+
+    Args:
+        filename: Output file given by the user, e.g. `out.trk`.
+        threshold: Threshold of the output.
+
+    Returns:
+        The output file of the threshold, e.g. `out_0.5.trk`.
+    """
+
+    root, ext = os.path.splitext(filename)
+    return '{}_{:g}{}'.format(root, threshold, ext)
+
+
+def parse_thresholds(value):
+    """ Parse a list of thresholds, either as comma-separated values or
+    as an inclusive `start:stop:step` range.
+
+    Args:
+        value: Thresholds, e.g. `0.3,0.5,0.7` or `0.1:0.9:0.1`.
+
+    Returns:
+        The sorted thresholds.
+    """
+
+    try:
+        if ':' in value:
+            start, stop, step = (float(v) for v in value.split(':'))
+            if step <= 0:
+                raise ValueError
+            thresholds = np.arange(start, stop + step / 2, step)
+        else:
+            thresholds = [float(v) for v in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'Invalid thresholds: {}'.format(value))
+
+    return sorted(set(np.round(thresholds, 6).tolist()))
 
 
 class TractOracleNetPredictor():
@@ -31,6 +122,14 @@ class TractOracleNetPredictor():
         """
         """
         self.checkpoint = train_dto['checkpoint']
+        self.backend = train_dto['backend']
+        self.quantize = train_dto['quantize']
+        self.compile = train_dto['compile']
+        # Autocast is only enabled on GPU by default
+        self.precision = train_dto['precision'] or \
+            ('fp16' if cast_device == 'cuda' else 'fp32')
+        self.dtype = PRECISIONS[self.precision]
+        self.exit_margin = train_dto['exit_margin']
         self.dense = train_dto['dense']
         self.tractogram = train_dto['tractogram']
         self.reference = train_dto['reference']
@@ -39,138 +138,582 @@ class TractOracleNetPredictor():
         self.out = train_dto['out']
         self.rejected = train_dto['rejected']
         self.nofilter = train_dto['nofilter']
+        self.stream = train_dto['stream']
+        self.num_workers = train_dto['num_workers']
+        self.dense_stride = train_dto['dense_stride']
+        self.thresholds = train_dto['thresholds']
+        self.curve = train_dto['curve']
+        self.processes = train_dto['processes']
+        self.cache = train_dto['cache']
+        self.cache_size = train_dto['cache_size']
+        self.score_cache = None
+        self.cascade = train_dto['cascade']
+        self.geometric_cascade = None
+        self.profile = train_dto['profile']
+        self.profile_trace = train_dto['profile_trace']
+
+    def _outputs(self):
+        """ Get the threshold and the output files of each filtered
+        tractogram, i.e. one per threshold of the sweep with
+        `thresholds`.
+
+        Returns:
+            A list of (threshold, out, rejected) tuples.
+        """
+
+        if not self.thresholds:
+            return [(self.threshold, self.out, self.rejected)]
+
+        return [(threshold, threshold_filename(self.out, threshold),
+                 threshold_filename(self.rejected, threshold)
+                 if self.rejected else None)
+                for threshold in self.thresholds]
+
+    def _forward(self, model, batch_dirs):
+        """ Score a batch of streamline features.
+
+        Args:
+            model: The model to use for prediction.
+            batch_dirs: The directions between points of the streamlines.
+
+        Returns:
+            The scores of the streamlines, as a numpy array.
+        """
+
+        with stage('forward', len(batch_dirs)), \
+                torch.profiler.record_function('forward'), \
+                torch.autocast(cast_device, dtype=self.dtype,
+                               enabled=self.dtype != torch.float32):
+            with torch.no_grad():
+                batch = torch.as_tensor(
+                    batch_dirs, dtype=self.dtype, device=device)
+                pred_batch = model(batch)
+
+            return pred_batch.float().cpu().numpy()
+
+    def _cached_forward(self, model, batch_dirs):
+        """ Score a batch of streamline features, only running the model
+        on the streamlines missing from the score cache.
+
+        Args:
+            model: The model to use for prediction.
+            batch_dirs: The directions between points of the streamlines.
+
+        Returns:
+            The scores of the streamlines, as a numpy array.
+        """
+
+        if self.score_cache is None:
+            return self._forward(model, batch_dirs)
+
+        keys = self.score_cache.keys(batch_dirs)
+        predictions, hits = self.score_cache.get(keys)
+        if not np.all(hits):
+            predictions[~hits] = self._forward(
+                model, batch_dirs[torch.as_tensor(~hits)])
+            self.score_cache.put(keys[~hits], predictions[~hits])
+
+        return predictions
+
+    def _cascaded_forward(self, model, batch_dirs):
+        """ Score a batch of streamline features, only running the model
+        on the streamlines left ambiguous by the geometric cascade.
 
-    def predict(self, model, sft):
+        Args:
+            model: The model to use for prediction.
+            batch_dirs: The directions between points of the streamlines.
+
+        Returns:
+            The scores of the streamlines, as a numpy array.
+        """
+
+        if self.geometric_cascade is None:
+            return self._cached_forward(model, batch_dirs)
+
+        with stage('cascade', len(batch_dirs)):
+            decided, predictions = self.geometric_cascade.decide(batch_dirs)
+        if not np.all(decided):
+            predictions[~decided] = self._cached_forward(
+                model, batch_dirs[torch.as_tensor(~decided)])
+
+        return predictions
+
+    def predict(self, model, sft, start=0, end=None, progress=True):
         """ Predict the scores of the streamlines.
 
         Args:
             model: The model to use for prediction.
             data: The data to predict on.
+            start: Index of the first streamline to score.
+            end: Index following the last streamline to score. Defaults
+                to the number of streamlines.
+            progress: Show a progress bar.
 
         Returns:
             The scores of the streamlines.
         """
 
-        # Get the directions between points of the streamlines
+        end = len(sft) if end is None else end
+
+        def _prepare(i):
+            # Get the directions between points of the streamlines. The
+            # features are prepared on the CPU by the worker threads and
+            # moved to the device when scored.
+            j = min(i + self.batch_size, end)
+            with stage('prepare', j - i):
+                return i, get_data(sft[i:j], cpu_device, self.dtype)
+
+        batches = prefetch_map(
+            _prepare, range(start, end, self.batch_size), self.num_workers)
+
+        predictions = np.zeros((end - start))
+        for i, batch_dirs in tqdm(
+                batches, total=int(np.ceil((end - start) / self.batch_size)),
+                disable=not progress):
+            # Predict while the next batches are being prepared
+            predictions[i - start:i - start + len(batch_dirs)] = \
+                self._cascaded_forward(model, batch_dirs)
+
+        return predictions
+
+    def sharded_predict(self, model, sft):
+        """ Predict the scores of the streamlines with several processes,
+        each scoring contiguous shards of the streamlines. The model and
+        the tractogram are shared with the processes rather than copied,
+        and the threads available are split between the processes.
+
+        Args:
+            model: The model to use for prediction.
+            sft: The streamlines to predict on.
+
+        Returns:
+            The scores of the streamlines, in their original order.
+        """
+        global _shard_context
+
         total = len(sft)
+        # More shards than processes to balance the load between them
+        shard_size = max(1, int(np.ceil(total / (4 * self.processes))))
+        shards = [(i, min(i + shard_size, total))
+                  for i in range(0, total, shard_size)]
+        nb_threads = max(1, (os.cpu_count() or 1) // self.processes)
+
+        # Weights are moved to shared memory so that no process ever
+        # holds its own copy of them
+        model.share_memory()
+        _shard_context = (self, model, sft)
 
         predictions = np.zeros((total))
-        for i in tqdm(range(0, total, self.batch_size)):
-            j = i + self.batch_size
-            # Load the features as torch tensors and predict
-            batch_dirs = get_data(sft[i:j], device)
+        ctx = mp.get_context('fork')
+        with ctx.Pool(self.processes, initializer=_init_shard_worker,
+                      initargs=(nb_threads,)) as pool:
+            for start, shard_predictions in tqdm(
+                    pool.imap(_predict_shard, shards), total=len(shards)):
+                predictions[start:start + len(shard_predictions)] = \
+                    shard_predictions
 
-            with torch.autocast(cast_device, enabled=cast_device == 'cuda'):
-                with torch.no_grad():
-                    batch = torch.as_tensor(
-                        batch_dirs, dtype=torch.float, device=device)
-                    pred_batch = model(batch)
-                    predictions[i:j] = pred_batch.cpu().numpy()
+        _shard_context = None
 
         return predictions
 
+    def stream_predict(self, model):
+        """ Score the tractogram chunk by chunk and append the streamlines
+        to the output files as they are scored. Only a few chunks of
+        `batch_size` streamlines are held in memory at a time, regardless
+        of the size of the tractogram.
+
+        Args:
+            model: The model to use for prediction.
+
+        Returns:
+            The number of kept streamlines, for each threshold with
+            `thresholds`, and the total number of streamlines.
+        """
+
+        # Voxel space is defined by the reference, which can be the
+        # tractogram itself for .trk files.
+        reference = self.tractogram if self.reference == 'same' \
+            else self.reference
+        affine, *_ = get_reference_info(reference)
+
+        # All thresholds are written in the same pass over the tractogram
+        outputs = self._outputs()
+        outs = [StreamingTractogramWriter(out, reference)
+                for _, out, _ in outputs]
+        rejecteds = [StreamingTractogramWriter(rejected, reference)
+                     if rejected else None for _, _, rejected in outputs]
+
+        def _prepare(streamlines):
+            # Only the features are computed in voxel space, the
+            # streamlines are written back in their original space.
+            with stage('prepare', len(streamlines)):
+                return streamlines, get_streamlines_data(
+                    rasmm_to_vox_corner(streamlines, affine), cpu_device,
+                    self.dtype)
+
+        chunks = prefetch_map(
+            _prepare, iter_tractogram_chunks(self.tractogram, self.batch_size),
+            self.num_workers)
+
+        kept, total = np.zeros(len(outputs), dtype=int), 0
+        for streamlines, batch_dirs in tqdm(chunks):
+            predictions = self._cascaded_forward(model, batch_dirs)
+
+            with stage('write', len(streamlines)):
+                for k, (threshold, _, _) in enumerate(outputs):
+                    mask = predictions > threshold
+                    if self.nofilter:
+                        outs[k].write(streamlines, predictions)
+                    else:
+                        outs[k].write(streamlines[mask], predictions[mask])
+                    if rejecteds[k] is not None:
+                        rejecteds[k].write(
+                            streamlines[~mask], predictions[~mask])
+
+                    kept[k] += np.count_nonzero(mask)
+            total += len(streamlines)
+
+        for writer in outs + rejecteds:
+            if writer is not None:
+                writer.close()
+
+        return (kept if self.thresholds else kept[0]), total
+
     def dense_predict(self, model, sft):
         """ Predict the scores of the streamlines point by point. This will
         be slower than predict, but is useful for visualizing the scores.
 
+        The score of a point is the score of the streamline cut just
+        before it. The cut streamlines of many streamlines are packed
+        into full batches. With `dense_stride` k, only every k-th cut
+        (and the last one) is scored and the scores of the points in
+        between are linearly interpolated.
+
         Args:
             model: The model to use for prediction.
             data: The data to predict on.
 
         Returns:
-            scores: The scores of the streamlines.
+            scores: The scores of the streamlines, as an ArraySequence
+                of (L, 1) arrays.
 
         """
 
+        # Causal models score every prefix in a single forward pass
+        if hasattr(model, 'forward_prefixes'):
+            return self.causal_dense_predict(model, sft)
+
         sft.to_vox()
         sft.to_corner()
 
-        lengths = [len(s) for s in sft.streamlines]
-        scores_per_point = np.zeros((len(lengths), max(lengths), 1))
+        streamlines = sft.streamlines
+        stride = self.dense_stride
+        lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+        offsets = np.asarray(streamlines._offsets, dtype=np.int64)
+
+        # Lengths of the cut streamlines to score for each streamline:
+        # 3, 3 + k, 3 + 2k, ... and the streamline minus its last point
+        nb_regular = np.maximum(0, -(-(lengths - 3) // stride))
+        has_last = (lengths > 3) & ((lengths - 4) % stride != 0)
+        nb_cuts = nb_regular + has_last
+        first_cut = np.cumsum(nb_cuts) - nb_cuts
+
+        cut_ids = np.repeat(np.arange(len(lengths)), nb_cuts)
+        cut_lengths = 3 + stride * (
+            np.arange(nb_cuts.sum()) - np.repeat(first_cut, nb_cuts))
+        last = (first_cut + nb_cuts - 1)[has_last]
+        cut_lengths[last] = lengths[has_last] - 1
+
+        def _prepare(i):
+            # The cut streamlines are views over the streamlines' points
+            j = i + self.batch_size
+            cuts = ArraySequence()
+            cuts._data = streamlines._data
+            cuts._offsets = offsets[cut_ids[i:j]]
+            cuts._lengths = cut_lengths[i:j]
+            # Compute streamline features as the directions between points
+            with stage('prepare', len(cuts)):
+                dirs = resample_directions(cuts, 128)
+                return i, torch.as_tensor(dirs, dtype=self.dtype)
+
+        batches = prefetch_map(
+            _prepare, range(0, len(cut_ids), self.batch_size),
+            self.num_workers)
+
+        cut_scores = np.zeros(len(cut_ids))
+        for i, batch_dirs in tqdm(
+                batches, total=int(np.ceil(len(cut_ids) / self.batch_size))):
+            cut_scores[i:i + self.batch_size] = self._forward(
+                model, batch_dirs)
+
+        # Interpolate the scores of every point from the scored cuts
+        # around it. The first three points are not scored.
+        point_ids = np.repeat(np.arange(len(lengths)), lengths)
+        points = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        scored = points >= 3
+        point_ids, points = point_ids[scored], points[scored]
+
+        lo = (points - 3) // stride
+        hi = np.minimum(lo + 1, nb_cuts[point_ids] - 1)
+        lo = first_cut[point_ids] + lo
+        hi = first_cut[point_ids] + hi
+        span = cut_lengths[hi] - cut_lengths[lo]
+        weight = np.divide(points - cut_lengths[lo], span,
+                           out=np.zeros(len(points)), where=span > 0)
+
+        scores_per_point = np.zeros((lengths.sum(), 1))
+        scores_per_point[scored, 0] = \
+            (1. - weight) * cut_scores[lo] + weight * cut_scores[hi]
+
+        scores = ArraySequence()
+        scores._data = scores_per_point
+        scores._offsets = np.cumsum(lengths) - lengths
+        scores._lengths = lengths
+
+        return scores
 
-        # Predict the scores of the streamlines point by point, one streamlne
-        # at a time.
-        for i, s in enumerate(tqdm(sft.streamlines)):
-            length = len(scores_per_point[i])
-            streamlines = [s[:le] for le in range(3, length)]
+    def causal_dense_predict(self, model, sft):
+        """ Predict the scores of the streamlines point by point with a
+        causal model. A single forward pass over the directions of a
+        streamline scores all its prefixes, and each point gets the
+        score of the prefix ending at the previous point, i.e. the score
+        of the streamline scaled by the fraction of it the prefix covers.
 
-            # Resample streamlines to a fixed number of points. This should be
-            # set by the model ? TODO?
-            resampled_streamlines = set_number_of_points(streamlines, 128)
-            # Compute streamline features as the directions between points
-            dirs = np.diff(resampled_streamlines, axis=1)
+        Args:
+            model: The causal model to use for prediction.
+            sft: The streamlines to predict on.
+
+        Returns:
+            scores: The scores of the streamlines, as an ArraySequence
+                of (L, 1) arrays.
+
+        """
 
-            with torch.autocast(cast_device, enabled=cast_device == 'cuda'):
-                with torch.no_grad():
-                    data = torch.as_tensor(
-                        dirs, dtype=torch.float, device=device)
-                    pred_batch = model(data).cpu().numpy()
+        sft.to_vox()
+        sft.to_corner()
 
-            scores_per_point[i][3:] = pred_batch[:, None]
+        streamlines = sft.streamlines
+        total = len(streamlines)
+        lengths = np.asarray(streamlines._lengths, dtype=np.int64)
 
-        scores = [list(scores_per_point[i, :l])
-                  for i, l in enumerate(lengths)]
+        def _prepare(i):
+            j = i + self.batch_size
+            with stage('prepare', len(streamlines[i:j])):
+                return i, get_streamlines_data(
+                    streamlines[i:j], cpu_device, self.dtype)
+
+        batches = prefetch_map(
+            _prepare, range(0, total, self.batch_size), self.num_workers)
+
+        # Score of the first t + 1 resampled directions of each streamline
+        prefix_scores = np.zeros((total, 127))
+        for i, batch_dirs in tqdm(
+                batches, total=int(np.ceil(total / self.batch_size))):
+            j = i + self.batch_size
+            prefix_scores[i:j] = self._forward(
+                model.forward_prefixes, batch_dirs)
+
+        # Each prefix covers a fraction of the arc length of its
+        # streamline. Streamlines are spread two units apart so that all
+        # of them can be interpolated at once.
+        nb_prefixes = prefix_scores.shape[-1]
+        prefix_pos = 2 * np.arange(total)[:, None] + \
+            np.arange(1, nb_prefixes + 1)[None, :] / nb_prefixes
+
+        # Position of the point preceding each point. The first three
+        # points are not scored.
+        point_ids = np.repeat(np.arange(total), lengths)
+        points = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        fractions = np.roll(arc_length_fractions(streamlines), 1)
+        point_pos = 2 * point_ids + np.maximum(fractions, 1. / nb_prefixes)
+
+        scores_per_point = np.zeros((lengths.sum(), 1))
+        scores_per_point[:, 0] = np.interp(
+            point_pos, prefix_pos.ravel(), prefix_scores.ravel())
+        scores_per_point[points < 3] = 0.
+
+        scores = ArraySequence()
+        scores._data = scores_per_point
+        scores._offsets = np.cumsum(lengths) - lengths
+        scores._lengths = lengths
 
         return scores
 
-    def run(self):
-        """
-        Main method where the magic happens
+    def load_tractogram(self):
+        """ Load the tractogram to score.
+
+        Returns:
+            The tractogram.
         """
 
-        model = get_model(self.checkpoint)
+        # Only imported when needed, dipy's streamline IO is slow to import
+        from dipy.io.streamline import load_tractogram
 
         # Load the tractogram using a reference to make sure it can
         # go into proper voxel space.
-        sft = load_tractogram(self.tractogram, self.reference,
-                              bbox_valid_check=False, trk_header_check=False)
+        return load_tractogram(self.tractogram, self.reference,
+                               bbox_valid_check=False, trk_header_check=False)
+
+    def filter_tractogram(self, model, sft=None):
+        """ Score the tractogram and save the filtered streamlines.
+
+        Args:
+            model: The model to use for prediction.
+            sft: The tractogram, if already loaded. Loaded from
+                `tractogram` otherwise. Unused with `stream`.
+
+        Returns:
+            The number of kept streamlines, for each threshold with
+            `thresholds`, and the total number of streamlines.
+        """
+
+        if self.stream:
+            # Score and save the streamlines without loading the
+            # whole tractogram
+            return self.stream_predict(model)
+
+        if sft is None:
+            with stage('load_tractogram'):
+                sft = self.load_tractogram()
 
         if self.dense:
             # Predict the scores of the streamlines point by point
             predictions = self.dense_predict(model, sft)
+        elif self.processes > 1:
+            # Predict the scores of the streamlines with several processes
+            predictions = self.sharded_predict(model, sft)
         else:
             # Predict the scores of the streamlines
             predictions = self.predict(model, sft)
 
         # Save the filtered streamlines
         if not self.dense:
-            # Fetch the streamlines that passed the gauntlet
-            if self.nofilter:
-                ids = np.arange(0, len(predictions))
-            else:
-                # Save the filtered streamlines
-                print('Kept {}/{} streamlines ({}%).'.format(len(ids),
-                      len(sft), (len(ids) / len(sft) * 100)))
-
-                ids = np.argwhere(
-                    predictions > self.threshold).squeeze()
-
-            new_sft = StatefulTractogram.from_sft(sft[ids].streamlines, sft)
-
-            # Save the streamlines
-            save_filtered_streamlines(new_sft, predictions[ids], self.out)
+            outputs = self._outputs()
+            kept = np.zeros(len(outputs), dtype=int)
 
-            # Save the streamlines that rejected
-            if self.rejected:
-                # Fetch the streamlines that rejected
-                rejected_ids = np.setdiff1d(np.arange(predictions.shape[0]),
-                                            ids)
-
-                new_sft = StatefulTractogram.from_sft(
-                    sft[rejected_ids].streamlines, sft)
+            for k, (threshold, out, rejected) in enumerate(outputs):
+                # Fetch the streamlines that passed the gauntlet
+                mask = predictions > threshold
+                kept[k] = np.count_nonzero(mask)
 
                 # Save the streamlines
-                save_filtered_streamlines(
-                    new_sft, predictions[rejected_ids], self.rejected)
+                with stage('write', len(sft) if self.nofilter else kept[k]):
+                    save_filtered_streamlines(
+                        sft, predictions, out,
+                        ids=None if self.nofilter else mask)
+
+                # Save the streamlines that rejected
+                if rejected:
+                    with stage('write', len(sft) - kept[k]):
+                        save_filtered_streamlines(
+                            sft, predictions, rejected, ids=~mask)
+
+            return (kept if self.thresholds else kept[0]), len(sft)
         else:
             # Save all streamlines
             sft.data_per_point['score'] = predictions
 
-            save_filtered_streamlines(
-                sft, predictions, self.out, dense=self.dense)
+            with stage('write', len(sft)):
+                save_filtered_streamlines(
+                    sft, predictions, self.out, dense=self.dense)
+
+            return len(sft), len(sft)
+
+    def run(self):
+        """
+        Main method where the magic happens
+        """
+
+        profiler = StageProfiler() if self.profile else nullcontext()
+        with profiler:
+            with stage('load_model'):
+                model = load_model(
+                    self.checkpoint, self.backend, self.quantize,
+                    self.compile, self.batch_size)
+
+            if self.cache:
+                self.score_cache = ScoreCache(
+                    self.cache, model, self.cache_size)
+            if self.exit_margin is not None:
+                enable_early_exit(model, self.threshold, self.exit_margin)
+            if self.cascade:
+                self.geometric_cascade = GeometricCascade.load(self.cascade)
+
+            trace = nullcontext()
+            if self.profile_trace:
+                # Forward passes are labeled 'forward' in the trace
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if cast_device == 'cuda':
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                trace = torch.profiler.profile(activities=activities)
+            with trace:
+                kept, total = self.filter_tractogram(model)
+
+        if self.profile_trace:
+            trace.export_chrome_trace(self.profile_trace)
+        if self.profile:
+            report = profiler.report(
+                total, tractogram=self.tractogram,
+                checkpoint=self.checkpoint, backend=self.backend,
+                precision=self.precision, batch_size=self.batch_size,
+                num_workers=self.num_workers, stream=self.stream,
+                dense=self.dense, device=str(device),
+                torch_threads=torch.get_num_threads())
+            profiler.save(self.profile, report)
+            for s in report['stages']:
+                print('{}: {:.2f}s over {} calls{}{}.'.format(
+                    s['stage'], s['time'], s['calls'],
+                    ', {:.0f} streamlines/s'.format(s['streamlines_per_s'])
+                    if s['streamlines_per_s'] else '',
+                    ', {:+.0f} MB'.format(s['rss_delta_mb'])
+                    if s['rss_delta_mb'] is not None else ''))
+            print('Peak memory: {:.0f} MB.'.format(
+                report['process_peak_rss_mb']))
+
+        if self.thresholds:
+            # Kept-count curve of the sweep
+            curve = [{'threshold': threshold, 'kept': int(k), 'total': total,
+                      'percent': k / max(total, 1) * 100}
+                     for threshold, k in zip(self.thresholds, kept)]
+            for row in curve:
+                print('Threshold {}: kept {}/{} streamlines ({}%).'.format(
+                    row['threshold'], row['kept'], total, row['percent']))
+            if self.curve:
+                with open(self.curve, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=list(curve[0]))
+                    writer.writeheader()
+                    writer.writerows(curve)
+        elif not (self.dense or self.nofilter):
+            print('Kept {}/{} streamlines ({}%).'.format(
+                kept, total, (kept / max(total, 1) * 100)))
+
+        if self.score_cache is not None:
+            self.score_cache.close()
+            print('Score cache: {}/{} hits ({}%).'.format(
+                self.score_cache.hits, self.score_cache.lookups,
+                self.score_cache.hit_rate * 100))
+
+        if self.geometric_cascade is not None:
+            print('Cascade: decided {}/{} streamlines without the model '
+                  '({}%): {} rejected, {} accepted.'.format(
+                      self.geometric_cascade.nb_decided,
+                      self.geometric_cascade.nb_seen,
+                      self.geometric_cascade.skip_rate * 100,
+                      self.geometric_cascade.nb_rejected,
+                      self.geometric_cascade.nb_accepted))
+
+        if self.exit_margin is not None:
+            print('Average exit depth: {}/{} layers.'.format(
+                model.average_exit_depth, model.n_layers))
 
 
 def _build_arg_parser(parser):
+    # scilpy's IO utilities pull in fury and matplotlib, so they are only
+    # imported when parsing arguments
+    from scilpy.io.utils import add_overwrite_arg
+
     parser.add_argument('tractogram', type=str,
                         help='Tractogram file to score.')
     parser.add_argument('out', type=str,
@@ -179,33 +722,201 @@ def _build_arg_parser(parser):
                         help='Reference file for tractogram (.nii.gz).'
                              'For .trk, can be \'same\'. Default is '
                              '[%(default)s].')
+    parser.add_argument('--thresholds', type=parse_thresholds,
+                        help='Score the tractogram once and save one '
+                             'filtered tractogram per threshold, given as '
+                             'a\ncomma-separated list (0.3,0.5,0.7) or an '
+                             'inclusive range (0.1:0.9:0.1). Outputs are '
+                             'named\nafter `out` and the threshold, e.g. '
+                             'out_0.5.trk. Overrides --threshold.')
+    parser.add_argument('--curve', type=str,
+                        help='With --thresholds, save the number of kept '
+                             'streamlines for each threshold to this CSV '
+                             'file.')
+    parser.add_argument('--profile', type=str,
+                        help='Save the wall time, the number of streamlines '
+                             'per second and the memory of each stage\n'
+                             'of the filtering (loading, preparing '
+                             'the features, forward passes, colormap,\n'
+                             'writing, ...) to this JSON file.')
+    parser.add_argument('--profile_trace', type=str,
+                        help='Save a trace of the PyTorch profiler of the '
+                             'scoring to this JSON file, to be opened\nin '
+                             'chrome://tracing or Perfetto.')
+
+    _add_scoring_args(parser)
+
+    add_overwrite_arg(parser)
+
+
+def _add_scoring_args(parser, rejected=True):
+    """ Add the options controlling how tractograms are scored, shared
+    with the batch predictor. """
     parser.add_argument('--batch_size', type=int, default=512,
                         help='Batch size for predictions. Default is '
                              '[%(default)s].')
     parser.add_argument('--threshold', type=float, default=0.5,
                         help='Threshold score for filtering. Default is '
                              '[%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='Number of threads preparing the next batches '
+                             'while the current one is scored. 0 prepares '
+                             'and scores batches one after the other. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of processes scoring shards of the '
+                             'tractogram in parallel on the CPU. The model is '
+                             'shared between the processes and the CPU '
+                             'threads are split between them. Default is '
+                             '[%(default)s].')
     parser.add_argument('--checkpoint', type=str,
                         default='model/tractoracle.ckpt',
                         help='Checkpoint (.ckpt) containing hyperparameters '
-                             'and weights of model. Default is '
-                             '[%(default)s].')
+                             'and weights of model, slim model (.pt) saved '
+                             'by\nexport_slim.py, or model exported with '
+                             'export_onnx.py (.onnx) for the onnxruntime\n'
+                             'backend. Default is [%(default)s].')
+    parser.add_argument('--backend', choices=BACKENDS, default='torch',
+                        help='Inference backend. Checkpoints (.ckpt) are '
+                             'exported to ONNX on the fly for onnxruntime. '
+                             '\nDefault is [%(default)s].')
+    parser.add_argument('--quantize', choices=list(QUANTIZATION_DTYPES),
+                        help='Quantize the linear layers of the model on the '
+                             'fly for CPU inference. Models saved by\n'
+                             'quantize_model.py are already quantized. Only '
+                             'supported by the torch backend.')
+    parser.add_argument('--precision', choices=list(PRECISIONS),
+                        help='Precision of the features and of the '
+                             'computations of the model. Reduced precisions '
+                             'run\nthe model under torch.autocast. By '
+                             'default, fp16 on GPU and fp32 on CPU.')
+    parser.add_argument('--exit_margin', type=float,
+                        help='With a model trained with --early_exit, stop '
+                             'scoring a streamline after the first layer\n'
+                             'whose score is at least this far from '
+                             '--threshold. All layers are used by default.')
+    parser.add_argument('--compile', action='store_true',
+                        help='Compile the model with torch.compile. Batches '
+                             'are padded to --batch_size streamlines so\n'
+                             'that the model is compiled only once. Only '
+                             'supported by the torch backend.')
 
     g = parser.add_mutually_exclusive_group()
     g.add_argument('--nofilter', action='store_true',
                    help='Output a tractogram containing all streamlines '
                    'instead of only plausible ones.')
-    g.add_argument('--rejected', type=str, default=None,
-                   help='Output file for invalid streamlines.')
+    if rejected:
+        g.add_argument('--rejected', type=str, default=None,
+                       help='Output file for invalid streamlines.')
     g.add_argument('--dense', action='store_true',
                    help='Predict the scores of the streamlines point by point.'
                         ' Streamlines\' endpoints should be uniformized for'
                         ' best visualization.')
 
-    add_overwrite_arg(parser)
+    parser.add_argument('--dense_stride', type=int, default=1,
+                        help='With --dense, only score every k-th point of '
+                             'the streamlines and interpolate the scores of '
+                             'the points in between. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read, score and write the tractogram chunk by '
+                             'chunk of --batch_size streamlines instead of '
+                             'loading it in memory. Only .trk and .tck '
+                             'files are supported. Cannot be used with '
+                             '--dense.')
+    parser.add_argument('--cascade', type=str,
+                        help='Rules (.json) calibrated by '
+                             'calibrate_cascade.py. Streamlines decided by '
+                             'their\ngeometric features are given a score of '
+                             '0 or 1 without running the model.')
+    parser.add_argument('--cache', type=str,
+                        help='Score cache (.npy), created if it does not '
+                             'exist. Streamlines scored before with the same '
+                             'model\nare not scored again, e.g. when '
+                             'filtering a tractogram with another '
+                             '--threshold.')
+    parser.add_argument('--cache_size', type=int, default=10000000,
+                        help='Maximum number of scores in the cache. The '
+                             'least recently used scores are evicted '
+                             'first.\nChanging the size of an existing '
+                             'cache clears it. Default is [%(default)s].')
+
+
+def _check_scoring_args(parser, args):
+    """ Validate the combinations of scoring options. """
+    from scilpy.io.utils import assert_inputs_exist
+
+    if args.stream and args.dense:
+        parser.error('--stream cannot be used with --dense.')
+
+    if args.dense_stride < 1:
+        parser.error('--dense_stride must be at least 1.')
+
+    if args.processes > 1:
+        if args.dense or args.stream:
+            parser.error('--processes cannot be used with --dense or '
+                         '--stream.')
+        if torch.cuda.is_available():
+            parser.error('--processes is only supported for CPU inference.')
+        if 'fork' not in mp.get_all_start_methods():
+            parser.error('--processes is not supported on this platform.')
+
+    if args.backend == 'onnxruntime':
+        if args.processes > 1:
+            parser.error('--processes is only supported with the torch '
+                         'backend.')
+        try:
+            import onnxruntime  # noqa F401
+        except ImportError:
+            parser.error('The onnxruntime backend requires the onnxruntime '
+                         'package.')
+        if args.quantize or args.compile or args.precision:
+            parser.error('--quantize, --compile and --precision are only '
+                         'supported with the torch backend.')
+    elif args.checkpoint.endswith('.onnx'):
+        parser.error('.onnx models require --backend onnxruntime.')
+
+    if args.quantize and torch.cuda.is_available():
+        parser.error('--quantize is only supported for CPU inference.')
+
+    if args.compile and (args.quantize or args.processes > 1):
+        parser.error('--compile cannot be used with --quantize or '
+                     '--processes.')
+
+    if args.quantize and args.precision not in (None, 'fp32'):
+        parser.error('Quantized models only run in fp32.')
+
+    if args.exit_margin is not None:
+        if args.exit_margin < 0:
+            parser.error('--exit_margin must be positive.')
+        if getattr(args, 'thresholds', None) or args.cache or \
+                args.processes > 1 or args.backend != 'torch':
+            # Early exit depends on the threshold and the model
+            parser.error('--exit_margin cannot be used with --thresholds, '
+                         '--cache, --processes or the onnxruntime backend.')
+
+    if args.cascade:
+        assert_inputs_exist(parser, args.cascade)
+        if args.dense or args.nofilter or args.processes > 1:
+            # Decided streamlines have no meaningful score to save
+            parser.error('--cascade cannot be used with --dense, '
+                         '--nofilter or --processes.')
+
+    if args.cache:
+        if args.dense or args.processes > 1:
+            parser.error('--cache cannot be used with --dense or '
+                         '--processes.')
+        if args.precision not in (None, 'fp32'):
+            # Scores of different precisions would be mixed in the cache
+            parser.error('--cache can only be used with fp32 precision.')
+        if args.cache_size < 1:
+            parser.error('--cache_size must be at least 1.')
+
 
 def parse_args():
     """ Filter a tractogram. """
+    from scilpy.io.utils import assert_inputs_exist, assert_outputs_exist
+
     parser = argparse.ArgumentParser(
         description=parse_args.__doc__,
         formatter_class=RawTextHelpFormatter)
@@ -214,7 +925,30 @@ def parse_args():
     args = parser.parse_args()
 
     assert_inputs_exist(parser, args.tractogram)
-    assert_outputs_exist(parser, args, args.out, optional=args.rejected)
+    if args.thresholds:
+        if args.dense or args.nofilter:
+            parser.error('--thresholds cannot be used with --dense or '
+                         '--nofilter.')
+        assert_outputs_exist(
+            parser, args,
+            [threshold_filename(args.out, t) for t in args.thresholds],
+            optional=[threshold_filename(args.rejected, t)
+                      for t in args.thresholds if args.rejected] +
+            [args.curve])
+    else:
+        if args.curve:
+            parser.error('--curve requires --thresholds.')
+        assert_outputs_exist(parser, args, args.out, optional=args.rejected)
+
+    if args.profile or args.profile_trace:
+        if args.processes > 1:
+            # Stages run in the worker processes would not be recorded
+            parser.error('--profile and --profile_trace cannot be used with '
+                         '--processes.')
+        assert_outputs_exist(parser, args, [],
+                             optional=[args.profile, args.profile_trace])
+
+    _check_scoring_args(parser, args)
 
     return parser, args
 
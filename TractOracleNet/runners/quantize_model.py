@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import argparse
+import json
+
+import numpy as np
+import torch
+
+from argparse import RawTextHelpFormatter
+from dipy.io.streamline import load_tractogram
+
+from scilpy.io.utils import (
+    assert_inputs_exist, assert_outputs_exist, add_overwrite_arg)
+
+from TractOracleNet.models.quantization import (
+    QUANTIZATION_DTYPES, agreement, quantize_model, save_quantized)
+from TractOracleNet.models.utils import get_model
+from TractOracleNet.utils import get_data
+
+
+def score(model, sft, batch_size):
+    """ Score the streamlines of a tractogram.
+
+    Args:
+        model: The model to use for prediction.
+        sft: The streamlines to predict on.
+        batch_size: Number of streamlines per forward pass.
+
+    Returns:
+        The scores of the streamlines.
+    """
+
+    predictions = np.zeros((len(sft)))
+    with torch.no_grad():
+        for i in range(0, len(sft), batch_size):
+            batch_dirs = get_data(sft[i:i + batch_size], torch.device('cpu'))
+            predictions[i:i + len(batch_dirs)] = \
+                model(batch_dirs).float().cpu().numpy()
+    return predictions
+
+
+def _build_arg_parser(parser):
+    parser.add_argument('checkpoint', type=str,
+                        help='Checkpoint (.ckpt) containing hyperparameters '
+                             'and weights of model.')
+    parser.add_argument('out', type=str,
+                        help='Output quantized checkpoint (.ckpt).')
+    parser.add_argument('--dtype', choices=list(QUANTIZATION_DTYPES),
+                        default='int8',
+                        help='Type of the quantized weights. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--tractogram', type=str,
+                        help='Score this tractogram with both models and '
+                             'report how many keep/reject decisions\n'
+                             'change at --threshold.')
+    parser.add_argument('--reference', type=str, default='same',
+                        help='Reference file for tractogram (.nii.gz).'
+                             'For .trk, can be \'same\'. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Threshold score for filtering. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--report', type=str,
+                        help='Save the agreement of the models to this JSON '
+                             'file.')
+
+    add_overwrite_arg(parser)
+
+
+def parse_args():
+    """ Quantize the linear layers of a model for CPU inference, to be used
+    as the `--checkpoint` of predictor.py. The quantized model can be
+    checked against the original one on a tractogram. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+
+    _build_arg_parser(parser)
+    args = parser.parse_args()
+
+    assert_inputs_exist(parser, args.checkpoint, optional=args.tractogram)
+    assert_outputs_exist(parser, args, args.out, optional=args.report)
+    if args.report and not args.tractogram:
+        parser.error('--report requires --tractogram.')
+
+    return parser, args
+
+
+def main():
+
+    parser, args = parse_args()
+
+    # The model is quantized in a copy, the original is left as is
+    model = get_model(args.checkpoint).to('cpu')
+    quantized = quantize_model(model, args.dtype)
+    save_quantized(quantized, args.out)
+
+    if args.tractogram:
+        sft = load_tractogram(args.tractogram, args.reference,
+                              bbox_valid_check=False,
+                              trk_header_check=False)
+        report = agreement(score(quantized, sft, args.batch_size),
+                           score(model, sft, args.batch_size),
+                           args.threshold)
+
+        print('{} agreement at threshold {}: {}/{} decisions unchanged '
+              '({}%), {} flipped to kept, {} flipped to rejected.'.format(
+                  args.dtype, args.threshold,
+                  report['streamlines'] - report['flipped_to_kept'] -
+                  report['flipped_to_rejected'], report['streamlines'],
+                  report['agreement'] * 100, report['flipped_to_kept'],
+                  report['flipped_to_rejected']))
+        print('Score deviation: max {}, mean {}.'.format(
+            report['max_deviation'], report['mean_deviation']))
+
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import argparse
+
+from argparse import RawTextHelpFormatter
+
+from TractOracleNet.backends import load_model
+from TractOracleNet.serving import ScoringServer
+
+
+def _build_arg_parser(parser):
+    parser.add_argument('--checkpoint', type=str,
+                        default='model/tractoracle.ckpt',
+                        help='Checkpoint (.ckpt) containing hyperparameters '
+                             'and weights of model, or slim model (.pt)\n'
+                             'saved by export_slim.py. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to listen on. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port to listen on. Default is [%(default)s].')
+    parser.add_argument('--max_batch_size', type=int, default=512,
+                        help='Maximum number of streamlines scored in a '
+                             'single batch. Default is [%(default)s].')
+    parser.add_argument('--max_wait', type=float, default=5.,
+                        help='Maximum time to wait for other requests before '
+                             'scoring a batch, in ms. Default is '
+                             '[%(default)s].')
+
+
+def parse_args():
+    """ Serve a model scoring streamlines over HTTP. Concurrent requests
+    are merged into batches.
+
+    POST /score  Score streamlines, in voxel space with the origin at the
+                 corner of the voxels. See TractOracleNet.serving.OracleClient.
+    GET /stats   Latency and throughput counters, as JSON.
+    """
+    # scilpy's IO utilities pull in fury and matplotlib, so they are only
+    # imported when parsing arguments
+    from scilpy.io.utils import assert_inputs_exist
+
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+
+    _build_arg_parser(parser)
+    args = parser.parse_args()
+
+    assert_inputs_exist(parser, args.checkpoint)
+
+    if args.max_batch_size < 1:
+        parser.error('--max_batch_size must be at least 1.')
+    if args.max_wait < 0:
+        parser.error('--max_wait cannot be negative.')
+
+    return parser, args
+
+
+def main():
+
+    parser, args = parse_args()
+
+    model = load_model(args.checkpoint)
+
+    server = ScoringServer(model, args.host, args.port,
+                           args.max_batch_size, args.max_wait / 1000.)
+    print('Serving on {}:{}.'.format(args.host, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
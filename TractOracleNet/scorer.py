@@ -0,0 +1,219 @@
+import torch
+
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from TractOracleNet.resampling import flatten_streamlines
+
+"""
+Scoring of streamlines held as arrays or tensors, without building a
+StatefulTractogram. Resampling is done with torch on the device of the
+model so that streamlines already on the GPU never leave it.
+"""
+
+
+def pad_streamlines(streamlines, device=None):
+    """ Move streamlines to a padded tensor.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence or list of np.ndarray
+        Streamlines.
+    device : torch.device, optional
+        Device of the padded tensor.
+
+    Returns
+    -------
+    points : torch.Tensor (N, L, 3)
+        Streamlines padded to the length L of the longest one.
+    lengths : torch.Tensor (N,)
+        Number of points of each streamline.
+    """
+    if not isinstance(streamlines, ArraySequence):
+        streamlines = ArraySequence(streamlines)
+
+    flat, lengths = flatten_streamlines(streamlines)
+    flat = torch.as_tensor(flat, device=device)
+    lengths = torch.as_tensor(lengths, device=device)
+
+    max_length = int(lengths.max()) if len(lengths) else 1
+    # Streamline and position of each point in the padded tensor
+    ids = torch.repeat_interleave(
+        torch.arange(len(lengths), device=device), lengths)
+    starts = torch.cumsum(lengths, 0) - lengths
+    pos = torch.arange(len(flat), device=device) - starts[ids]
+
+    points = flat.new_zeros((len(lengths), max_length, 3))
+    points[ids, pos] = flat
+
+    return points, lengths
+
+
+def resample_padded(points, lengths, nb_points=128):
+    """ Resample padded streamlines to a fixed number of points, equally
+    spaced along their arc length. Torch equivalent of
+    `TractOracleNet.resampling.resample_streamlines`.
+
+    Parameters
+    ----------
+    points : torch.Tensor (N, L, 3)
+        Padded streamlines.
+    lengths : torch.Tensor (N,)
+        Number of points of each streamline.
+    nb_points : int, optional
+        Number of points of the resampled streamlines.
+
+    Returns
+    -------
+    resampled : torch.Tensor (N, nb_points, 3)
+        Resampled streamlines.
+    """
+    N, L, _ = points.shape
+    lengths = lengths.to(points.device).long()
+
+    # Segments past the end of the streamlines have no length, so the
+    # arc length of the padding is the length of the streamline.
+    segments = points[:, 1:] - points[:, :-1]
+    valid = torch.arange(L - 1, device=points.device)[None] < \
+        (lengths[:, None] - 1)
+    segments = segments * valid[..., None]
+    seg_lengths = torch.linalg.vector_norm(segments, dim=-1)
+    arc = torch.cat((seg_lengths.new_zeros((N, 1)),
+                     torch.cumsum(seg_lengths, dim=1)), dim=1)
+
+    targets = torch.linspace(
+        0, 1, nb_points, device=points.device, dtype=points.dtype)
+    targets = targets[None] * arc[:, -1:]
+
+    # Segment of each resampled point
+    idx = torch.searchsorted(arc.contiguous(), targets, right=True) - 1
+    last = (lengths - 2).clamp(min=0)[:, None]
+    idx = torch.minimum(idx.clamp(min=0), last)
+
+    seg_lengths = torch.cat((seg_lengths, seg_lengths.new_zeros((N, 1))), 1)
+    segments = torch.cat((segments, segments.new_zeros((N, 1, 3))), 1)
+    seg = torch.gather(seg_lengths, 1, idx)
+    frac = torch.where(
+        seg > 0, (targets - torch.gather(arc, 1, idx)) / seg.clamp(min=1e-12),
+        torch.zeros_like(seg))
+
+    idx3 = idx[..., None].expand(-1, -1, 3)
+    return torch.gather(points, 1, idx3) + \
+        frac[..., None] * torch.gather(segments, 1, idx3)
+
+
+class OracleScorer():
+    """ Score streamlines held in memory with a model. Streamlines are
+    given in voxel space, or with an affine bringing them there, either as
+    an ArraySequence or as a padded array or tensor with the number of
+    points of each streamline.
+    """
+
+    def __init__(self, model, nb_points=128, batch_size=None):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            Model scoring the streamlines, in eval mode.
+        nb_points : int, optional
+            Number of points streamlines are resampled to.
+        batch_size : int, optional
+            Maximum number of streamlines per forward pass. All
+            streamlines are scored at once if not given.
+        """
+        self.model = model
+        self.nb_points = nb_points
+        self.batch_size = batch_size
+        self.device = next(model.parameters()).device
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint_file, **kwargs):
+        """ Build a scorer from a checkpoint.
+
+        Parameters
+        ----------
+        checkpoint_file : str
+            Checkpoint (.ckpt) containing hyperparameters and weights of
+            the model, or slim model (.pt) saved by export_slim.py.
+        kwargs : dict
+            Passed to the constructor.
+
+        Returns
+        -------
+        scorer : OracleScorer
+            Scorer.
+        """
+        from TractOracleNet.backends import load_model
+        return cls(load_model(checkpoint_file), **kwargs)
+
+    def features(self, streamlines, lengths=None, affine=None):
+        """ Compute the input features of the model.
+
+        Parameters
+        ----------
+        streamlines : ArraySequence, list of np.ndarray, np.ndarray or
+                torch.Tensor (N, L, 3)
+            Streamlines, padded if given as an array or tensor.
+        lengths : np.ndarray or torch.Tensor (N,), optional
+            Number of points of each padded streamline. All streamlines
+            have L points if not given.
+        affine : np.ndarray or torch.Tensor (4, 4), optional
+            Transform from the space of the streamlines to voxel space,
+            e.g. the inverse of the affine of the reference for
+            streamlines in RASMM. Translations do not change the
+            features, so the origin of the voxels does not matter.
+
+        Returns
+        -------
+        data : torch.Tensor (N, nb_points - 1, 3)
+            Directions between the points of the resampled streamlines,
+            on the device of the model.
+        """
+        if isinstance(streamlines, (ArraySequence, list, tuple)):
+            points, lengths = pad_streamlines(streamlines, self.device)
+        else:
+            points = torch.as_tensor(streamlines, device=self.device)
+            if lengths is None:
+                lengths = torch.full(
+                    (len(points),), points.shape[1], device=self.device)
+            lengths = torch.as_tensor(lengths, device=self.device)
+
+        points = points.float()
+        if affine is not None:
+            linear = torch.as_tensor(
+                affine, dtype=points.dtype, device=self.device)[:3, :3]
+            points = points @ linear.T
+
+        resampled = resample_padded(points, lengths, self.nb_points)
+
+        return resampled[:, 1:] - resampled[:, :-1]
+
+    def score(self, streamlines, lengths=None, affine=None):
+        """ Score streamlines.
+
+        Parameters
+        ----------
+        streamlines : ArraySequence, list of np.ndarray, np.ndarray or
+                torch.Tensor (N, L, 3)
+            Streamlines, padded if given as an array or tensor.
+        lengths : np.ndarray or torch.Tensor (N,), optional
+            Number of points of each padded streamline.
+        affine : np.ndarray or torch.Tensor (4, 4), optional
+            Transform from the space of the streamlines to voxel space.
+
+        Returns
+        -------
+        scores : torch.Tensor (N,)
+            Scores of the streamlines, on the device of the model.
+        """
+        with torch.no_grad():
+            data = self.features(streamlines, lengths, affine)
+            batch_size = self.batch_size or max(len(data), 1)
+            with torch.autocast(self.device.type,
+                                enabled=self.device.type == 'cuda'):
+                scores = [self.model(data[i:i + batch_size])
+                          for i in range(0, len(data), batch_size)]
+
+        return torch.cat(scores).float() if scores else \
+            torch.zeros(0, device=self.device)
+
+    __call__ = score
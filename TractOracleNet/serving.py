@@ -0,0 +1,413 @@
+import http.client
+import io
+import json
+import threading
+import time
+
+import numpy as np
+import torch
+
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from TractOracleNet.resampling import resample_directions
+
+"""
+Local scoring service keeping a model warm between requests. Concurrent
+requests are merged into batches before being scored, which amortizes
+the cost of a forward pass over many small requests.
+
+Requests and responses are NumPy arrays in the .npy format: a request
+holds the number of points of each streamline followed by all their
+points, in voxel space with the origin at the corner of the voxels, and
+the response holds the scores of the streamlines.
+"""
+
+
+def _write_arrays(*arrays):
+    """ Serialize arrays one after the other in the .npy format. """
+    buffer = io.BytesIO()
+    for array in arrays:
+        np.lib.format.write_array(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _read_arrays(data, nb_arrays):
+    """ Deserialize arrays written by `_write_arrays`. """
+    buffer = io.BytesIO(data)
+    return [np.lib.format.read_array(buffer, allow_pickle=False)
+            for _ in range(nb_arrays)]
+
+
+class ServiceStats():
+    """ Latency and throughput counters of the scoring service. Latencies
+    are kept for the last `window` requests only.
+    """
+
+    def __init__(self, window=1000):
+        """
+        Parameters
+        ----------
+        window : int, optional
+            Number of recent requests used for the latency percentiles.
+        """
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.latencies = deque(maxlen=window)
+        self.nb_requests = 0
+        self.nb_streamlines = 0
+        self.nb_batches = 0
+        self.batched_streamlines = 0
+
+    def record_request(self, nb_streamlines, latency):
+        with self.lock:
+            self.nb_requests += 1
+            self.nb_streamlines += nb_streamlines
+            self.latencies.append(latency)
+
+    def record_batch(self, nb_streamlines):
+        with self.lock:
+            self.nb_batches += 1
+            self.batched_streamlines += nb_streamlines
+
+    def as_dict(self):
+        """ Get the counters.
+
+        Returns
+        -------
+        stats : dict
+            Number of requests, streamlines and batches, mean batch size,
+            throughput in requests and streamlines per second since the
+            service started, and latency percentiles in seconds.
+        """
+        with self.lock:
+            uptime = time.perf_counter() - self.start
+            latencies = np.asarray(self.latencies)
+            stats = {
+                'uptime': uptime,
+                'requests': self.nb_requests,
+                'streamlines': self.nb_streamlines,
+                'batches': self.nb_batches,
+                'mean_batch_size':
+                    self.batched_streamlines / max(self.nb_batches, 1),
+                'requests_per_s': self.nb_requests / uptime,
+                'streamlines_per_s': self.nb_streamlines / uptime,
+            }
+        for p in (50, 95, 99):
+            stats['latency_p{}'.format(p)] = \
+                float(np.percentile(latencies, p)) if len(latencies) else 0.
+        return stats
+
+
+class DynamicBatcher():
+    """ Merge concurrent scoring requests into batches scored by a single
+    thread. A batch is scored as soon as it holds `max_batch_size`
+    streamlines or `max_wait` seconds after its first request arrived,
+    whichever comes first. Requests are never split between batches,
+    except those larger than `max_batch_size`, which are scored alone.
+    """
+
+    def __init__(self, model, max_batch_size=512, max_wait=0.005,
+                 stats=None):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            Model scoring the streamlines, in eval mode.
+        max_batch_size : int, optional
+            Maximum number of streamlines per batch.
+        max_wait : float, optional
+            Maximum time to wait for other requests before scoring a
+            batch, in seconds.
+        stats : ServiceStats, optional
+            Counters to update.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats or ServiceStats()
+        self.device = next(model.parameters()).device
+
+        self.queue = Queue()
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, data):
+        """ Queue streamlines to be scored.
+
+        Parameters
+        ----------
+        data : torch.Tensor (N, 127, 3)
+            Features of the streamlines.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Future resolving to the scores of the streamlines, as a
+            np.ndarray (N,).
+        """
+        future = Future()
+        self.queue.put((data, future))
+        return future
+
+    def close(self):
+        """ Stop the scoring thread once the queued requests are scored.
+        """
+        self.running = False
+        self.queue.put(None)
+        self.thread.join()
+
+    def _next_batch(self, pending):
+        """ Wait for a first request, then gather requests until the batch
+        is full or the deadline is reached.
+        """
+        if pending is None:
+            pending = self.queue.get()
+            if pending is None:
+                return [], None
+
+        batch, size = [pending], len(pending[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self.queue.get(timeout=max(timeout, 0)) \
+                    if timeout > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                # Start the next batch with the request that does not fit
+                return batch, request
+            batch.append(request)
+            size += len(request[0])
+
+        return batch, None
+
+    def _score(self, data):
+        """ Score features, in chunks of at most `max_batch_size`. """
+        scores = []
+        with torch.autocast(self.device.type,
+                            enabled=self.device.type == 'cuda'):
+            with torch.no_grad():
+                for i in range(0, len(data), self.max_batch_size):
+                    chunk = data[i:i + self.max_batch_size].to(
+                        self.device, torch.float)
+                    scores.append(self.model(chunk).float().cpu().numpy())
+                    self.stats.record_batch(len(chunk))
+        return np.concatenate(scores) if scores else np.zeros(0)
+
+    def _loop(self):
+        pending = None
+        while self.running or pending is not None or \
+                not self.queue.empty():
+            batch, pending = self._next_batch(pending)
+            if len(batch) == 0:
+                continue
+
+            try:
+                scores = self._score(torch.cat([d for d, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for data, future in batch:
+                future.set_result(scores[start:start + len(data)])
+                start += len(data)
+
+
+def _make_handler(batcher, nb_points):
+    """ Build the HTTP request handler of the service. """
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, code, body, content_type):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, code, message):
+            self._send(code, message.encode('utf-8'), 'text/plain')
+
+        def do_GET(self):
+            if self.path != '/stats':
+                return self._send_error(404, 'Unknown path.')
+            self._send(200, json.dumps(batcher.stats.as_dict()).encode(
+                'utf-8'), 'application/json')
+
+        def do_POST(self):
+            if self.path != '/score':
+                return self._send_error(404, 'Unknown path.')
+
+            start = time.perf_counter()
+            try:
+                body = self.rfile.read(
+                    int(self.headers['Content-Length']))
+                lengths, points = _read_arrays(body, 2)
+                if points.ndim != 2 or points.shape[-1] != 3 or \
+                        lengths.ndim != 1 or np.any(lengths < 1) or \
+                        lengths.sum() != len(points):
+                    raise ValueError('Invalid streamlines.')
+
+                streamlines = ArraySequence()
+                streamlines._data = points
+                streamlines._lengths = lengths.astype(np.int64)
+                streamlines._offsets = np.cumsum(
+                    streamlines._lengths) - streamlines._lengths
+
+                # Features are computed by the request threads, only the
+                # forward pass is serialized
+                data = torch.as_tensor(
+                    resample_directions(streamlines, nb_points),
+                    dtype=torch.float)
+            except Exception as e:
+                return self._send_error(400, str(e))
+
+            try:
+                scores = batcher.submit(data).result()
+            except Exception as e:
+                return self._send_error(500, str(e))
+
+            batcher.stats.record_request(
+                len(lengths), time.perf_counter() - start)
+            self._send(200, _write_arrays(scores.astype(np.float32)),
+                       'application/octet-stream')
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """ HTTP service scoring streamlines with a warm model. `POST /score`
+    scores streamlines and `GET /stats` returns the counters of the
+    service as JSON.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, model, host='127.0.0.1', port=0, max_batch_size=512,
+                 max_wait=0.005, nb_points=128):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            Model scoring the streamlines, in eval mode.
+        host : str, optional
+            Address to listen on.
+        port : int, optional
+            Port to listen on. 0 picks a free port.
+        max_batch_size : int, optional
+            Maximum number of streamlines per batch.
+        max_wait : float, optional
+            Maximum time to wait for other requests before scoring a
+            batch, in seconds.
+        nb_points : int, optional
+            Number of points streamlines are resampled to.
+        """
+        self.batcher = DynamicBatcher(model, max_batch_size, max_wait)
+        super().__init__(
+            (host, port), _make_handler(self.batcher, nb_points))
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+class OracleClient():
+    """ Client of the scoring service. Each thread uses its own
+    persistent connection, so a single client can be shared between
+    threads.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8000, timeout=60.):
+        """
+        Parameters
+        ----------
+        host : str, optional
+            Address of the service.
+        port : int, optional
+            Port of the service.
+        timeout : float, optional
+            Timeout of the requests, in seconds.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _request(self, method, path, body=None):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        connection = self.local.connection
+        try:
+            connection.request(method, path, body=body)
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+
+        if response.status != 200:
+            raise RuntimeError('Scoring service error {}: {}'.format(
+                response.status, data.decode('utf-8', 'replace')))
+        return data
+
+    def score(self, streamlines):
+        """ Score streamlines.
+
+        Parameters
+        ----------
+        streamlines : ArraySequence or list of np.ndarray
+            Streamlines in voxel space, with the origin at the corner of
+            the voxels.
+
+        Returns
+        -------
+        scores : np.ndarray (N,)
+            Scores of the streamlines.
+        """
+        if isinstance(streamlines, ArraySequence):
+            streamlines = list(streamlines)
+        lengths = np.asarray([len(s) for s in streamlines], dtype=np.int64)
+        points = np.concatenate(streamlines).astype(np.float32) \
+            if len(streamlines) else np.zeros((0, 3), dtype=np.float32)
+
+        data = self._request(
+            'POST', '/score', _write_arrays(lengths, points))
+        return _read_arrays(data, 1)[0]
+
+    def stats(self):
+        """ Get the counters of the service.
+
+        Returns
+        -------
+        stats : dict
+            See `ServiceStats.as_dict`.
+        """
+        return json.loads(self._request('GET', '/stats'))
+
+    def close(self):
+        """ Close the connection of the calling thread. """
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
@@ -0,0 +1,273 @@
+import numpy as np
+import nibabel as nib
+
+from dipy.io.stateful_tractogram import Origin, Space
+from dipy.io.utils import create_tractogram_header, get_reference_info
+from nibabel.affines import apply_affine
+from nibabel.streamlines.array_sequence import ArraySequence
+from nibabel.streamlines.trk import (
+    Field, TrkFile, encode_value_in_name, get_affine_rasmm_to_trackvis,
+    header_2_dtype)
+
+from TractOracleNet.profiling import stage
+from TractOracleNet.resampling import flatten_streamlines
+
+
+def score_colormap():
+    """ Colormap of the scores of the streamlines. scilpy's colormaps,
+    which pull in matplotlib, are only imported when coloring streamlines.
+
+    Returns
+    -------
+    cmap : callable
+        Colormap, mapping scores to RGBA colors in [0, 1].
+    """
+    from scilpy.viz.utils import get_colormap
+    return get_colormap('jet')
+
+
+def iter_tractogram_chunks(tractogram_file, chunk_size):
+    """ Lazily read a tractogram, chunk by chunk. Only one chunk of
+    streamlines is kept in memory at a time.
+
+    Parameters
+    ----------
+    tractogram_file : str
+        Tractogram (.trk or .tck) to read.
+    chunk_size : int
+        Number of streamlines per chunk.
+
+    Yields
+    ------
+    streamlines : ArraySequence
+        Chunk of at most `chunk_size` streamlines, in RASMM space.
+    """
+    tractogram = nib.streamlines.load(tractogram_file, lazy_load=True)
+
+    chunk = []
+    for s in tractogram.streamlines:
+        chunk.append(s)
+        if len(chunk) == chunk_size:
+            yield ArraySequence(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        yield ArraySequence(chunk)
+
+
+def rasmm_to_vox_corner(streamlines, affine):
+    """ Move streamlines from RASMM space to voxel space with the origin
+    at the corner of the voxels, i.e. what `sft.to_vox()` followed by
+    `sft.to_corner()` would do.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence
+        Streamlines in RASMM space.
+    affine : np.ndarray (4, 4)
+        Voxel to RASMM affine of the reference.
+
+    Returns
+    -------
+    vox_streamlines : ArraySequence
+        Copy of the streamlines in voxel space, corner origin.
+    """
+    points, lengths = flatten_streamlines(streamlines)
+
+    vox_streamlines = ArraySequence()
+    vox_streamlines._data = (apply_affine(
+        np.linalg.inv(affine), points) + 0.5).astype(np.float32)
+    vox_streamlines._lengths = lengths
+    vox_streamlines._offsets = np.cumsum(lengths) - lengths
+
+    return vox_streamlines
+
+
+def sft_to_rasmm(sft, streamlines):
+    """ Move streamlines of a tractogram from the space and origin of
+    the tractogram to RASMM space with the origin at the center of the
+    voxels, without modifying the tractogram, i.e. what `sft.to_rasmm()`
+    followed by `sft.to_center()` would do to these streamlines only.
+
+    Parameters
+    ----------
+    sft : StatefulTractogram
+        Tractogram defining the space and origin of the streamlines.
+    streamlines : ArraySequence
+        Streamlines of the tractogram, e.g. a subset of them.
+
+    Returns
+    -------
+    rasmm_streamlines : ArraySequence
+        Copy of the streamlines in RASMM space, center origin.
+    """
+    # Streamlines to voxel space, then to the center of the voxels and
+    # to RASMM space
+    to_vox = np.eye(4)
+    if sft.space == Space.VOXMM:
+        to_vox[:3, :3] = np.diag(1. / np.asarray(sft.voxel_sizes))
+    elif sft.space == Space.RASMM:
+        to_vox = np.linalg.inv(sft.affine)
+    if sft.origin == Origin.TRACKVIS:
+        to_vox[:3] -= 0.5 * to_vox[3]
+    affine = np.dot(sft.affine, to_vox)
+
+    points, lengths = flatten_streamlines(streamlines)
+
+    rasmm_streamlines = ArraySequence()
+    rasmm_streamlines._data = apply_affine(affine, points).astype(
+        np.float32)
+    rasmm_streamlines._lengths = lengths
+    rasmm_streamlines._offsets = np.cumsum(lengths) - lengths
+
+    return rasmm_streamlines
+
+
+class StreamingTractogramWriter():
+    """ Append streamlines to a .trk or .tck file as they are scored,
+    so that a tractogram never has to be held in memory. The streamline
+    count in the header is written when the writer is closed.
+
+    Streamlines are colored according to their scores if the format
+    supports it (.trk only).
+    """
+
+    # TCK delimiters, as written by MRtrix and nibabel
+    FIBER_DELIMITER = np.full((1, 3), np.nan, dtype='<f4')
+    EOF_DELIMITER = np.full((1, 3), np.inf, dtype='<f4')
+
+    def __init__(self, filename, reference):
+        """
+        Parameters
+        ----------
+        filename : str
+            Output tractogram (.trk or .tck).
+        reference : str
+            Reference anatomy (or .trk) defining the output space.
+        """
+        self.filename = filename
+        self.nb_streamlines = 0
+        # Created when the first colored streamlines are written
+        self.cmap = None
+
+        self.format = nib.streamlines.detect_format(filename)
+        if self.format not in (TrkFile, nib.streamlines.TckFile):
+            raise ValueError(
+                'Streaming is only supported for .trk and .tck files, '
+                'got {}.'.format(filename))
+
+        self.f = open(filename, 'wb')
+        if self.format is TrkFile:
+            self._write_trk_header(reference)
+        else:
+            self._write_tck_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_trk_header(self, reference):
+        """ Write a temporary TRK header built from the reference. Points
+        will be saved in trackvis space, with a color per point.
+        """
+        header = create_tractogram_header(
+            TrkFile, *get_reference_info(reference))
+
+        self.header = np.zeros((), dtype=header_2_dtype.newbyteorder('<'))
+        for k in self.header.dtype.names:
+            self.header[k] = header[k]
+        self.header['scalar_name'][0] = encode_value_in_name(3, 'color')
+        self.header[Field.NB_SCALARS_PER_POINT] = 3
+        self.header[Field.NB_PROPERTIES_PER_STREAMLINE] = 0
+
+        self.affine = get_affine_rasmm_to_trackvis(self.header)
+        self.f.write(self.header.tobytes())
+
+    def _write_tck_header(self):
+        """ Write a temporary TCK header. The count field has a fixed
+        width so it can be overwritten once all streamlines are written.
+        """
+        header = ('mrtrix tracks\ncount: {:010}\n'
+                  'datatype: Float32LE\nfile: . ')
+        header = header.format(self.nb_streamlines)
+
+        # The data offset includes its own string representation
+        offset = len(header) + len('\nEND\n')
+        offset += len(str(offset + len(str(offset))))
+        header = '{}{}\nEND\n'.format(header, offset)
+
+        self.f.seek(0)
+        self.f.write(header.encode('utf-8'))
+
+    def write(self, streamlines, scores):
+        """ Append streamlines to the file.
+
+        Parameters
+        ----------
+        streamlines : ArraySequence
+            Streamlines to write, in RASMM space.
+        scores : np.ndarray (N,)
+            Scores of the streamlines, used to color them.
+        """
+        if len(streamlines) == 0:
+            return
+
+        points, lengths = flatten_streamlines(streamlines)
+        nb_streamlines = len(lengths)
+        # Index of the streamline each point belongs to
+        ids = np.repeat(np.arange(nb_streamlines), lengths)
+
+        if self.format is TrkFile:
+            with stage('colormap', nb_streamlines):
+                if self.cmap is None:
+                    self.cmap = score_colormap()
+                color = self.cmap(np.asarray(scores))[:, 0:3] * 255
+            values = np.empty((len(points), 6), dtype='<f4')
+            np.matmul(points, self.affine[:3, :3].T.astype('<f4'),
+                      out=values[:, :3])
+            values[:, :3] += self.affine[:3, 3]
+            values[:, 3:] = color[ids]
+
+            # Each record is the number of points (int32) followed by the
+            # points and their colors (float32), all 4 bytes wide.
+            width = values.shape[-1]
+            record = np.empty(nb_streamlines + values.size, dtype='<f4')
+            starts = np.cumsum(lengths) - lengths
+            counts = np.arange(nb_streamlines) + width * starts
+            is_value = np.ones(len(record), dtype=bool)
+            is_value[counts] = False
+            record[is_value] = values.ravel()
+            record.view('<i4')[counts] = lengths
+        else:
+            # Streamlines are separated by a row of NaNs
+            record = np.empty(
+                (len(points) + nb_streamlines, 3), dtype='<f4')
+            pos = np.arange(len(points)) + ids
+            record[pos] = points
+            record[np.cumsum(lengths) + np.arange(nb_streamlines)] = \
+                self.FIBER_DELIMITER
+
+        self.f.write(record.tobytes())
+        self.nb_streamlines += nb_streamlines
+
+    def close(self):
+        """ Finalize the header with the number of streamlines written
+        and close the file.
+        """
+        if self.f.closed:
+            return
+
+        if self.format is TrkFile:
+            self.header[Field.NB_STREAMLINES] = self.nb_streamlines
+            if self.nb_streamlines == 0:
+                # Readers cannot load an empty tractogram with colors
+                self.header[Field.NB_SCALARS_PER_POINT] = 0
+                self.header['scalar_name'][0] = b''
+            self.f.seek(0)
+            self.f.write(self.header.tobytes())
+        else:
+            self.f.write(self.EOF_DELIMITER.tobytes())
+            self._write_tck_header()
+
+        self.f.close()
@@ -9,7 +9,9 @@ from lightning.pytorch.trainer import Trainer
 from lightning.pytorch.loggers import CometLogger
 from lightning.pytorch.callbacks import LearningRateMonitor
 
-from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.models.transformer import (
+    CausalTransformerOracle, EarlyExitTransformerOracle, TransformerOracle)
+from TractOracleNet.models.utils import get_model
 from TractOracleNet.trainers.data_module import StreamlineDataModule
 
 # Set the default precision to float32 to
@@ -37,7 +39,14 @@ class TractOracleNetTransformerTraining():
         self.max_ep = train_dto['max_ep']
         self.n_head = train_dto['n_head']
         self.n_layers = train_dto['n_layers']
+        self.embedding_size = train_dto['embedding_size']
+        self.dim_feedforward = train_dto['dim_feedforward']
+        self.patch_size = train_dto['patch_size']
         self.checkpoint = train_dto['checkpoint']
+        self.causal = train_dto['causal']
+        self.early_exit = train_dto['early_exit']
+        self.teacher = train_dto['teacher']
+        self.distillation_alpha = train_dto['distillation_alpha']
 
         # Data loading parameters
         self.num_workers = train_dto['num_workers']
@@ -61,12 +70,28 @@ class TractOracleNetTransformerTraining():
         self.input_size = (128-1) * 3  # Get this from datamodule ?
         self.output_size = 1
 
+        # The causal variant scores every prefix of the streamlines and
+        # the early-exit variant scores the streamlines after every layer
+        if self.causal:
+            model_class = CausalTransformerOracle
+        elif self.early_exit:
+            model_class = EarlyExitTransformerOracle
+        else:
+            model_class = TransformerOracle
+
         if self.checkpoint:
-            model = TransformerOracle.load_from_checkpoint(self.checkpoint)
+            model = model_class.load_from_checkpoint(self.checkpoint)
         else:
-            model = TransformerOracle(
+            model = model_class(
                 self.input_size, self.output_size, self.n_head,
-                self.n_layers, self.lr)
+                self.n_layers, self.lr, embedding_size=self.embedding_size,
+                dim_feedforward=self.dim_feedforward,
+                patch_size=self.patch_size)
+
+        # Train a smaller model against the scores of a trained one
+        if self.teacher:
+            model.distill_from(
+                get_model(self.teacher), self.distillation_alpha)
 
         # Instanciate the datamodule
         dm = StreamlineDataModule(
@@ -81,11 +106,16 @@ class TractOracleNetTransformerTraining():
 
         # Log parameters
         comet_logger.log_hyperparams({
-            "model": TransformerOracle.__name__,
+            "model": model_class.__name__,
             "lr": self.lr,
             "max_ep": self.max_ep,
             "n_layers": self.n_layers,
             "n_head": self.n_head,
+            "embedding_size": self.embedding_size,
+            "dim_feedforward": self.dim_feedforward,
+            "patch_size": self.patch_size,
+            "teacher": self.teacher,
+            "distillation_alpha": self.distillation_alpha,
             "batch_size": self.batch_size})
 
         # Log the learning rate during training as it will vary
@@ -130,6 +160,15 @@ def add_args(parser):
                         help='Number of attention heads.')
     parser.add_argument('--n_layers', type=int, default=4,
                         help='Number of encoder layers.')
+    parser.add_argument('--embedding_size', type=int, default=32,
+                        help='Size of the embeddings of the directions.')
+    parser.add_argument('--dim_feedforward', type=int, default=2048,
+                        help='Size of the feed-forward layers of the '
+                             'encoder.')
+    parser.add_argument('--patch_size', type=int, default=1,
+                        help='Number of consecutive directions embedded into '
+                             'one token, e.g. 4 for sequences of 32\ntokens '
+                             'instead of 127. Not supported by --causal.')
     parser.add_argument('--batch_size', type=int, default=(2**11+768),
                         help='Batch size, in number of streamlines.')
     parser.add_argument('--num_workers', type=int, default=20,
@@ -137,6 +176,24 @@ def add_args(parser):
     parser.add_argument('--checkpoint', type=str,
                         help='Path to checkpoint. If not provided, '
                              'train from scratch.')
+    variant = parser.add_mutually_exclusive_group()
+    variant.add_argument('--causal', action='store_true',
+                         help='Train a causal model scoring every prefix of '
+                              'the streamlines in one forward pass.')
+    variant.add_argument('--early_exit', action='store_true',
+                         help='Train a model with a score head after every '
+                              'layer, so that confidently scored\n'
+                              'streamlines can skip the last layers at '
+                              'inference (see predictor.py --exit_margin).')
+    parser.add_argument('--teacher', type=str,
+                        help='Checkpoint of a trained model. The model is '
+                             'trained against the scores of the teacher\n'
+                             '(knowledge distillation), e.g. to train a '
+                             'smaller and faster model.')
+    parser.add_argument('--distillation_alpha', type=float, default=1.,
+                        help='With --teacher, weight of the scores of the '
+                             'teacher in the targets, the scores of\nthe '
+                             'dataset having a weight of 1 - alpha.')
 
 
 def parse_args():
@@ -147,6 +204,12 @@ def parse_args():
         formatter_class=RawTextHelpFormatter)
     add_args(parser)
     args = parser.parse_args()
+    if args.patch_size < 1:
+        parser.error('--patch_size must be at least 1.')
+    if args.causal and args.patch_size > 1:
+        parser.error('--patch_size cannot be used with --causal.')
+    if not 0. <= args.distillation_alpha <= 1.:
+        parser.error('--distillation_alpha must be in [0, 1].')
     return args
 
 
@@ -1,29 +1,106 @@
+import nibabel as nib
 import numpy as np
 import torch
 
-from dipy.io.streamline import save_tractogram
-from dipy.tracking.streamline import set_number_of_points
-from scilpy.viz.utils import get_colormap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dipy.io.stateful_tractogram import StatefulTractogram
+from nibabel.streamlines.array_sequence import ArraySequence
 
+from TractOracleNet.profiling import stage
+from TractOracleNet.resampling import flatten_streamlines, resample_directions
+from TractOracleNet.streaming import (
+    StreamingTractogramWriter, score_colormap, sft_to_rasmm)
 
-def get_data(sft, device):
+
+def get_data(sft, device, dtype=torch.float):
     sft.to_vox()
     sft.to_corner()
 
-    resampled_streamlines = set_number_of_points(sft.streamlines, 128)
+    return get_streamlines_data(sft.streamlines, device, dtype)
+
+
+def get_streamlines_data(streamlines, device, dtype=torch.float):
+    """ Compute the model's input features from streamlines already in
+    voxel space with the origin at the corner of the voxels.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence
+        The streamlines, in voxel space and corner origin.
+    device : torch.device
+        Device to put the features on.
+    dtype : torch.dtype, optional
+        Dtype of the features.
+
+    Returns
+    -------
+    data : torch.Tensor (N, 127, 3)
+        Directions between the points of the resampled streamlines.
+    """
+
     # Compute streamline features as the directions between points
-    dirs = np.diff(resampled_streamlines, axis=1)
+    # of the streamlines resampled to 128 points
+    dirs = resample_directions(streamlines, 128)
 
     with torch.no_grad():
-        data = torch.as_tensor(
-            dirs, dtype=torch.float, device=device)
+        data = torch.as_tensor(dirs, dtype=dtype, device=device)
 
     return data
 
 
-def save_filtered_streamlines(sft, scores, out_tractogram, dense=False):
+def prefetch_map(func, iterable, num_workers, max_pending=None):
+    """ Apply a function to every item of an iterable using a pool of
+    threads, so that the next items are prepared while the current one
+    is consumed. Results are yielded in the order of the iterable and
+    at most `max_pending` items are in flight at any time, which bounds
+    memory usage.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to each item.
+    iterable : iterable
+        Items to process. Only consumed from the calling thread.
+    num_workers : int
+        Number of worker threads. If 0, items are processed serially
+        in the calling thread.
+    max_pending : int, optional
+        Maximum number of items submitted but not yet yielded. Defaults
+        to twice the number of workers.
+
+    Yields
+    ------
+    result
+        `func(item)` for each item, in order.
+    """
+
+    if num_workers <= 0:
+        for item in iterable:
+            yield func(item)
+        return
+
+    max_pending = max_pending or 2 * num_workers
+    with ThreadPoolExecutor(num_workers) as pool:
+        pending = deque()
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def save_filtered_streamlines(
+    sft, scores, out_tractogram, dense=False, ids=None
+):
     """ Save the filtered streamlines with the scores as colors.
 
+    Colors are only computed if the format can store them (i.e. not for
+    .tck). Streamlines with per streamline scores saved as .trk or .tck
+    are written directly from the points of the tractogram, without
+    building a new tractogram.
+
     Parameters
     ----------
     sft : StatefulTractogram
@@ -36,26 +113,62 @@ def save_filtered_streamlines(sft, scores, out_tractogram, dense=False):
         If True, the scores are dense and will be used as is.
         If False, the scores are per streamline and will be repeated for each
         point of the streamline.
+    ids : np.ndarray, optional
+        Indices (or boolean mask) of the streamlines to save, and of their
+        scores if not dense. All streamlines are saved if not given.
 
     """
 
-    cmap = get_colormap('jet')
-
-    if dense:
-        tmp = [np.squeeze(scores[s]) for s in
-               range(len(sft))]
-        data = np.hstack(tmp)
-    else:
-        data = np.squeeze(scores)
-
-    color = cmap(data)[:, 0:3] * 255
-    if not dense:
-        tmp = [np.tile([color[i][0], color[i][1], color[i][2]],
-                       (len(sft.streamlines[i]), 1))
-               for i in range(len(sft.streamlines))]
-        sft.data_per_point['color'] = tmp
-    else:
-        sft.data_per_point['color'] = sft.streamlines
-        sft.data_per_point['color']._data = color
-
-    save_tractogram(sft, out_tractogram)
+    tractogram_format = nib.streamlines.detect_format(out_tractogram)
+    has_color = tractogram_format is not nib.streamlines.TckFile
+
+    streamlines = sft.streamlines
+    if ids is not None:
+        # Views over the points of the tractogram, gathered only when
+        # written
+        streamlines = streamlines[ids]
+        scores = scores[ids]
+
+    if not dense and tractogram_format in (
+            nib.streamlines.TrkFile, nib.streamlines.TckFile):
+        # Only the saved points are moved to RASMM space, the
+        # tractogram is left as is
+        with StreamingTractogramWriter(out_tractogram, sft) as writer:
+            writer.write(sft_to_rasmm(sft, streamlines),
+                         np.squeeze(scores, axis=-1)
+                         if np.ndim(scores) > 1 else scores)
+        return
+
+    if ids is not None:
+        points, lengths = flatten_streamlines(streamlines)
+        streamlines = ArraySequence()
+        streamlines._data = points
+        streamlines._lengths = lengths
+        streamlines._offsets = np.cumsum(lengths) - lengths
+        sft = StatefulTractogram.from_sft(streamlines, sft)
+
+    if has_color:
+        with stage('colormap', len(sft)):
+            cmap = score_colormap()
+
+            if dense:
+                data = np.squeeze(scores._data, axis=-1) \
+                    if isinstance(scores, ArraySequence) else \
+                    np.hstack([np.squeeze(s) for s in scores])
+                color = cmap(data)[:, 0:3] * 255
+            else:
+                # One color per streamline, repeated for each of its points
+                color = cmap(np.squeeze(scores))[:, 0:3] * 255
+                color = np.repeat(
+                    color, np.asarray(sft.streamlines._lengths), axis=0)
+
+        colors = ArraySequence()
+        colors._data = color
+        colors._lengths = np.asarray(sft.streamlines._lengths)
+        colors._offsets = np.cumsum(colors._lengths) - colors._lengths
+        sft.data_per_point['color'] = colors
+
+    # dipy's streamline IO is slow to import and only used here
+    from dipy.io.streamline import save_tractogram
+    with stage('save_tractogram', len(sft)):
+        save_tractogram(sft, out_tractogram)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import argparse
+import json
+import time
+
+from argparse import RawTextHelpFormatter
+
+from benchmarks.synthetic import make_model, make_predictor, make_sft
+from TractOracleNet.backends import BACKENDS, OnnxModel, export_onnx
+
+"""
+Throughput of the inference backends on a synthetic tractogram. Run from
+the root of the repository:
+
+    python -m benchmarks.bench_backends --nb_streamlines 20000
+"""
+
+
+def bench_backends(nb_streamlines, batch_size=512, num_workers=4):
+    """ Time the scoring of a synthetic tractogram with each backend.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        Number of streamlines of the synthetic tractogram.
+    batch_size : int, optional
+        Batch size of the predictions.
+    num_workers : int, optional
+        Number of threads preparing batches.
+
+    Returns
+    -------
+    results : list of dict
+        Timing and throughput of each backend.
+    """
+    sft = make_sft(nb_streamlines)
+    model = make_model()
+    models = {'torch': model,
+              'onnxruntime': OnnxModel(export_onnx(model))}
+
+    predictor = make_predictor(
+        batch_size=batch_size, num_workers=num_workers)
+
+    results = []
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        predictor.predict(models[backend], sft, progress=False)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'backend': backend,
+            'time': elapsed,
+            'streamlines_per_s': nb_streamlines / elapsed})
+        print('{:>12}: {:8.2f}s {:10.1f} streamlines/s'.format(
+            backend, elapsed, results[-1]['streamlines_per_s']))
+
+    return results
+
+
+def parse_args():
+    """ Benchmark the inference backends of the predictor. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--nb_streamlines', type=int, default=20000,
+                        help='Number of synthetic streamlines. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='Threads preparing batches. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = bench_backends(
+        args.nb_streamlines, args.batch_size, args.num_workers)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
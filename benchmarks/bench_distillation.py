@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+from argparse import RawTextHelpFormatter
+
+from benchmarks.synthetic import make_predictor, make_sft
+from TractOracleNet.datasets.StreamlineBatchDataset import (
+    StreamlineBatchDataset)
+from TractOracleNet.models.quantization import agreement
+from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.models.utils import get_model
+
+"""
+Speed/accuracy table of a teacher model and of smaller students, e.g.
+trained with `transformer_train.py --teacher`. The throughput of each model
+is measured on a synthetic tractogram; with a test dataset, the error of
+each model against the scores of the dataset and the keep/reject
+decisions of the students changed from the teacher's are also reported.
+Without checkpoints, randomly initialized models of the `--sizes` are
+timed. Run from the root of the repository:
+
+    python -m benchmarks.bench_distillation --teacher teacher.ckpt \
+        --students small.ckpt,tiny.ckpt --dataset test.hdf5
+"""
+
+
+def load_dataset(dataset_file, nb_streamlines):
+    """ Load the first streamlines of a dataset, without augmentation.
+
+    Parameters
+    ----------
+    dataset_file : str
+        HDF5 dataset created by create_dataset.py.
+    nb_streamlines : int
+        Number of streamlines to load.
+
+    Returns
+    -------
+    dirs : torch.Tensor (N, 127, 3)
+        Directions between the points of the streamlines.
+    scores : np.ndarray (N,)
+        Target scores of the streamlines.
+    """
+    dataset = StreamlineBatchDataset(
+        dataset_file, noise=0., flip_p=0., dense=False)
+    nb_streamlines = min(nb_streamlines, dataset.length)
+    dirs, scores = dataset[list(range(nb_streamlines))]
+    return torch.as_tensor(dirs, dtype=torch.float), np.asarray(scores)
+
+
+def _score(model, dirs, batch_size):
+    """ Score features in batches. """
+    with torch.no_grad():
+        return torch.cat([model(dirs[i:i + batch_size])
+                          for i in range(0, len(dirs), batch_size)]).numpy()
+
+
+def bench_distillation(models, nb_streamlines, dataset=None, threshold=0.5,
+                       batch_size=512, num_workers=4):
+    """ Time each model and compare its scores to the first one's.
+
+    Parameters
+    ----------
+    models : dict of str to TransformerOracle
+        Models by name, in eval mode. The first one is the teacher.
+    nb_streamlines : int
+        Number of streamlines of the synthetic tractogram.
+    dataset : tuple, optional
+        Directions and target scores of test streamlines, see
+        `load_dataset`.
+    threshold : float, optional
+        Threshold at which keep/reject decisions are compared.
+    batch_size : int, optional
+        Batch size of the predictions.
+    num_workers : int, optional
+        Number of threads preparing batches.
+
+    Returns
+    -------
+    results : list of dict
+        Size, throughput and, with a dataset, accuracy of each model.
+    """
+    sft = make_sft(nb_streamlines)
+    predictor = make_predictor(
+        batch_size=batch_size, num_workers=num_workers)
+
+    results, teacher_scores = [], None
+    for name, model in models.items():
+        inference_model = model.for_inference()
+        start = time.perf_counter()
+        predictor.predict(inference_model, sft, progress=False)
+        elapsed = time.perf_counter() - start
+
+        result = {
+            'model': name,
+            'embedding_size': model.embedding_size,
+            'n_head': model.n_head,
+            'n_layers': model.n_layers,
+            'dim_feedforward': model.bert.layers[0].linear1.out_features,
+            'patch_size': model.patch_size,
+            'parameters': sum(p.numel() for p in model.parameters()),
+            'streamlines_per_s': len(sft) / elapsed}
+        # Speedup over the teacher
+        result['speedup'] = result['streamlines_per_s'] / \
+            results[0]['streamlines_per_s'] if results else 1.
+
+        if dataset is not None:
+            dirs, scores = dataset
+            predictions = _score(inference_model, dirs, batch_size)
+            if teacher_scores is None:
+                teacher_scores = predictions
+            report = agreement(predictions, teacher_scores, threshold)
+            result.update({
+                'mse': float(np.mean((predictions - scores) ** 2)),
+                'mae': float(np.mean(np.abs(predictions - scores))),
+                'accuracy': float(np.mean(
+                    (predictions > threshold) == (scores > threshold))),
+                'teacher_agreement': report['agreement'],
+                'teacher_mae': report['mean_deviation']})
+
+        results.append(result)
+
+    columns = ['model', 'embedding_size', 'n_head', 'n_layers',
+               'dim_feedforward', 'patch_size', 'parameters',
+               'streamlines_per_s', 'speedup']
+    if dataset is not None:
+        columns += ['mse', 'mae', 'accuracy', 'teacher_agreement']
+    print(' | '.join('{:>17}'.format(c) for c in columns))
+    for result in results:
+        print(' | '.join(
+            '{:>17.4g}'.format(result[c]) if isinstance(result[c], float)
+            else '{:>17}'.format(result[c]) for c in columns))
+
+    return results
+
+
+def parse_args():
+    """ Compare the speed and the accuracy of distilled models. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--teacher', type=str,
+                        help='Checkpoint of the teacher model.')
+    parser.add_argument('--students', type=str,
+                        help='Comma-separated checkpoints of the students.')
+    parser.add_argument('--sizes', type=str,
+                        default='32:4:4:2048,32:4:2:256,16:2:2:128,'
+                                '32:4:4:2048:4',
+                        help='Without checkpoints, comma-separated '
+                             'embedding_size:n_head:n_layers:dim_feedforward '
+                             'of\nrandomly initialized models, optionally '
+                             'followed by :patch_size, the first one being '
+                             'the\nteacher. Default is [%(default)s].')
+    parser.add_argument('--dataset', type=str,
+                        help='Test dataset (.hdf5) on which the accuracy of '
+                             'the models is computed.')
+    parser.add_argument('--nb_dataset_streamlines', type=int, default=100000,
+                        help='Number of streamlines of the dataset used. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--nb_streamlines', type=int, default=20000,
+                        help='Number of synthetic streamlines timed. Default '
+                             'is [%(default)s].')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Threshold at which decisions are compared. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='Threads preparing batches. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    args = parser.parse_args()
+    if bool(args.teacher) != bool(args.students):
+        parser.error('--teacher and --students must be given together.')
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if args.teacher:
+        models = {args.teacher: get_model(args.teacher)}
+        for student in args.students.split(','):
+            models[student] = get_model(student)
+    else:
+        torch.manual_seed(0)
+        models = {}
+        for size in args.sizes.split(','):
+            embedding_size, n_head, n_layers, dim_feedforward, \
+                *patch_size = (int(v) for v in size.split(':'))
+            models[size] = TransformerOracle(
+                (128 - 1) * 3, 1, n_head, n_layers, 1e-3,
+                embedding_size=embedding_size,
+                dim_feedforward=dim_feedforward,
+                patch_size=patch_size[0] if patch_size else 1).eval()
+
+    dataset = load_dataset(args.dataset, args.nb_dataset_streamlines) \
+        if args.dataset else None
+
+    results = bench_distillation(
+        models, args.nb_streamlines, dataset, args.threshold,
+        args.batch_size, args.num_workers)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+import argparse
+import json
+import time
+
+import torch
+
+from argparse import RawTextHelpFormatter
+
+from benchmarks.synthetic import make_predictor, make_sft
+from TractOracleNet.models.quantization import agreement
+from TractOracleNet.models.transformer import EarlyExitTransformerOracle
+from TractOracleNet.models.utils import get_model
+from TractOracleNet.runners.predictor import enable_early_exit
+from TractOracleNet.utils import get_data
+
+"""
+Throughput and average exit depth of `predictor.py --exit_margin` for
+several margins, on a synthetic tractogram. Without a checkpoint, a
+randomly initialized model is used, whose heads do not agree with each
+other: the threshold then defaults to the median score of the first head
+so that streamlines exit at various depths, and only the timings and the
+exit depths are meaningful. Run from the root of the repository:
+
+    python -m benchmarks.bench_early_exit --margins 0.01,0.02,0.05
+"""
+
+
+def bench_early_exit(model, nb_streamlines, margins, threshold=None,
+                     batch_size=512, num_workers=4):
+    """ Time the scoring of a synthetic tractogram with each margin.
+
+    Parameters
+    ----------
+    model : EarlyExitTransformerOracle
+        Model scoring the streamlines, in eval mode.
+    nb_streamlines : int
+        Number of streamlines of the synthetic tractogram.
+    margins : list of float
+        Margins to the threshold.
+    threshold : float, optional
+        Filtering threshold. Defaults to the median score of the first
+        head.
+    batch_size : int, optional
+        Batch size of the predictions.
+    num_workers : int, optional
+        Number of threads preparing batches.
+
+    Returns
+    -------
+    results : list of dict
+        Timing, average exit depth and agreement with the full model of
+        each margin.
+    """
+    sft = make_sft(nb_streamlines)
+    predictor = make_predictor(
+        batch_size=batch_size, num_workers=num_workers)
+
+    start = time.perf_counter()
+    full_scores = predictor.predict(model, sft, progress=False)
+    full_time = time.perf_counter() - start
+    print('{:>8}: {:8.2f}s'.format('full', full_time))
+
+    if threshold is None:
+        with torch.no_grad():
+            first_scores = model.forward_exits(
+                get_data(sft[:batch_size], torch.device('cpu')))[:, 0]
+        threshold = float(first_scores.median())
+
+    results = []
+    for margin in margins:
+        enable_early_exit(model, threshold, margin)
+        start = time.perf_counter()
+        scores = predictor.predict(model, sft, progress=False)
+        elapsed = time.perf_counter() - start
+
+        results.append(dict(
+            agreement(scores, full_scores, threshold),
+            margin=margin, time=elapsed, speedup=full_time / elapsed,
+            average_exit_depth=model.average_exit_depth))
+        print('{:>8}: {:8.2f}s (x{:.2f}), average exit depth {:.2f}/{}, '
+              '{} decisions flipped'.format(
+                  margin, elapsed, results[-1]['speedup'],
+                  model.average_exit_depth, model.n_layers,
+                  results[-1]['flipped_to_kept'] +
+                  results[-1]['flipped_to_rejected']))
+
+    return results
+
+
+def parse_args():
+    """ Benchmark early exit for several margins. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--nb_streamlines', type=int, default=20000,
+                        help='Number of synthetic streamlines. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--margins', type=str, default='0.01,0.02,0.05',
+                        help='Comma-separated margins. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--checkpoint', type=str,
+                        help='Checkpoint of a model trained with '
+                             '--early_exit. A randomly initialized model is '
+                             'used\nif not given.')
+    parser.add_argument('--threshold', type=float,
+                        help='Filtering threshold. Defaults to the median '
+                             'score of the first head.')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='Threads preparing batches. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.checkpoint:
+        model = get_model(args.checkpoint)
+    else:
+        torch.manual_seed(0)
+        model = EarlyExitTransformerOracle(
+            (128 - 1) * 3, 1, 4, 4, 1e-3).eval()
+
+    results = bench_early_exit(
+        model, args.nb_streamlines,
+        [float(m) for m in args.margins.split(',')], args.threshold,
+        args.batch_size, args.num_workers)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
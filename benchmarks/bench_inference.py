@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import argparse
+import json
+import time
+
+import torch
+
+from argparse import RawTextHelpFormatter
+
+from benchmarks.synthetic import make_model
+
+"""
+Latency of a forward pass of the model, as trained and as built for
+inference by `TransformerOracle.for_inference`, for several batch sizes.
+Run from the root of the repository:
+
+    python -m benchmarks.bench_inference --batch_sizes 1,16,512
+"""
+
+
+def bench_inference(batch_sizes, repeats=20, compile=False):
+    """ Time forward passes of each version of the model.
+
+    Parameters
+    ----------
+    batch_sizes : list of int
+        Number of streamlines per forward pass.
+    repeats : int, optional
+        Number of timed forward passes per batch size.
+    compile : bool, optional
+        Also time the inference model compiled with `torch.compile`.
+
+    Returns
+    -------
+    results : list of dict
+        Mean latency of each version of the model for each batch size.
+    """
+    model = make_model()
+
+    results = []
+    for batch_size in batch_sizes:
+        models = {'model': model,
+                  'inference': model.for_inference()}
+        if compile:
+            models['compiled'] = model.for_inference(batch_size, True)
+
+        x = torch.randn(batch_size, 127, 3)
+        for name, m in models.items():
+            with torch.no_grad():
+                # Warm up, which compiles the compiled model
+                m(x)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    m(x)
+                latency = (time.perf_counter() - start) / repeats
+
+            results.append({
+                'model': name,
+                'batch_size': batch_size,
+                'latency': latency,
+                'streamlines_per_s': batch_size / latency})
+            print('{:>10} {:6d}: {:10.2f}ms {:10.1f} streamlines/s'.format(
+                name, batch_size, latency * 1000,
+                results[-1]['streamlines_per_s']))
+
+    return results
+
+
+def parse_args():
+    """ Benchmark the inference model against the trained model. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--batch_sizes', type=str, default='1,16,512',
+                        help='Comma-separated batch sizes. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--repeats', type=int, default=20,
+                        help='Timed forward passes per batch size. Default '
+                             'is [%(default)s].')
+    parser.add_argument('--compile', action='store_true',
+                        help='Also time the model compiled with '
+                             'torch.compile.')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = bench_inference(
+        [int(b) for b in args.batch_sizes.split(',')], args.repeats,
+        args.compile)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import argparse
+import json
+import time
+
+from argparse import RawTextHelpFormatter
+from dipy.io.streamline import load_tractogram
+
+from benchmarks.synthetic import make_model, make_predictor, make_sft
+from TractOracleNet.backends import PRECISIONS, load_model
+from TractOracleNet.models.quantization import agreement
+
+"""
+Throughput of `predictor.py --precision` and deviation of the scores from
+fp32, on a reference tractogram or a synthetic one. Run from the root of
+the repository:
+
+    python -m benchmarks.bench_precision --tractogram sub-01.trk \
+        --checkpoint model/tractoracle.ckpt
+"""
+
+
+def bench_precision(model, sft, batch_size=512, num_workers=4,
+                    threshold=0.5):
+    """ Time the scoring of a tractogram in each precision and compare
+    the scores to the fp32 ones.
+
+    Parameters
+    ----------
+    model : TransformerOracle or InferenceOracle
+        Model scoring the streamlines.
+    sft : StatefulTractogram
+        Tractogram to score.
+    batch_size : int, optional
+        Batch size of the predictions.
+    num_workers : int, optional
+        Number of threads preparing batches.
+    threshold : float, optional
+        Threshold at which keep/reject decisions are compared.
+
+    Returns
+    -------
+    results : list of dict
+        Timing, throughput and agreement with fp32 of each precision.
+    """
+    results, reference_scores = [], None
+    for precision in PRECISIONS:
+        predictor = make_predictor(
+            batch_size=batch_size, num_workers=num_workers,
+            precision=precision)
+
+        start = time.perf_counter()
+        scores = predictor.predict(model, sft, progress=False)
+        elapsed = time.perf_counter() - start
+        if reference_scores is None:
+            reference_scores = scores
+
+        results.append(dict(
+            agreement(scores, reference_scores, threshold),
+            precision=precision, time=elapsed,
+            streamlines_per_s=len(sft) / elapsed))
+        print('{:>5}: {:8.2f}s {:10.1f} streamlines/s, max deviation '
+              '{:.2e}, {} decisions flipped'.format(
+                  precision, elapsed, results[-1]['streamlines_per_s'],
+                  results[-1]['max_deviation'],
+                  results[-1]['flipped_to_kept'] +
+                  results[-1]['flipped_to_rejected']))
+
+    return results
+
+
+def parse_args():
+    """ Benchmark the precisions of the predictor against fp32. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--tractogram', type=str,
+                        help='Reference tractogram. A synthetic tractogram '
+                             'is scored if not given.')
+    parser.add_argument('--reference', type=str, default='same',
+                        help='Reference anatomy of the tractogram. Default '
+                             'is [%(default)s].')
+    parser.add_argument('--checkpoint', type=str,
+                        help='Checkpoint of the model. A randomly '
+                             'initialized model is used if not given.')
+    parser.add_argument('--nb_streamlines', type=int, default=20000,
+                        help='Number of synthetic streamlines. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Threshold at which decisions are compared. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='Threads preparing batches. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    model = load_model(args.checkpoint) if args.checkpoint else \
+        make_model().for_inference()
+    sft = load_tractogram(args.tractogram, args.reference,
+                          bbox_valid_check=False, trk_header_check=False) \
+        if args.tractogram else make_sft(args.nb_streamlines)
+
+    results = bench_precision(
+        model, sft, args.batch_size, args.num_workers, args.threshold)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
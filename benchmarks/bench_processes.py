@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import time
+
+from argparse import RawTextHelpFormatter
+
+from benchmarks.synthetic import make_model, make_predictor, make_sft
+
+"""
+Scaling of `predictor.py --processes` on a synthetic tractogram. Run from
+the root of the repository:
+
+    python -m benchmarks.bench_processes --max_processes 8
+"""
+
+
+def bench_processes(
+    nb_streamlines, max_processes, batch_size=512, num_workers=0
+):
+    """ Time the scoring of a synthetic tractogram with 1 to
+    `max_processes` processes.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        Number of streamlines of the synthetic tractogram.
+    max_processes : int
+        Maximum number of processes.
+    batch_size : int, optional
+        Batch size of the predictions.
+    num_workers : int, optional
+        Number of threads preparing batches in each process.
+
+    Returns
+    -------
+    results : list of dict
+        Timing and throughput for each number of processes.
+    """
+    sft = make_sft(nb_streamlines)
+    model = make_model()
+
+    results = []
+    for processes in range(1, max_processes + 1):
+        predictor = make_predictor(
+            batch_size=batch_size, num_workers=num_workers,
+            processes=processes)
+
+        start = time.perf_counter()
+        if processes > 1:
+            predictor.sharded_predict(model, sft)
+        else:
+            predictor.predict(model, sft, progress=False)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'processes': processes,
+            'time': elapsed,
+            'streamlines_per_s': nb_streamlines / elapsed,
+            'speedup': results[0]['time'] / elapsed if results else 1.})
+        print('{:>3d} processes: {:8.2f}s {:10.1f} streamlines/s '
+              '(x{:.2f})'.format(
+                  processes, elapsed, results[-1]['streamlines_per_s'],
+                  results[-1]['speedup']))
+
+    return results
+
+
+def parse_args():
+    """ Benchmark the multi-process inference of the predictor. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--nb_streamlines', type=int, default=20000,
+                        help='Number of synthetic streamlines. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--max_processes', type=int,
+                        default=os.cpu_count(),
+                        help='Maximum number of processes. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help='Threads preparing batches in each process. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = bench_processes(
+        args.nb_streamlines, args.max_processes, args.batch_size,
+        args.num_workers)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
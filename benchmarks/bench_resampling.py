@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import argparse
+import json
+import time
+
+import numpy as np
+
+from argparse import RawTextHelpFormatter
+from dipy.tracking.streamline import set_number_of_points
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from benchmarks.synthetic import make_streamlines
+from TractOracleNet.resampling import resample_directions
+
+"""
+Time taken to compute the input features of the model, i.e. the directions
+between the points of the streamlines resampled to 128 points, by
+`resample_directions` and by `np.diff(set_number_of_points(...))`, on
+synthetic streamlines. Run from the root of the repository:
+
+    python -m benchmarks.bench_resampling --batch_sizes 512,50000
+"""
+
+
+def _best_time(func, repeats):
+    """ Best wall time of `repeats` calls of a function, in seconds. """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_resampling(
+    nb_streamlines, batch_sizes=(512,), nb_points=128, repeats=3, **kwargs
+):
+    """ Time the computation of the directions of all the streamlines,
+    batch by batch, with both implementations.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        Number of synthetic streamlines.
+    batch_sizes : list of int, optional
+        Number of streamlines per batch.
+    nb_points : int, optional
+        Number of points of the resampled streamlines.
+    repeats : int, optional
+        Number of runs of each implementation, the best of which is kept.
+    kwargs : dict
+        Passed to `make_streamlines`.
+
+    Returns
+    -------
+    results : list of dict
+        Best time of each implementation for each batch size.
+    """
+    streamlines = ArraySequence(make_streamlines(nb_streamlines, **kwargs))
+
+    def _dipy(batch):
+        return np.diff(set_number_of_points(batch, nb_points), axis=1)
+
+    def _resample_directions(batch):
+        return resample_directions(batch, nb_points)
+
+    results = []
+    for batch_size in batch_sizes:
+        times = {}
+        for name, func in (('dipy', _dipy),
+                           ('resample_directions', _resample_directions)):
+            times[name] = _best_time(
+                lambda: [func(streamlines[i:i + batch_size])
+                         for i in range(0, nb_streamlines, batch_size)],
+                repeats)
+
+        results.append(dict(
+            batch_size=batch_size, **times,
+            speedup=times['dipy'] / times['resample_directions']))
+        print('batch size {:>6d}: dipy {:.3f}s, resample_directions '
+              '{:.3f}s (x{:.2f})'.format(
+                  batch_size, times['dipy'], times['resample_directions'],
+                  results[-1]['speedup']))
+
+    return results
+
+
+def parse_args():
+    """ Benchmark the computation of the directions of the streamlines
+    against dipy. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--nb_streamlines', type=int, default=50000,
+                        help='Number of synthetic streamlines. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--batch_sizes', type=str, default='512,50000',
+                        help='Comma-separated numbers of streamlines per '
+                             'batch. Default is [%(default)s].')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Number of runs of each implementation, the '
+                             'best of which is kept. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = bench_resampling(
+        args.nb_streamlines,
+        [int(b) for b in args.batch_sizes.split(',')],
+        repeats=args.repeats)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
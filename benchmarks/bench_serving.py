@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+from argparse import RawTextHelpFormatter
+
+from benchmarks.synthetic import make_model, make_streamlines
+from TractOracleNet.serving import OracleClient, ScoringServer
+
+"""
+Drive the scoring service with concurrent synthetic clients, e.g. to
+tune --max_batch_size and --max_wait. Run from the root of the
+repository:
+
+    python -m benchmarks.bench_serving --clients 16 --max_wait 5
+"""
+
+
+def bench_serving(nb_clients, nb_requests, request_size, max_batch_size,
+                  max_wait, port=None):
+    """ Send requests to the scoring service from concurrent clients.
+
+    Parameters
+    ----------
+    nb_clients : int
+        Number of concurrent clients.
+    nb_requests : int
+        Number of requests sent by each client, one after the other.
+    request_size : int
+        Number of streamlines per request.
+    max_batch_size : int
+        Maximum batch size of the service.
+    max_wait : float
+        Maximum wait of the service, in seconds.
+    port : int, optional
+        Port of a running service. If not given, a service with a
+        synthetic model is started.
+
+    Returns
+    -------
+    stats : dict
+        Counters of the service, and the throughput seen by the clients.
+    """
+    server = None
+    if port is None:
+        server = ScoringServer(make_model(), max_batch_size=max_batch_size,
+                               max_wait=max_wait)
+        port = server.port
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = OracleClient(port=port)
+    requests = [make_streamlines(request_size, seed=i)
+                for i in range(nb_clients)]
+
+    def _run(i):
+        for _ in range(nb_requests):
+            client.score(requests[i])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_run, args=(i,))
+               for i in range(nb_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    stats = client.stats()
+    stats['client_streamlines_per_s'] = \
+        nb_clients * nb_requests * request_size / elapsed
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    return stats
+
+
+def parse_args():
+    """ Benchmark the scoring service with concurrent clients. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16,
+                        help='Number of concurrent clients. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--requests', type=int, default=20,
+                        help='Number of requests per client. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--request_size', type=int, default=16,
+                        help='Number of streamlines per request. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--max_batch_size', type=int, default=512,
+                        help='Maximum batch size. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--max_wait', type=float, default=5.,
+                        help='Maximum wait before scoring a batch, in ms. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--port', type=int,
+                        help='Port of a running service. A service with a '
+                             'random model is started if not given.')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    stats = bench_serving(
+        args.clients, args.requests, args.request_size, args.max_batch_size,
+        args.max_wait / 1000., args.port)
+    print(json.dumps(stats, indent=2))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
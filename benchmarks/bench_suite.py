@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import torch
+
+from argparse import RawTextHelpFormatter
+from datetime import datetime, timezone
+
+from benchmarks.synthetic import (
+    make_hdf5, make_model, make_predictor, make_sft, make_subjects)
+from TractOracleNet.datasets.create_dataset import process_subjects
+from TractOracleNet.datasets.StreamlineBatchDataset import (
+    StreamlineBatchDataset)
+from TractOracleNet.profiling import machine_info, peak_rss
+from TractOracleNet.utils import get_data, save_filtered_streamlines
+
+"""
+Timings of the main steps of filtering tractograms and of creating and
+reading datasets, on synthetic data generated on the fly. Results are
+saved with the commit and the machine they were measured on, so that runs
+can be compared over time with `--compare`. Run from the root of the
+repository:
+
+    python -m benchmarks.bench_suite --out before.json
+    python -m benchmarks.bench_suite --compare before.json
+"""
+
+BENCHMARKS = ['get_data', 'predict', 'dense_predict', 'save_trk',
+              'save_tck', 'dataset_getitem', 'process_subjects']
+
+
+def _best_time(func, repeats):
+    """ Best wall time of `repeats` calls of a function, in seconds. """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _commit():
+    """ Commit of the repository, if known. """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(
+    directory, nb_streamlines, nb_dense_streamlines=200, nb_subjects=2,
+    batch_size=512, num_workers=4, repeats=3, benchmarks=BENCHMARKS,
+    **kwargs
+):
+    """ Time each benchmark on synthetic data.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the synthetic files and the outputs are saved.
+    nb_streamlines : int
+        Number of streamlines of the synthetic tractogram and dataset.
+    nb_dense_streamlines : int, optional
+        Number of streamlines scored point by point by `dense_predict`,
+        which scores every cut of the streamlines.
+    nb_subjects : int, optional
+        Number of subjects of `nb_streamlines // nb_subjects` streamlines
+        processed by `process_subjects`.
+    batch_size : int, optional
+        Batch size of the predictions and of the dataset.
+    num_workers : int, optional
+        Number of threads preparing batches.
+    repeats : int, optional
+        Number of runs of each benchmark, the best of which is kept.
+    benchmarks : list of str, optional
+        Benchmarks to run, among `BENCHMARKS`.
+    kwargs : dict
+        Passed to `make_streamlines`, e.g. the `distribution` of the
+        number of points of the streamlines.
+
+    Returns
+    -------
+    results : list of dict
+        Best time and throughput of each benchmark.
+    """
+    sft = make_sft(nb_streamlines, **kwargs)
+    dense_sft = make_sft(nb_dense_streamlines, **kwargs)
+    model = make_model().for_inference()
+    predictor = make_predictor(
+        batch_size=batch_size, num_workers=num_workers)
+    scores = np.random.default_rng(0).uniform(size=nb_streamlines)
+
+    dataset_file = os.path.join(directory, 'dataset.hdf5')
+    make_hdf5(dataset_file, nb_streamlines, **kwargs)
+    nb_per_subject = max(1, nb_streamlines // nb_subjects)
+    sub_files = make_subjects(directory, nb_subjects, nb_per_subject,
+                              **kwargs)
+
+    def _getitem():
+        dataset = StreamlineBatchDataset(dataset_file)
+        for i in range(0, dataset.length, batch_size):
+            dataset[list(range(i, min(i + batch_size, dataset.length)))]
+
+    def _process_subjects():
+        with h5py.File(os.path.join(directory, 'created.hdf5'), 'w') as f:
+            process_subjects(sub_files, f, 128, nb_per_subject)
+
+    cases = {
+        'get_data': (lambda: get_data(sft, 'cpu'), nb_streamlines),
+        'predict': (lambda: predictor.predict(model, sft, progress=False),
+                    nb_streamlines),
+        'dense_predict': (lambda: predictor.dense_predict(model, dense_sft),
+                          nb_dense_streamlines),
+        'save_trk': (lambda: save_filtered_streamlines(
+            sft, scores, os.path.join(directory, 'out.trk')),
+            nb_streamlines),
+        'save_tck': (lambda: save_filtered_streamlines(
+            sft, scores, os.path.join(directory, 'out.tck')),
+            nb_streamlines),
+        'dataset_getitem': (_getitem, nb_streamlines),
+        'process_subjects': (_process_subjects,
+                             nb_per_subject * nb_subjects)}
+
+    results = []
+    for name in benchmarks:
+        func, n = cases[name]
+        elapsed = _best_time(func, repeats)
+        results.append({
+            'benchmark': name,
+            'streamlines': n,
+            'time': elapsed,
+            'streamlines_per_s': n / elapsed,
+            'process_peak_rss_mb': peak_rss()})
+
+    return results
+
+
+def print_results(results, baseline=None):
+    """ Print the results, with the speedup over a baseline if given.
+
+    Parameters
+    ----------
+    results : list of dict
+        Results of `bench_suite`.
+    baseline : dict, optional
+        Report of a previous run, as saved by `--out`.
+    """
+    previous = {}
+    if baseline is not None:
+        previous = {r['benchmark']: r for r in baseline['results']}
+
+    print('{:>17} | {:>11} | {:>9} | {:>13} | {:>7}'.format(
+        'benchmark', 'streamlines', 'time (s)', 'streamlines/s',
+        'speedup'))
+    for r in results:
+        # Throughputs are compared, as the sizes of the runs may differ
+        p = previous.get(r['benchmark'])
+        speedup = 'x{:.2f}'.format(
+            r['streamlines_per_s'] / p['streamlines_per_s']) if p else ''
+        print('{:>17} | {:>11} | {:>9.3f} | {:>13.1f} | {:>7}'.format(
+            r['benchmark'], r['streamlines'], r['time'],
+            r['streamlines_per_s'], speedup))
+
+
+def parse_args():
+    """ Benchmark the main steps of TractOracleNet on synthetic data. """
+    parser = argparse.ArgumentParser(
+        description=parse_args.__doc__,
+        formatter_class=RawTextHelpFormatter)
+    parser.add_argument('--nb_streamlines', type=int, default=10000,
+                        help='Number of synthetic streamlines. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--nb_dense_streamlines', type=int, default=200,
+                        help='Number of streamlines scored point by point. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--nb_subjects', type=int, default=2,
+                        help='Number of subjects the streamlines are split '
+                             'into for process_subjects. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--min_length', type=int, default=20,
+                        help='Minimum number of points of the streamlines. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--max_length', type=int, default=200,
+                        help='Maximum number of points of the streamlines. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--distribution', choices=['uniform', 'lognormal'],
+                        default='uniform',
+                        help='Distribution of the number of points of the '
+                             'streamlines. Default is [%(default)s].')
+    parser.add_argument('--batch_size', type=int, default=512,
+                        help='Batch size for predictions and datasets. '
+                             'Default is [%(default)s].')
+    parser.add_argument('--num_workers', type=int, default=4,
+                        help='Threads preparing batches. Default is '
+                             '[%(default)s].')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Number of runs of each benchmark, the best '
+                             'of which is kept. Default is [%(default)s].')
+    parser.add_argument('--benchmarks', type=str, default=','.join(
+                        BENCHMARKS),
+                        help='Comma-separated benchmarks to run. Default '
+                             'is [%(default)s].')
+    parser.add_argument('--compare', type=str,
+                        help='Results (.json) of a previous run to compare '
+                             'the throughputs to.')
+    parser.add_argument('--out', type=str,
+                        help='Save the results to this JSON file.')
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks.split(',')) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: {}.'.format(
+            ', '.join(sorted(unknown))))
+    if args.repeats < 1:
+        parser.error('--repeats must be at least 1.')
+    if args.min_length < 2 or args.min_length > args.max_length:
+        parser.error('--min_length must be at least 2 and at most '
+                     '--max_length.')
+    return args
+
+
+def main():
+    args = parse_args()
+
+    config = {k: v for k, v in vars(args).items()
+              if k not in ('compare', 'out')}
+    with tempfile.TemporaryDirectory() as directory:
+        results = bench_suite(
+            directory, args.nb_streamlines, args.nb_dense_streamlines,
+            args.nb_subjects, args.batch_size, args.num_workers,
+            args.repeats, args.benchmarks.split(','),
+            min_length=args.min_length, max_length=args.max_length,
+            distribution=args.distribution)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.out:
+        report = dict(
+            date=datetime.now(timezone.utc).isoformat(),
+            commit=_commit(),
+            python=sys.version.split()[0],
+            numpy=np.__version__,
+            torch=torch.__version__,
+            torch_threads=torch.get_num_threads(),
+            **machine_info(),
+            config=config,
+            results=results)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import os
+
+import h5py
+import nibabel as nib
+import numpy as np
+
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
+from dipy.io.streamline import save_tractogram
+
+from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.resampling import resample_streamlines
+
+"""
+Synthetic data for benchmarks, so that they can run without real
+tractograms, datasets or checkpoints.
+"""
+
+
+def make_reference(dims=(128, 128, 128), voxel_size=1.):
+    """ Create an empty reference anatomy.
+
+    Parameters
+    ----------
+    dims : tuple of int, optional
+        Dimensions of the volume.
+    voxel_size : float, optional
+        Isotropic voxel size, in mm.
+
+    Returns
+    -------
+    reference : nib.Nifti1Image
+        Reference anatomy.
+    """
+    affine = np.diag([voxel_size, voxel_size, voxel_size, 1.])
+    return nib.Nifti1Image(np.zeros(dims, dtype=np.uint8), affine)
+
+
+def make_lengths(
+    nb_streamlines, min_length=20, max_length=200, distribution='uniform',
+    rng=None
+):
+    """ Draw the number of points of streamlines.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        Number of streamlines.
+    min_length, max_length : int, optional
+        Range of the number of points of the streamlines.
+    distribution : str, optional
+        'uniform' draws lengths uniformly in the range. 'lognormal' draws
+        them around the geometric mean of the range with a long tail of
+        long streamlines, as in tractograms compressed or tracked with a
+        small step, clipped to the range.
+    rng : np.random.Generator, optional
+        Random generator.
+
+    Returns
+    -------
+    lengths : np.ndarray (N,)
+        Number of points of each streamline.
+    """
+    rng = rng or np.random.default_rng(0)
+    if distribution == 'uniform':
+        return rng.integers(min_length, max_length + 1, nb_streamlines)
+    if distribution == 'lognormal':
+        # About 95% of the lengths within the range before clipping
+        mean = (np.log(min_length) + np.log(max_length)) / 2
+        sigma = (np.log(max_length) - np.log(min_length)) / 4
+        lengths = rng.lognormal(mean, sigma, nb_streamlines)
+        return np.clip(np.round(lengths), min_length, max_length).astype(int)
+    raise ValueError('Unknown length distribution: {}.'.format(distribution))
+
+
+def make_streamlines(
+    nb_streamlines, min_length=20, max_length=200, step=1.,
+    dims=(128, 128, 128), seed=0, distribution='uniform'
+):
+    """ Generate smooth random walks inside a volume.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        Number of streamlines.
+    min_length, max_length : int, optional
+        Range of the number of points of the streamlines.
+    step : float, optional
+        Distance between consecutive points, in voxels.
+    dims : tuple of int, optional
+        Dimensions of the volume the streamlines are kept in.
+    seed : int, optional
+        Random seed.
+    distribution : str, optional
+        Distribution of the number of points, see `make_lengths`.
+
+    Returns
+    -------
+    streamlines : list of np.ndarray
+        Streamlines in voxel space, corner origin.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = make_lengths(
+        nb_streamlines, min_length, max_length, distribution, rng)
+    dims = np.asarray(dims)
+
+    streamlines = []
+    for length in lengths:
+        # Directions slowly drift so that streamlines are not too curvy
+        dirs = np.cumsum(rng.normal(scale=0.3, size=(length, 3)), axis=0)
+        dirs += rng.normal(size=3)
+        dirs /= np.linalg.norm(dirs, axis=-1, keepdims=True)
+        start = rng.uniform(0.25, 0.75, 3) * dims
+        points = start + np.cumsum(dirs * step, axis=0)
+        streamlines.append(
+            np.clip(points, 0.5, dims - 0.5).astype(np.float32))
+
+    return streamlines
+
+
+def make_sft(nb_streamlines, seed=0, **kwargs):
+    """ Generate a tractogram of random streamlines.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        Number of streamlines.
+    seed : int, optional
+        Random seed.
+    kwargs : dict
+        Passed to `make_streamlines`.
+
+    Returns
+    -------
+    sft : StatefulTractogram
+        Tractogram in RASMM space.
+    """
+    dims = kwargs.pop('dims', (128, 128, 128))
+    reference = make_reference(dims)
+    streamlines = make_streamlines(
+        nb_streamlines, dims=dims, seed=seed, **kwargs)
+
+    sft = StatefulTractogram(
+        streamlines, reference, Space.VOX, origin=Origin.TRACKVIS)
+    sft.to_rasmm()
+    sft.to_center()
+
+    return sft
+
+
+def make_subjects(directory, nb_subjects, nb_streamlines, seed=0, **kwargs):
+    """ Save tractograms of scored random streamlines, as expected by
+    `create_dataset.process_subjects`.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the reference anatomies and the tractograms are
+        saved.
+    nb_subjects : int
+        Number of subjects.
+    nb_streamlines : int
+        Number of streamlines per subject.
+    seed : int, optional
+        Random seed of the first subject.
+    kwargs : dict
+        Passed to `make_streamlines`.
+
+    Returns
+    -------
+    sub_files : list of tuple
+        Reference anatomy and list of tractograms of each subject.
+    """
+    rng = np.random.default_rng(seed)
+    sub_files = []
+    for i in range(nb_subjects):
+        sft = make_sft(nb_streamlines, seed=seed + i, **kwargs)
+        sft.data_per_streamline['score'] = rng.uniform(
+            size=(len(sft), 1)).astype(np.float32)
+
+        anat = os.path.join(directory, 'sub-{:02d}_t1.nii.gz'.format(i))
+        tractogram = os.path.join(directory, 'sub-{:02d}.trk'.format(i))
+        nib.save(make_reference(kwargs.get('dims', (128, 128, 128))), anat)
+        save_tractogram(sft, tractogram, bbox_valid_check=False)
+        sub_files.append((anat, [tractogram]))
+
+    return sub_files
+
+
+def make_hdf5(filename, nb_streamlines, nb_points=128, seed=0, **kwargs):
+    """ Save a dataset of scored random streamlines in the format of
+    create_dataset.py, without going through tractogram files.
+
+    Parameters
+    ----------
+    filename : str
+        Output dataset (.hdf5).
+    nb_streamlines : int
+        Number of streamlines.
+    nb_points : int, optional
+        Number of points the streamlines are resampled to.
+    seed : int, optional
+        Random seed.
+    kwargs : dict
+        Passed to `make_streamlines`.
+    """
+    streamlines = resample_streamlines(
+        make_streamlines(nb_streamlines, seed=seed, **kwargs), nb_points)
+    scores = np.random.default_rng(seed).uniform(size=nb_streamlines)
+
+    with h5py.File(filename, 'w') as f:
+        f.attrs['version'] = 1
+        f.attrs['nb_points'] = nb_points
+        group = f.create_group('streamlines')
+        group.create_dataset('data', data=streamlines.astype(np.float32))
+        group.create_dataset('scores', data=scores.astype(np.float32))
+
+
+def make_model(n_head=4, n_layers=4, seed=0):
+    """ Create a randomly initialized model, in eval mode.
+
+    Parameters
+    ----------
+    n_head : int, optional
+        Number of attention heads.
+    n_layers : int, optional
+        Number of encoder layers.
+    seed : int, optional
+        Random seed of the weights.
+
+    Returns
+    -------
+    model : TransformerOracle
+        Model.
+    """
+    import torch
+    torch.manual_seed(seed)
+    model = TransformerOracle((128 - 1) * 3, 1, n_head, n_layers, 1e-3)
+    model.eval()
+    return model
+
+
+def make_predictor(**kwargs):
+    """ Create a predictor with the default options of predictor.py,
+    scoring tractograms in memory.
+
+    Parameters
+    ----------
+    kwargs : dict
+        Options overriding the defaults, e.g. `batch_size`.
+
+    Returns
+    -------
+    predictor : TractOracleNetPredictor
+        Predictor.
+    """
+    from TractOracleNet.runners.predictor import TractOracleNetPredictor
+    dto = {
+        'checkpoint': None, 'backend': 'torch', 'quantize': None,
+        'compile': False, 'precision': None, 'exit_margin': None,
+        'dense': False, 'tractogram': None, 'reference': None,
+        'threshold': 0.5, 'batch_size': 512, 'out': None, 'rejected': None,
+        'nofilter': False, 'stream': False, 'num_workers': 4,
+        'dense_stride': 1, 'processes': 1, 'cache': None, 'cache_size': 0,
+        'thresholds': None, 'curve': None, 'cascade': None,
+        'profile': None, 'profile_trace': None}
+    dto.update(kwargs)
+    return TractOracleNetPredictor(dto)
@@ -65,7 +65,14 @@ setup(
     # pip to create the appropriate form of executable for the target platform.
     entry_points={
         'console_scripts': [
-            "predictor.py=TractOracleNet.runners.predictor:main"]
+            "predictor.py=TractOracleNet.runners.predictor:main",
+            "batch_predictor.py=TractOracleNet.runners.batch_predictor:main",
+            "scoring_server.py=TractOracleNet.runners.scoring_server:main",
+            "export_onnx.py=TractOracleNet.runners.export_onnx:main",
+            "quantize_model.py=TractOracleNet.runners.quantize_model:main",
+            "calibrate_cascade.py="
+            "TractOracleNet.runners.calibrate_cascade:main",
+            "export_slim.py=TractOracleNet.runners.export_slim:main"]
     },
     include_package_data=True,
 
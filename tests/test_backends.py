@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+import torch
+
+from TractOracleNet.backends import OnnxModel, export_onnx
+from TractOracleNet.models.transformer import TransformerOracle
+
+
+def test_onnxruntime_matches_torch(tmp_path):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    filename = str(tmp_path / 'model.onnx')
+    export_onnx(model, filename)
+    onnx_model = OnnxModel(filename)
+
+    # The batch axis is dynamic
+    for batch_size in (1, 7, 64):
+        x = torch.randn(batch_size, 127, 3)
+        with torch.no_grad():
+            expected = model(x).numpy()
+        np.testing.assert_allclose(
+            onnx_model(x).numpy(), expected, atol=1e-5)
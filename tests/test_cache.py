@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+from TractOracleNet.cache import ScoreCache
+from TractOracleNet.models.transformer import TransformerOracle
+
+
+def _model(seed=0):
+    torch.manual_seed(seed)
+    return TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+
+
+def test_score_cache(tmp_path):
+    filename = str(tmp_path / 'cache.npy')
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(100, 127, 3)).astype(np.float32)
+    scores = rng.uniform(size=100)
+
+    cache = ScoreCache(filename, _model(), max_entries=1000)
+    keys = cache.keys(data)
+    cache.put(keys[:60], scores[:60])
+    cached, hits = cache.get(keys)
+    assert np.all(hits[:60]) and not np.any(hits[60:])
+    np.testing.assert_allclose(cached[:60], scores[:60], rtol=1e-6)
+    cache.close()
+
+    # Scores persist, but only for the same weights
+    cache = ScoreCache(filename, _model(), max_entries=1000)
+    assert np.all(cache.get(cache.keys(data[:60]))[1])
+    other = ScoreCache(filename, _model(seed=1), max_entries=1000)
+    assert not np.any(other.get(other.keys(data[:60]))[1])
+
+
+def test_score_cache_eviction(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(500, 127, 3)).astype(np.float32)
+
+    cache = ScoreCache(str(tmp_path / 'cache.npy'), _model(),
+                       max_entries=64, ways=4)
+    keys = cache.keys(data)
+    for i in range(0, 500, 50):
+        cache.put(keys[i:i + 50], np.zeros(50))
+
+    _, hits = cache.get(keys)
+    assert 0 < np.count_nonzero(hits) <= 64
+    # The most recent streamlines are kept first
+    assert np.count_nonzero(hits[-50:]) > np.count_nonzero(hits[:50])
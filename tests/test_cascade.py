@@ -0,0 +1,62 @@
+import numpy as np
+
+from TractOracleNet.cascade import (
+    FEATURES, GeometricCascade, geometric_features)
+
+
+def _dirs(nb_streamlines, max_angle, length=50.):
+    """ Planar streamlines turning by a random angle up to `max_angle`
+    between consecutive segments. """
+    angles = np.cumsum(np.random.uniform(
+        -max_angle, max_angle, (nb_streamlines, 127)), axis=1)
+    dirs = np.stack((np.cos(angles), np.sin(angles),
+                     np.zeros_like(angles)), axis=-1)
+    return dirs * length / 127
+
+
+def test_geometric_features():
+    straight = np.zeros((1, 127, 3))
+    straight[..., 0] = 0.5
+    # A half turn in the middle of the streamline
+    turn = straight.copy()
+    turn[:, 64:] *= -1
+
+    features = geometric_features(np.concatenate((straight, turn)))
+    length, straightness, mean_angle, max_angle, _ = features.T
+
+    assert features.shape == (2, len(FEATURES))
+    assert np.allclose(length, 63.5)
+    assert np.allclose(straightness, [1., 1 / 127], atol=1e-6)
+    assert np.allclose(max_angle, [0., np.pi])
+    assert np.allclose(mean_angle, [0., np.pi / 126])
+
+
+def test_cascade_calibrate():
+    np.random.seed(0)
+    # Plausible streamlines are smooth, implausible ones sharp
+    dirs = np.concatenate((_dirs(500, 0.05), _dirs(500, 1.)))
+    scores = np.r_[np.ones(500), np.zeros(500)]
+
+    cascade = GeometricCascade.calibrate(
+        geometric_features(dirs), scores, tolerance=0., min_support=10)
+    decided, predictions = cascade.decide(dirs)
+
+    assert len(cascade.rules) > 0
+    assert cascade.nb_seen == 1000
+    assert cascade.nb_decided == np.count_nonzero(decided) > 0
+    assert np.all(predictions[decided] == scores[decided])
+
+
+def test_cascade_save_load(tmp_path):
+    rules = [{'feature': 'max_angle', 'side': 'above', 'cut': 1.,
+              'decision': 'reject', 'purity': 1., 'support': 10}]
+    GeometricCascade(rules).save(tmp_path / 'cascade.json')
+    cascade = GeometricCascade.load(tmp_path / 'cascade.json')
+
+    decided, predictions = cascade.decide(
+        np.concatenate((_dirs(10, 0.01), _dirs(10, 3.))))
+
+    assert cascade.rules == rules
+    assert not np.any(decided[:10])
+    assert np.all(decided[10:]) and not np.any(predictions)
+    assert cascade.nb_rejected == 10 and cascade.nb_accepted == 0
@@ -0,0 +1,68 @@
+import h5py
+import nibabel as nib
+import numpy as np
+
+from dipy.io.stateful_tractogram import Space, StatefulTractogram
+from dipy.io.streamline import save_tractogram
+
+from TractOracleNet.datasets.create_dataset import (
+    count_streamlines, process_subjects)
+
+
+def _save_bundle(filename, reference, nb_streamlines, seed):
+    rng = np.random.default_rng(seed)
+    streamlines = [10 + np.cumsum(rng.uniform(0, 1, (n, 3)), axis=0)
+                   for n in rng.integers(5, 30, nb_streamlines)]
+    sft = StatefulTractogram(
+        streamlines, reference, Space.VOX,
+        data_per_streamline={'score': rng.uniform(size=(nb_streamlines, 1))})
+    save_tractogram(sft, str(filename), bbox_valid_check=False)
+
+
+def test_process_subjects_workers(tmp_path):
+    anat = tmp_path / 't1.nii.gz'
+    nib.save(nib.Nifti1Image(np.zeros((64, 64, 64), np.uint8), np.eye(4)),
+             anat)
+    for i in range(3):
+        _save_bundle(tmp_path / 'bundle_{}.trk'.format(i), str(anat),
+                     20 + 10 * i, i)
+    sub_files = [(str(anat), [str(tmp_path / 'bundle_*.trk')])]
+
+    datasets = []
+    for workers in (0, 2):
+        np.random.seed(0)
+        with h5py.File(tmp_path / 'dataset.hdf5', 'w') as f:
+            process_subjects(sub_files, f, 16, 25, workers)
+            datasets.append((f['streamlines']['data'][:],
+                             f['streamlines']['scores'][:]))
+
+    # The streamlines are written to the same shuffled indices
+    (data, scores), (data_workers, scores_workers) = datasets
+    assert data.shape == (20 + 25 + 25, 16, 3)
+    assert np.all(scores > 0)
+    assert np.array_equal(data, data_workers)
+    assert np.array_equal(scores, scores_workers)
+
+
+def _save_tck(filename, count_line, nb_streamlines=4):
+    """ TCK file whose header may have no or a wrong count. """
+    body = b''.join(np.vstack((
+        np.random.rand(5, 3), np.full((1, 3), np.nan))).astype('<f4')
+        .tobytes() for _ in range(nb_streamlines))
+    body += np.full((1, 3), np.inf, dtype='<f4').tobytes()
+
+    header = 'mrtrix tracks\n{}datatype: Float32LE\nfile: . '.format(
+        count_line)
+    offset = len(header) + len('\nEND\n')
+    offset += len(str(offset + len(str(offset))))
+    with open(filename, 'wb') as f:
+        f.write('{}{}\nEND\n'.format(header, offset).encode('utf-8'))
+        f.write(body)
+
+
+def test_count_streamlines(tmp_path):
+    for name, count_line in (('no_count', ''), ('zero', 'count: 0\n'),
+                             ('count', 'count: 4\n')):
+        filename = str(tmp_path / '{}.tck'.format(name))
+        _save_tck(filename, count_line)
+        assert count_streamlines(filename) == 4
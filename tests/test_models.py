@@ -0,0 +1,229 @@
+import pytest
+import torch
+
+from TractOracleNet.models.transformer import (
+    CausalTransformerOracle, EarlyExitTransformerOracle, InferenceOracle,
+    TransformerOracle, patchify)
+from TractOracleNet.resampling import resample_directions
+
+
+def _causal_model():
+    torch.manual_seed(0)
+    return CausalTransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+
+
+def test_causal_prefix_scores_ignore_next_directions():
+    model = _causal_model()
+    x = torch.randn(4, 127, 3)
+    x_changed = x.clone()
+    x_changed[:, 60:] = torch.randn(4, 67, 3)
+
+    with torch.no_grad():
+        y = model.forward_prefixes(x)
+        y_changed = model.forward_prefixes(x_changed)
+
+    assert y.shape == (4, 127)
+    torch.testing.assert_close(y[:, :60], y_changed[:, :60])
+    torch.testing.assert_close(model(x), y[:, -1])
+
+
+def test_causal_step_matches_forward_prefixes():
+    model = _causal_model()
+    x = torch.randn(4, 127, 3)
+
+    with torch.no_grad():
+        expected = model.forward_prefixes(x)
+
+        cache = None
+        scores = []
+        for t in range(x.shape[1]):
+            y, cache = model.step(x[:, t], cache)
+            scores.append(y)
+
+    torch.testing.assert_close(torch.stack(scores, dim=1), expected)
+
+
+def test_causal_loss_scales_targets_of_prefixes():
+    model = _causal_model()
+    x = torch.randn(4, 127, 3)
+    y = torch.tensor([1., 0., 0.5, 1.])
+
+    with torch.no_grad():
+        y_hat, loss = model.compute_loss(x, y)
+        prefixes = model.forward_prefixes(x)
+
+    # The prefix of the first t + 1 directions covers (t + 1) / 127 of
+    # the streamline
+    targets = y[:, None] * torch.arange(1, 128) / 127
+    torch.testing.assert_close(
+        loss, torch.nn.functional.mse_loss(prefixes, targets))
+    torch.testing.assert_close(y_hat, prefixes[:, -1])
+
+
+def test_causal_step_scale_of_directions():
+    model = _causal_model()
+    torch.manual_seed(1)
+    # Tracking steps of a fixed length
+    steps = torch.nn.functional.normalize(torch.randn(2, 127, 3), dim=-1)
+
+    def _step_scores(dirs):
+        cache = None
+        with torch.no_grad():
+            for t in range(dirs.shape[1]):
+                y, cache = model.step(dirs[:, t], cache)
+        return y
+
+    def _resampled_scores(dirs):
+        points = torch.cat(
+            (torch.zeros(len(dirs), 1, 3), torch.cumsum(dirs, 1)), 1)
+        features = resample_directions(list(points.numpy()), 128)
+        with torch.no_grad():
+            return model(torch.as_tensor(features))
+
+    # Streamlines of 128 points are already on the scale of the training
+    # directions, whatever the length of their steps
+    torch.testing.assert_close(
+        _step_scores(steps), _resampled_scores(steps), atol=1e-4, rtol=0)
+    torch.testing.assert_close(
+        _step_scores(steps * 0.5), _resampled_scores(steps * 0.5),
+        atol=1e-4, rtol=0)
+
+    # Shorter streamlines are not rescaled, their directions are longer
+    # than the ones of the same streamline resampled to 128 points
+    assert not torch.allclose(
+        _step_scores(steps[:, :63]), _resampled_scores(steps[:, :63]),
+        atol=1e-4)
+
+
+def test_inference_model_matches_model():
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    x = torch.randn(21, 127, 3)
+
+    with torch.no_grad():
+        expected = model(x)
+
+    inference_model = model.for_inference()
+    assert isinstance(inference_model, InferenceOracle)
+    torch.testing.assert_close(inference_model(x), expected)
+
+    # Batches are split and padded to a fixed number of streamlines
+    padded_model = model.for_inference(batch_size=8)
+    torch.testing.assert_close(padded_model(x), expected)
+    assert padded_model(x[:0]).shape == (0,)
+
+
+def test_inference_model_reduced_precision():
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    inference_model = model.for_inference()
+    x = torch.randn(16, 127, 3)
+    expected = inference_model(x)
+
+    for dtype in (torch.bfloat16, torch.float16):
+        with torch.autocast('cpu', dtype=dtype):
+            y = inference_model(x.to(dtype))
+        torch.testing.assert_close(
+            y.float(), expected, atol=2e-2, rtol=0)
+
+
+def test_early_exit_matches_exit_heads():
+    torch.manual_seed(0)
+    model = EarlyExitTransformerOracle(127 * 3, 1, 4, 3, 1e-3).eval()
+    x = torch.randn(32, 127, 3)
+
+    with torch.no_grad():
+        exits = model.forward_exits(x)
+        threshold = float(exits[:, 0].median())
+        y, depth = model.forward_early_exit(x, threshold, 0.)
+        torch.testing.assert_close(y, exits[:, 0])
+        assert torch.all(depth == 1)
+
+        # Each streamline gets the score of the first confident layer
+        margin = float((exits[:, 0] - threshold).abs().median())
+        y, depth = model.forward_early_exit(x, threshold, margin)
+        torch.testing.assert_close(y, exits[torch.arange(32), depth - 1])
+        confident = (exits - threshold).abs() >= margin
+        for n in range(32):
+            assert not confident[n, :depth[n] - 1].any()
+            assert depth[n] == 3 or confident[n, depth[n] - 1]
+        assert 1 < depth.float().mean() < 3
+
+        model.enable_early_exit(threshold, margin)
+        torch.testing.assert_close(model(x), y)
+        assert model.average_exit_depth == pytest.approx(
+            depth.float().mean().item())
+
+    # All heads are trained jointly
+    model.train()
+    _, loss = model.compute_loss(x, torch.rand(32))
+    loss.backward()
+    assert all(head.weight.grad is not None for head in model.exit_heads)
+
+
+def test_distillation_targets():
+    torch.manual_seed(0)
+    teacher = TransformerOracle(127 * 3, 1, 4, 2, 1e-3)
+    student = TransformerOracle(
+        127 * 3, 1, 2, 1, 1e-3, embedding_size=16, dim_feedforward=64)
+    x, y = torch.randn(8, 127, 3), torch.rand(8)
+
+    student.distill_from(teacher, alpha=0.25)
+    with torch.no_grad():
+        expected = 0.25 * teacher(x) + 0.75 * y
+
+    torch.testing.assert_close(student.targets(x, y), expected)
+    # The teacher is neither trained nor saved with the student
+    assert not any(k.startswith('_teacher') for k in student.state_dict())
+    assert not any(p.requires_grad for p in teacher.parameters())
+    assert student.hparams['embedding_size'] == 16
+
+
+def test_patched_model():
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3, patch_size=4).eval()
+    x = torch.randn(8, 127, 3)
+
+    with torch.no_grad():
+        y = model(x)
+        x_changed = x.clone()
+        x_changed[:, -1] = 0.
+
+    assert model.pos_encoding.pe.shape[0] == 32 + 1
+    assert model.hparams['patch_size'] == 4
+    assert y.shape == (8,)
+    torch.testing.assert_close(model.for_inference()(x), y)
+
+    # 127 = 31 * 4 + 3: the last patch holds the last three directions
+    # and one null direction of padding
+    patches = patchify(x, 4)
+    assert patches.shape == (8, 32, 12)
+    torch.testing.assert_close(patches[:, -1, :9], x[:, -3:].reshape(8, 9))
+    assert torch.all(patches[:, -1, 9:] == 0.)
+    # The last direction is not dropped with the padding
+    with torch.no_grad():
+        assert not torch.allclose(model(x_changed), y)
+
+
+@pytest.mark.parametrize('in_place', [True, False])
+def test_slim_model(tmp_path, monkeypatch, in_place):
+    from TractOracleNet.models import inference
+    from TractOracleNet.models.inference import load_slim, save_slim
+
+    # Older versions of torch load slim models without memory-mapping
+    monkeypatch.setattr(inference, '_IN_PLACE_LOADING',
+                        in_place and inference._IN_PLACE_LOADING)
+
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3, patch_size=4).eval()
+    save_slim(model, tmp_path / 'model.pt')
+    slim = load_slim(tmp_path / 'model.pt', device='cpu')
+
+    x = torch.randn(8, 127, 3)
+    with torch.no_grad():
+        expected = model(x)
+        torch.testing.assert_close(slim(x), expected)
+    torch.testing.assert_close(slim.for_inference()(x), expected)
+
+    with pytest.raises(ValueError):
+        save_slim(_causal_model(), tmp_path / 'causal.pt')
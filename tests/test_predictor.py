@@ -0,0 +1,217 @@
+import csv
+import os
+
+import nibabel as nib
+import numpy as np
+import torch
+
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
+from dipy.io.streamline import load_tractogram, save_tractogram
+
+from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.resampling import resample_directions
+from TractOracleNet.runners import predictor as predictor_module
+from TractOracleNet.runners.predictor import TractOracleNetPredictor
+
+
+def _model():
+    torch.manual_seed(0)
+    return TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+
+
+def _predictor(**kwargs):
+    dto = {
+        'checkpoint': None, 'backend': 'torch', 'quantize': None,
+        'compile': False, 'precision': 'fp32', 'exit_margin': None,
+        'dense': False, 'tractogram': None, 'reference': 'same',
+        'threshold': 0.5, 'batch_size': 16, 'out': None, 'rejected': None,
+        'nofilter': False, 'stream': False, 'num_workers': 2,
+        'dense_stride': 1, 'processes': 1, 'cache': None, 'cache_size': 0,
+        'thresholds': None, 'curve': None, 'cascade': None,
+        'profile': None, 'profile_trace': None}
+    dto.update(kwargs)
+    return TractOracleNetPredictor(dto)
+
+
+def _sft(nb_streamlines=100, seed=0, lengths=None):
+    rng = np.random.default_rng(seed)
+    reference = nib.Nifti1Image(np.zeros((64, 64, 64), dtype=np.uint8),
+                                np.diag([2., 2., 2., 1.]))
+    if lengths is None:
+        lengths = rng.integers(2, 50, nb_streamlines)
+    streamlines = [
+        np.cumsum(rng.uniform(-1, 1, (length, 3)), axis=0) + 64
+        for length in lengths]
+    return StatefulTractogram(streamlines, reference, Space.RASMM,
+                              origin=Origin.NIFTI)
+
+
+def _save_sft(tmp_path, ext):
+    """ Save a tractogram and its reference, returned as file names. """
+    sft = _sft()
+    reference = str(tmp_path / 'reference.nii.gz')
+    nib.save(nib.Nifti1Image(np.zeros((64, 64, 64), dtype=np.uint8),
+                             sft.affine), reference)
+    tractogram = str(tmp_path / 'in.{}'.format(ext))
+    save_tractogram(sft, tractogram, bbox_valid_check=False)
+    return tractogram, reference
+
+
+def test_stream_matches_in_memory(tmp_path):
+    model = _model()
+
+    for ext in ('trk', 'tck'):
+        tractogram, reference = _save_sft(tmp_path, ext)
+        predictor = _predictor(tractogram=tractogram, reference=reference)
+        scores = predictor.predict(
+            model, predictor.load_tractogram(), progress=False)
+        # Half of the streamlines are kept
+        threshold = float(np.median(scores))
+
+        outputs = {}
+        for stream in (False, True):
+            out = str(tmp_path / 'out_{}.{}'.format(stream, ext))
+            rejected = str(tmp_path / 'rejected_{}.{}'.format(stream, ext))
+            kept, total = _predictor(
+                tractogram=tractogram, reference=reference, out=out,
+                rejected=rejected, threshold=threshold,
+                stream=stream).filter_tractogram(model)
+            assert (kept, total) == (np.count_nonzero(scores > threshold),
+                                     len(scores))
+            outputs[stream] = [
+                load_tractogram(f, reference, bbox_valid_check=False)
+                for f in (out, rejected)]
+
+        for in_memory, streamed in zip(outputs[False], outputs[True]):
+            assert len(streamed) == len(in_memory)
+            np.testing.assert_allclose(
+                streamed.streamlines._data, in_memory.streamlines._data,
+                atol=1e-4)
+            # Colors are only saved in .trk files
+            if ext == 'trk':
+                np.testing.assert_allclose(
+                    streamed.data_per_point['color']._data,
+                    in_memory.data_per_point['color']._data, atol=1e-3)
+
+
+def test_stream_nofilter_prints_no_kept_count(tmp_path, monkeypatch, capsys):
+    model = _model()
+    monkeypatch.setattr(predictor_module, 'load_model', lambda *args: model)
+    tractogram, reference = _save_sft(tmp_path, 'trk')
+
+    for stream in (False, True):
+        _predictor(tractogram=tractogram, reference=reference,
+                   out=str(tmp_path / 'out.trk'), nofilter=True,
+                   stream=stream).run()
+        assert 'Kept' not in capsys.readouterr().out
+
+    _predictor(tractogram=tractogram, reference=reference,
+               out=str(tmp_path / 'out.trk'), stream=True).run()
+    assert 'Kept' in capsys.readouterr().out
+
+
+def _cut_scores(predictor, model, streamline):
+    """ Scores of the streamline cut before each of its points, one
+    streamline at a time, as before cuts were packed into batches. """
+    cuts = [streamline[:length] for length in range(3, len(streamline))]
+    scores = np.zeros(len(streamline))
+    if cuts:
+        scores[3:] = predictor._forward(
+            model, resample_directions(cuts, 128))
+    return scores
+
+
+def test_dense_predict_matches_per_streamline_cuts():
+    model = _model()
+    # Streamlines too short to be scored, and cuts of the same streamline
+    # spread over several batches
+    sft = _sft(lengths=[2, 3, 4, 5, 6, 40, 17, 3, 25])
+    predictor = _predictor(batch_size=7)
+
+    scores = predictor.dense_predict(model, sft)
+
+    assert len(scores) == len(sft)
+    for streamline, score in zip(sft.streamlines, scores):
+        assert score.shape == (len(streamline), 1)
+        np.testing.assert_allclose(
+            score[:, 0], _cut_scores(predictor, model, streamline),
+            atol=1e-5)
+
+
+def test_dense_predict_stride():
+    model = _model()
+    sft = _sft(lengths=[2, 3, 4, 5, 6, 7, 8, 40, 17, 3, 25])
+
+    for stride in (2, 4, 8):
+        predictor = _predictor(batch_size=7, dense_stride=stride)
+        scores = predictor.dense_predict(model, sft)
+
+        for streamline, score in zip(sft.streamlines, scores):
+            # Cuts of 3, 3 + k, 3 + 2k, ... points and of all points but
+            # the last one are scored, the points in between are
+            # interpolated
+            expected = _cut_scores(predictor, model, streamline)
+            points = np.arange(3, len(streamline))
+            if len(points):
+                scored = np.union1d(points[::stride], points[-1:])
+                expected[3:] = np.interp(points, scored, expected[scored])
+
+            assert score.shape == (len(streamline), 1)
+            np.testing.assert_allclose(score[:, 0], expected, atol=1e-5)
+
+
+def test_sharded_predict_matches_predict():
+    model = _model()
+    sft = _sft()
+
+    expected = _predictor().predict(model, sft, progress=False)
+    # Shards of 13 streamlines, scored in batches of 8
+    scores = _predictor(processes=2, batch_size=8).sharded_predict(
+        model, sft)
+
+    assert scores.shape == (len(sft),)
+    np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+
+def test_threshold_sweep(tmp_path, monkeypatch):
+    model = _model()
+    monkeypatch.setattr(predictor_module, 'load_model', lambda *args: model)
+    tractogram, reference = _save_sft(tmp_path, 'trk')
+
+    predictor = _predictor(tractogram=tractogram, reference=reference)
+    scores = predictor.predict(
+        model, predictor.load_tractogram(), progress=False)
+    thresholds = np.round(np.quantile(scores, [0.3, 0.7]), 4).tolist()
+    assert thresholds[0] < thresholds[1]
+
+    for stream in (False, True):
+        directory = tmp_path / 'stream_{}'.format(stream)
+        directory.mkdir()
+        curve = str(directory / 'curve.csv')
+        _predictor(tractogram=tractogram, reference=reference,
+                   out=str(directory / 'out.trk'),
+                   rejected=str(directory / 'rejected.trk'),
+                   thresholds=thresholds, curve=curve, stream=stream).run()
+
+        with open(curve, newline='') as f:
+            rows = list(csv.DictReader(f))
+        assert [float(r['threshold']) for r in rows] == thresholds
+
+        for threshold, row in zip(thresholds, rows):
+            kept = np.count_nonzero(scores > threshold)
+            assert int(row['kept']) == kept
+            assert int(row['total']) == len(scores)
+
+            # One kept and one rejected tractogram per threshold
+            for name, nb_streamlines in (
+                    ('out', kept), ('rejected', len(scores) - kept)):
+                filename = str(directory / '{}_{:g}.trk'.format(
+                    name, threshold))
+                assert os.path.isfile(filename)
+                assert len(nib.streamlines.load(
+                    filename).streamlines) == nb_streamlines
+
+        assert sorted(os.listdir(directory)) == sorted(
+            ['curve.csv'] + ['{}_{:g}.trk'.format(name, threshold)
+                             for name in ('out', 'rejected')
+                             for threshold in thresholds])
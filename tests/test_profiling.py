@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+import pytest
+
+from contextlib import nullcontext
+
+from TractOracleNet.profiling import StageProfiler, current_rss, stage
+
+
+def test_stage_inactive():
+    assert isinstance(stage('forward', 10), nullcontext)
+
+
+def test_stage_profiler(tmp_path):
+    with StageProfiler() as profiler:
+        for _ in range(2):
+            with stage('forward', 10):
+                time.sleep(0.01)
+        with stage('write'):
+            pass
+    report = profiler.report(20, batch_size=10)
+
+    forward, write = report['stages']
+    assert report['batch_size'] == 10 and report['nb_streamlines'] == 20
+    assert forward['stage'] == 'forward' and write['stage'] == 'write'
+    assert forward['calls'] == 2 and forward['streamlines'] == 20
+    assert forward['time'] >= 0.02 and report['time'] >= forward['time']
+    assert write['streamlines_per_s'] is None
+    assert report['process_peak_rss_mb'] > 0
+    # Stages are only recorded while the profiler is active
+    assert isinstance(stage('forward'), nullcontext)
+
+
+@pytest.mark.skipif(current_rss() is None, reason='Needs /proc.')
+def test_stage_memory():
+    with StageProfiler() as profiler:
+        with stage('small'):
+            small = np.ones(2 ** 10)
+        with stage('large'):
+            # 128 MB held on to after the stage
+            large = np.ones(2 ** 24)
+    small_stage, large_stage = profiler.report(0)['stages']
+
+    assert large_stage['rss_delta_mb'] > 100
+    assert small_stage['rss_delta_mb'] < 10
+    assert large_stage['max_rss_mb'] >= small_stage['max_rss_mb']
+    del small, large
@@ -0,0 +1,54 @@
+import numpy as np
+import torch
+
+from TractOracleNet.cache import weights_hash
+from TractOracleNet.models.quantization import (
+    agreement, quantize_model, save_quantized)
+from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.models.utils import get_model
+
+
+def test_quantized_model_matches_model(tmp_path):
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    quantized = quantize_model(model)
+
+    x = torch.randn(64, 127, 3)
+    with torch.no_grad():
+        expected = model(x).numpy()
+        scores = quantized(x).numpy()
+    assert np.abs(scores - expected).max() < 0.05
+
+    # The quantized model is saved and loaded without the original weights
+    filename = str(tmp_path / 'model_int8.ckpt')
+    save_quantized(quantized, filename)
+    loaded = get_model(filename)
+    with torch.no_grad():
+        np.testing.assert_array_equal(loaded(x).numpy(), scores)
+    assert weights_hash(loaded) == weights_hash(quantized)
+    assert weights_hash(loaded) != weights_hash(model)
+
+
+def test_quantize_model_leaves_model_unchanged():
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).train()
+    weights = model.head.weight.detach().clone()
+
+    quantized = quantize_model(model)
+
+    assert model.training and not quantized.training
+    assert isinstance(model.head, torch.nn.Linear)
+    assert getattr(model, 'quantization', None) is None
+    torch.testing.assert_close(model.head.weight, weights)
+
+
+def test_agreement():
+    reference = np.array([0.1, 0.45, 0.55, 0.9])
+    scores = np.array([0.1, 0.55, 0.45, 0.8])
+    report = agreement(scores, reference, 0.5)
+    assert report['streamlines'] == 4
+    assert report['kept'] == report['reference_kept'] == 2
+    assert report['flipped_to_kept'] == report['flipped_to_rejected'] == 1
+    assert report['agreement'] == 0.5
+    np.testing.assert_allclose(report['max_deviation'], 0.1)
+    np.testing.assert_allclose(report['mean_deviation'], 0.075)
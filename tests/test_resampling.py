@@ -0,0 +1,52 @@
+import numpy as np
+
+from dipy.tracking.streamline import set_number_of_points
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from TractOracleNet.resampling import (
+    resample_directions, resample_streamlines)
+
+
+def _random_streamlines(nb_streamlines=500, seed=0):
+    rng = np.random.default_rng(seed)
+    streamlines = [
+        np.cumsum(rng.normal(size=(rng.integers(2, 200), 3)), axis=0)
+        for _ in range(nb_streamlines)]
+    # Repeated points give zero-length segments
+    streamlines[0][2] = streamlines[0][1]
+    return ArraySequence([s.astype(np.float32) for s in streamlines])
+
+
+def test_resample_streamlines_matches_dipy():
+    streamlines = _random_streamlines()
+
+    expected = np.asarray(set_number_of_points(streamlines, 128))
+    resampled = resample_streamlines(streamlines, 128)
+
+    assert resampled.shape == expected.shape
+    assert resampled.dtype == np.float32
+    np.testing.assert_allclose(resampled, expected, atol=1e-3)
+
+
+def test_resample_directions_matches_dipy():
+    streamlines = _random_streamlines()
+
+    for nb_points in (12, 128):
+        expected = np.diff(
+            set_number_of_points(streamlines, nb_points), axis=1)
+        dirs = resample_directions(streamlines, nb_points)
+
+        assert dirs.shape == (len(streamlines), nb_points - 1, 3)
+        np.testing.assert_allclose(dirs, expected, atol=1e-3)
+
+
+def test_resample_sliced_streamlines():
+    # Slices and masks of an ArraySequence share the points of the
+    # original sequence
+    streamlines = _random_streamlines()
+
+    for subset in (streamlines[::3], streamlines[100:200],
+                   streamlines[np.arange(len(streamlines)) % 2 == 0]):
+        expected = np.asarray(set_number_of_points(subset, 128))
+        np.testing.assert_allclose(
+            resample_streamlines(subset, 128), expected, atol=1e-3)
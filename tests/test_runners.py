@@ -1,6 +1,108 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+
 def test_ttl_track(script_runner):
     # Call 'ttl_track.py' from the command line and assert that it
     # runs without errors
 
     ret = script_runner.run('predictor.py', '--help')
     assert ret.success
+
+
+def test_batch_predictor(script_runner):
+    ret = script_runner.run('batch_predictor.py', '--help')
+    assert ret.success
+
+
+def test_batch_predictor_prefetch(monkeypatch):
+    from TractOracleNet.runners import batch_predictor
+
+    events = []
+
+    class Predictor():
+        def __init__(self, subject):
+            self.tractogram = subject['tractogram']
+
+        def load_tractogram(self):
+            events.append(('load', self.tractogram))
+            return self.tractogram
+
+        def filter_tractogram(self, model, sft):
+            # Leave time for the next tractogram to be loaded
+            time.sleep(0.1)
+            events.append(('score', sft))
+            return 1, 1
+
+    monkeypatch.setattr(batch_predictor, 'load_model', lambda *args: None)
+    monkeypatch.setattr(batch_predictor.TractOracleNetBatchPredictor,
+                        '_predictor', lambda self, subject: Predictor(subject))
+    batch_predictor.TractOracleNetBatchPredictor({
+        'checkpoint': None, 'backend': 'torch', 'quantize': None,
+        'compile': False, 'batch_size': 512, 'summary': None,
+        'stream': False, 'cache': None, 'cache_size': 0, 'threshold': 0.5,
+        'exit_margin': None, 'cascade': None,
+        'subjects': [{'tractogram': str(i), 'out': 'out.trk'}
+                     for i in range(3)]}).run()
+
+    # Each tractogram is loaded while the previous one is scored
+    assert events.index(('load', '1')) < events.index(('score', '0'))
+    assert events.index(('load', '2')) < events.index(('score', '1'))
+
+
+def test_scoring_server(script_runner):
+    ret = script_runner.run('scoring_server.py', '--help')
+    assert ret.success
+
+
+def test_parse_thresholds():
+    from TractOracleNet.runners.predictor import (
+        parse_thresholds, threshold_filename)
+
+    assert parse_thresholds('0.7,0.3,0.5') == [0.3, 0.5, 0.7]
+    assert parse_thresholds('0.1:0.5:0.1') == [0.1, 0.2, 0.3, 0.4, 0.5]
+    assert threshold_filename('out.trk', 0.5) == 'out_0.5.trk'
+
+
+def test_export_onnx(script_runner):
+    ret = script_runner.run('export_onnx.py', '--help')
+    assert ret.success
+
+
+def test_quantize_model(script_runner):
+    ret = script_runner.run('quantize_model.py', '--help')
+    assert ret.success
+
+
+def test_calibrate_cascade(script_runner):
+    ret = script_runner.run('calibrate_cascade.py', '--help')
+    assert ret.success
+
+
+def test_export_slim(script_runner):
+    ret = script_runner.run('export_slim.py', '--help')
+    assert ret.success
+
+
+@pytest.mark.parametrize('module', [
+    'TractOracleNet.runners.predictor',
+    'TractOracleNet.runners.batch_predictor',
+    'TractOracleNet.runners.scoring_server',
+    'TractOracleNet.scorer'])
+def test_inference_imports(module):
+    # Packages only needed for training or for coloring streamlines are
+    # slow to import and must not be imported by the inference path.
+    # Packages imported at startup, e.g. by sitecustomize, are ignored.
+    code = ('import sys; before = set(sys.modules); import {}; '
+            'print(" ".join(set(sys.modules) - before))'.format(module))
+    imported = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True,
+        check=True).stdout.split()
+
+    for heavy in ('lightning', 'torchmetrics', 'matplotlib', 'fury',
+                  'scilpy.viz', 'scilpy.io'):
+        assert not any(m == heavy or m.startswith(heavy + '.')
+                       for m in imported), heavy
@@ -0,0 +1,52 @@
+import numpy as np
+import torch
+
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.resampling import resample_directions
+from TractOracleNet.scorer import OracleScorer, pad_streamlines
+
+
+def _scorer():
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    return OracleScorer(model, batch_size=32)
+
+
+def _random_streamlines(nb_streamlines=100, seed=0):
+    rng = np.random.default_rng(seed)
+    streamlines = [
+        np.cumsum(rng.normal(size=(rng.integers(2, 200), 3)), axis=0)
+        for _ in range(nb_streamlines)]
+    return ArraySequence([s.astype(np.float32) for s in streamlines])
+
+
+def test_features_match_numpy_resampling():
+    scorer = _scorer()
+    streamlines = _random_streamlines()
+    expected = resample_directions(streamlines, 128)
+
+    # From an ArraySequence and from padded points
+    points, lengths = pad_streamlines(streamlines)
+    for args in ((streamlines,), (points, lengths),
+                 (points.numpy(), lengths.numpy())):
+        features = scorer.features(*args)
+        np.testing.assert_allclose(features.numpy(), expected, atol=1e-3)
+
+
+def test_score_with_affine():
+    scorer = _scorer()
+    streamlines = _random_streamlines()
+    affine = np.diag([2., 2., 2., 1.])
+    affine[:3, 3] = [-90., -126., -72.]
+    rasmm = ArraySequence(
+        [s @ affine[:3, :3].T + affine[:3, 3] for s in streamlines])
+
+    with torch.no_grad():
+        expected = scorer.model(torch.as_tensor(
+            resample_directions(streamlines, 128))).numpy()
+
+    scores = scorer(rasmm, affine=np.linalg.inv(affine))
+    assert scores.shape == (len(streamlines),)
+    np.testing.assert_allclose(scores.numpy(), expected, atol=1e-4)
@@ -0,0 +1,77 @@
+import http.client
+import threading
+
+import numpy as np
+import torch
+
+from TractOracleNet.models.transformer import TransformerOracle
+from TractOracleNet.resampling import resample_directions
+from TractOracleNet.serving import (
+    OracleClient, ScoringServer, _write_arrays)
+
+
+def _random_streamlines(rng, nb_streamlines):
+    return [np.cumsum(rng.normal(size=(rng.integers(4, 100), 3)), axis=0)
+            .astype(np.float32) + 50 for _ in range(nb_streamlines)]
+
+
+def test_concurrent_clients_are_batched():
+    torch.manual_seed(0)
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    server = ScoringServer(model, max_batch_size=64, max_wait=0.05)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    client = OracleClient(port=server.port)
+    rng = np.random.default_rng(0)
+    requests = [_random_streamlines(rng, n) for n in
+                rng.integers(1, 20, 16)] + [_random_streamlines(rng, 100)]
+    results = [None] * len(requests)
+
+    def _run(i):
+        results[i] = client.score(requests[i])
+
+    try:
+        clients = [threading.Thread(target=_run, args=(i,))
+                   for i in range(len(requests))]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        stats = client.stats()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for streamlines, scores in zip(requests, results):
+        with torch.no_grad():
+            expected = model(torch.as_tensor(
+                resample_directions(streamlines, 128))).numpy()
+        np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+    nb_streamlines = sum(len(r) for r in requests)
+    assert stats['requests'] == len(requests)
+    assert stats['streamlines'] == nb_streamlines
+    # Concurrent requests share batches, and no batch is too large
+    assert stats['batches'] < len(requests)
+    assert stats['mean_batch_size'] <= 64
+
+
+def test_invalid_streamlines_are_rejected():
+    model = TransformerOracle(127 * 3, 1, 4, 2, 1e-3).eval()
+    server = ScoringServer(model)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    points = np.zeros((4, 3), dtype=np.float32)
+    try:
+        # Negative or empty streamlines, and lengths not matching the points
+        for lengths in ([6, -2], [4, 0], [3]):
+            conn = http.client.HTTPConnection('127.0.0.1', server.port)
+            conn.request('POST', '/score', _write_arrays(
+                np.asarray(lengths), points))
+            assert conn.getresponse().status == 400
+            conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
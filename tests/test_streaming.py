@@ -0,0 +1,18 @@
+import nibabel as nib
+import numpy as np
+
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from TractOracleNet.streaming import StreamingTractogramWriter
+
+
+def test_write_empty_tractogram(tmp_path):
+    reference = nib.Nifti1Image(np.zeros((64, 64, 64), dtype=np.uint8),
+                                np.eye(4))
+
+    for ext in ('trk', 'tck'):
+        filename = str(tmp_path / 'empty.{}'.format(ext))
+        with StreamingTractogramWriter(filename, reference) as writer:
+            writer.write(ArraySequence(), np.zeros(0))
+
+        assert len(nib.streamlines.load(filename).streamlines) == 0
@@ -0,0 +1,79 @@
+import nibabel as nib
+import numpy as np
+
+from dipy.io.stateful_tractogram import Origin, Space, StatefulTractogram
+from scilpy.viz.utils import get_colormap
+
+from TractOracleNet.streaming import sft_to_rasmm
+from TractOracleNet.utils import save_filtered_streamlines
+
+
+def test_save_filtered_streamlines(tmp_path):
+    rng = np.random.default_rng(0)
+    reference = nib.Nifti1Image(np.zeros((64, 64, 64), dtype=np.uint8),
+                                np.diag([2., 2., 2., 1.]))
+    streamlines = [
+        np.cumsum(rng.uniform(-1, 1, (rng.integers(2, 50), 3)), axis=0) + 64
+        for _ in range(200)]
+    sft = StatefulTractogram(streamlines, reference, Space.RASMM,
+                             origin=Origin.NIFTI)
+    scores = rng.uniform(size=len(sft))
+    mask = scores > 0.5
+    expected = sft.streamlines[mask]
+
+    for ext in ('trk', 'tck'):
+        filename = str(tmp_path / 'out.{}'.format(ext))
+        save_filtered_streamlines(sft, scores, filename, ids=mask)
+        tractogram = nib.streamlines.load(filename).tractogram
+
+        assert len(tractogram.streamlines) == np.count_nonzero(mask)
+        for s, e in zip(tractogram.streamlines, expected):
+            np.testing.assert_allclose(s, e, atol=1e-4)
+
+    # Colors are only saved in .trk files
+    color = get_colormap('jet')(scores[mask])[:, 0:3] * 255
+    saved = nib.streamlines.load(
+        str(tmp_path / 'out.trk')).tractogram.data_per_point['color']
+    np.testing.assert_allclose(
+        [c[0] for c in saved], color, atol=1e-3)
+
+
+def _sft(nb_streamlines=50):
+    rng = np.random.default_rng(0)
+    reference = nib.Nifti1Image(np.zeros((64, 64, 64), dtype=np.uint8),
+                                np.diag([2., 2., 2., 1.]))
+    streamlines = [
+        np.cumsum(rng.uniform(-1, 1, (rng.integers(2, 50), 3)), axis=0) + 64
+        for _ in range(nb_streamlines)]
+    return StatefulTractogram(streamlines, reference, Space.RASMM,
+                              origin=Origin.NIFTI)
+
+
+def test_sft_to_rasmm():
+    sft = _sft()
+    expected = sft.streamlines.copy()
+
+    for space in (Space.RASMM, Space.VOX, Space.VOXMM):
+        for origin in (Origin.NIFTI, Origin.TRACKVIS):
+            sft.to_space(space)
+            sft.to_origin(origin)
+            np.testing.assert_allclose(
+                sft_to_rasmm(sft, sft.streamlines[5:10])._data,
+                np.concatenate(list(expected[5:10])), atol=1e-4)
+
+
+def test_save_empty_selection(tmp_path):
+    sft = _sft()
+    sft.to_vox()
+    sft.to_corner()
+    points = sft.streamlines._data.copy()
+    mask = np.zeros(len(sft), dtype=bool)
+
+    for ext in ('trk', 'tck'):
+        filename = str(tmp_path / 'out.{}'.format(ext))
+        save_filtered_streamlines(sft, np.zeros(len(sft)), filename, ids=mask)
+        assert len(nib.streamlines.load(filename).streamlines) == 0
+
+    # The tractogram is not moved to RASMM space and back
+    assert sft.space == Space.VOX and sft.origin == Origin.TRACKVIS
+    assert np.array_equal(sft.streamlines._data, points)